@@ -0,0 +1,770 @@
+"""
+Benchmarks of the pipeline stages.
+
+Usage: python app/scripts/benchmark.py <benchmark> [options]
+"""
+import argparse
+import asyncio
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from playwright.async_api import async_playwright
+from utils import *
+from fakes import *
+
+
+def report(name, timings):
+    timings = sorted(timings)
+    print(
+        f"{name}: median {statistics.median(timings) * 1000:.1f}ms, "
+        f"min {timings[0] * 1000:.1f}ms, max {timings[-1] * 1000:.1f}ms over {len(timings)} runs"
+    )
+
+
+async def bench_extraction(args):
+    """Compare the per-field and the single round-trip card extraction on a saved page."""
+    if args.fixture:
+        with open(args.fixture, encoding="utf-8") as f:
+            content = f.read()
+    else:
+        content = build_search_page(args.cards, missing_fields=args.missing_fields)
+
+    datetime_now = pd.Timestamp.now().strftime("%Y-%m-%d %H:%M:%S")
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True)
+        page = await browser.new_page()
+        await page.set_content(content)
+
+        for mode in ["selectors", "evaluate"]:
+            timings = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                jobs = await extract_job_cards(page, datetime_now, mode=mode)
+                timings.append(time.perf_counter() - started)
+            report(f"{mode} ({len(jobs)} cards)", timings)
+
+        await browser.close()
+
+
+def synthetic_jobs(n_jobs, seed=0):
+    """A DataFrame of `n_jobs` raw jobs parsed from synthetic search pages."""
+    rng = random.Random(seed)
+    datetime_now = pd.Timestamp.now()
+    jobs = []
+    for i in range(n_jobs):
+        title = " ".join(rng.choice(LOREM_WORDS) for _ in range(6)).capitalize()
+        jobs.append({
+            "job_id": fake_job_id(i),
+            "job_title": title,
+            "job_description": " ".join(rng.choice(LOREM_WORDS) for _ in range(rng.randint(80, 250))),
+            "job_link": f"/jobs/{title.replace(' ', '-')}_~{fake_job_id(i)}/",
+            "job_post_date": rng.choice(POST_DATES),
+            "job_type_level": "Fixed price",
+            "job_experience_level": "Intermediate",
+            "is_fixed_price": "$500",
+            "duration_label": "1 to 3 months",
+            "datetime": datetime_now,
+        })
+    return pd.DataFrame(jobs)
+
+
+async def bench_evaluation(args):
+    """Evaluate synthetic jobs against the fake OpenAI server, then resume from the checkpoints."""
+    jobs_df = synthetic_jobs(args.jobs)
+    with tempfile.TemporaryDirectory() as staging_path, FakeOpenAIServer(
+        latency=args.latency, error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate
+    ) as server:
+        client = openai.AsyncOpenAI(base_url=server.base_url, api_key="fake", max_retries=0)
+
+        started = time.perf_counter()
+        written = await evaluate_jobs_async(
+            jobs_df, staging_path, concurrency=args.concurrency,
+            requests_per_minute=args.rpm, checkpoint_every=args.checkpoint_every, client=client
+        )
+        elapsed = time.perf_counter() - started
+        print(f"evaluation: {written} of {len(jobs_df)} jobs in {elapsed:.2f}s "
+              f"({written / elapsed:.1f} jobs/s), server counts {server.counts}")
+
+        # A second run only evaluates the jobs that are not checkpointed yet
+        done = duckdb.query(f"SELECT DISTINCT job_id FROM {read_dataset_sql(staging_path)}").to_df()
+        pending = jobs_df[~jobs_df["job_id"].isin(done["job_id"])]
+        written = await evaluate_jobs_async(pending, staging_path, client=client)
+        print(f"evaluation resume: {written} of {len(pending)} remaining jobs")
+        await client.close()
+
+
+async def bench_batch(args):
+    """Evaluate synthetic jobs through the fake Batch API and compare with the per-job engine."""
+    jobs_df = synthetic_jobs(args.jobs)
+    with tempfile.TemporaryDirectory() as batch_path, tempfile.TemporaryDirectory() as async_path, \
+            FakeOpenAIServer(latency=args.latency, batch_delay=1.0) as server:
+        client = openai.AsyncOpenAI(base_url=server.base_url, api_key="fake", max_retries=0)
+
+        started = time.perf_counter()
+        written = await evaluate_jobs_batch(jobs_df, batch_path, poll_interval=0.5, client=client)
+        print(f"batch: {written} of {len(jobs_df)} jobs in {time.perf_counter() - started:.2f}s")
+
+        started = time.perf_counter()
+        written = await evaluate_jobs_async(jobs_df, async_path, concurrency=args.concurrency,
+                                            requests_per_minute=args.rpm, client=client)
+        print(f"async: {written} of {len(jobs_df)} jobs in {time.perf_counter() - started:.2f}s")
+
+        # Both modes must agree, they share the prompt and the validation
+        agreement = duckdb.query(f"""
+            SELECT avg(CASE WHEN b.match_level = a.match_level THEN 1 ELSE 0 END)
+            FROM {read_dataset_sql(batch_path)} b
+            JOIN {read_dataset_sql(async_path)} a USING (job_id)
+        """).fetchone()[0]
+        print(f"batch/async agreement: {agreement:.1%}, server counts {server.counts}")
+        await client.close()
+
+
+async def bench_multi_eval(args):
+    """
+    Tokens per job and agreement of multi-job requests with single-job scoring, on a fixed
+    sample: the first `--jobs` jobs of `--staging-path` by job_id, or synthetic jobs.
+    With `--real` the requests go to the OpenAI API instead of the fake server, otherwise
+    `--error-rate` of the multi-job answer items are dropped or malformed.
+    """
+    if args.staging_path:
+        jobs_df = duckdb.query(f"""
+            SELECT * EXCLUDE (match_level, apply, reason, model) FROM {read_latest_sql(args.staging_path)}
+            ORDER BY job_id LIMIT {int(args.jobs)}
+        """).to_df()
+    else:
+        jobs_df = synthetic_jobs(args.jobs)
+
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as work_path, FakeOpenAIServer(
+        latency=args.latency, answer=lambda text: fake_evaluation(text, drop_rate=args.error_rate, rng=rng)
+    ) as server:
+        # Usage is read back from a metrics store of this benchmark only
+        os.environ["METRICS_PATH"] = os.path.join(work_path, "metrics.sqlite")
+        metrics = get_metrics()
+        if args.real:
+            client = openai.AsyncOpenAI(max_retries=0)
+        else:
+            client = openai.AsyncOpenAI(base_url=server.base_url, api_key="fake", max_retries=0)
+
+        for jobs_per_request in (1, args.jobs_per_request):
+            metrics.start_run(f"k{jobs_per_request}")
+            started = time.perf_counter()
+            written = await evaluate_jobs_async(
+                jobs_df, os.path.join(work_path, f"k{jobs_per_request}"), concurrency=args.concurrency,
+                requests_per_minute=args.rpm, client=client, jobs_per_request=jobs_per_request
+            )
+            elapsed = time.perf_counter() - started
+            metrics.finish_run()
+            calls, input_tokens, output_tokens, cost = metrics.conn.execute("""
+                SELECT count(*), sum(input_tokens), sum(output_tokens), sum(cost) FROM llm_usage WHERE run_id = ?
+            """, (f"k{jobs_per_request}",)).fetchone()
+            fallbacks = metrics.conn.execute(
+                "SELECT coalesce(sum(value), 0) FROM counters WHERE run_id = ? AND name = 'multi_eval_fallbacks'",
+                (f"k{jobs_per_request}",)
+            ).fetchone()[0]
+            print(
+                f"{jobs_per_request} jobs per request: {written} of {len(jobs_df)} jobs in {elapsed:.2f}s, "
+                f"{calls} requests, {input_tokens / len(jobs_df):.0f} input and {output_tokens / len(jobs_df):.0f} "
+                f"output tokens per job, ${cost:.4f}, {fallbacks} jobs retried alone"
+            )
+        await client.close()
+
+        agreement = duckdb.query(f"""
+            SELECT count(*), avg(CASE WHEN s.apply = m.apply THEN 1 ELSE 0 END),
+                   avg(abs(s.match_level - m.match_level))
+            FROM {read_dataset_sql(os.path.join(work_path, 'k1'))} s
+            JOIN {read_dataset_sql(os.path.join(work_path, f'k{args.jobs_per_request}'))} m USING (job_id)
+        """).fetchone()
+        print(f"agreement on {agreement[0]} jobs: apply {agreement[1]:.1%}, "
+              f"mean match_level difference {agreement[2]:.3f}")
+
+
+async def bench_route_filter(args):
+    """
+    Page-load time and bytes transferred with and without the route filter, on fake search
+    pages loading `--assets` images, a web font and a tracker script from another host.
+    """
+    with FakeUpworkServer(args.jobs, assets=args.assets, latency=args.page_latency) as upwork:
+        query_urls = [upwork.query_url(f"query{i}") for i in range(args.queries)]
+        max_pages = args.jobs // upwork.per_page + 2
+        # The fake tracker is served from localhost, the pages from 127.0.0.1
+        route_filters = {
+            "without filter": None,
+            "with filter": RouteFilter(blocked_domains=BLOCKED_DOMAINS + ("localhost",)),
+        }
+        for label, route_filter in route_filters.items():
+            upwork.counts.clear()
+            print(f"{label}:")
+            jobs = await scrape_queries(query_urls, max_concurrency=args.concurrency, max_pages=max_pages,
+                                        route_filter=route_filter)
+            print(f"{label}: {len(jobs)} jobs, {upwork.counts.get('assets', 0)} assets served "
+                  f"({upwork.counts.get('asset_bytes', 0) / 1e6:.2f}MB)")
+
+
+def bench_prefilter(args):
+    """
+    Replay the prefilter on the jobs of a staging dataset that the LLM evaluated and report,
+    per threshold, the LLM calls avoided and the LLM-approved jobs that would be lost.
+    """
+    jobs_df = with_descriptions(duckdb.query(f"""
+        SELECT * FROM {read_latest_sql(args.staging_path)}
+        WHERE model != 'prefilter' AND apply IS NOT NULL
+    """).to_df())
+    started = time.perf_counter()
+    scores = prefilter_scores(jobs_df)
+    print(f"prefilter: scored {len(jobs_df)} jobs in {(time.perf_counter() - started) * 1000:.1f}ms")
+
+    approved = jobs_df["apply"].astype(bool)
+    for threshold in range(0, 6):
+        rejected = scores < threshold
+        print(
+            f"threshold {threshold}: {rejected.sum()} calls avoided ({rejected.mean():.1%}), "
+            f"{(rejected & approved).sum()} of {approved.sum()} approved jobs lost"
+        )
+
+
+def perturb_job(row, rng, edit_rate=0.05):
+    """A repost of a job: new job_id, a few words of the description replaced."""
+    words = row["job_description"].split()
+    for i in range(len(words)):
+        if rng.random() < edit_rate:
+            words[i] = rng.choice(LOREM_WORDS)
+    return {**row, "job_id": f"repost{row['job_id']}", "job_description": " ".join(words)}
+
+
+def bench_reposts(args):
+    """
+    Index histories of growing size and report the repost lookup time per new job, which
+    must stay flat, and the recall and false positives of the detection on new jobs that
+    are half reposts with `--edit-rate` of their words edited, at `--repost-threshold`.
+    The same is reported for near-duplicates inside one batch of new jobs (hold_duplicates).
+    """
+    rng = random.Random(0)
+
+    def report(label, jobs_df, detected):
+        is_repost = jobs_df["job_id"].str.startswith("repost").to_numpy()
+        detected = jobs_df.index.isin(list(detected))
+        return (
+            f"{label}: recall {(detected & is_repost).sum()} of {is_repost.sum()} "
+            f"({(detected & is_repost).sum() / max(1, is_repost.sum()):.1%}), "
+            f"{(detected & ~is_repost).sum()} false positives of {(~is_repost).sum()} new jobs"
+        )
+
+    for size in [int(size) for size in args.sizes.split(",")]:
+        history_df = synthetic_jobs(size, seed=1)
+        new_df = pd.concat([
+            pd.DataFrame([
+                perturb_job(row, rng, args.edit_rate)
+                for row in history_df.sample(args.jobs // 2, random_state=0).to_dict("records")
+            ]),
+            synthetic_jobs(args.jobs - args.jobs // 2, seed=2).assign(job_id=lambda df: "new" + df["job_id"]),
+        ], ignore_index=True)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            index = RepostIndex(os.path.join(tmp, "reposts.sqlite"), threshold=args.repost_threshold)
+            results = {i: {"match_level": 0.5, "apply": False, "reason": "", "model": "fake"} for i in history_df.index}
+            started = time.perf_counter()
+            index.put_many(history_df, results)
+            index_seconds = time.perf_counter() - started
+
+            timings = []
+            found = {}
+            for i, row in new_df.iterrows():
+                started = time.perf_counter()
+                found.update(index.find_many(new_df.loc[[i]]))
+                timings.append(time.perf_counter() - started)
+            index.close()
+
+        print(
+            f"history {size}: indexed in {index_seconds:.1f}s, "
+            f"lookup p50 {statistics.median(timings) * 1000:.2f}ms, "
+            f"p95 {sorted(timings)[int(len(timings) * 0.95)] * 1000:.2f}ms, "
+            + report("reposts", new_df, found)
+        )
+
+    # Reposts of jobs of the same batch, before any of them is evaluated
+    batch_df = synthetic_jobs(args.jobs - args.jobs // 2, seed=3)
+    batch_df = pd.concat([
+        batch_df,
+        pd.DataFrame([perturb_job(row, rng, args.edit_rate) for row in batch_df.head(args.jobs // 2).to_dict("records")]),
+    ], ignore_index=True)
+    with tempfile.TemporaryDirectory() as tmp:
+        index = RepostIndex(os.path.join(tmp, "reposts.sqlite"), threshold=args.repost_threshold)
+        kept = index.hold_duplicates(batch_df)
+        index.close()
+    print(report("same batch", batch_df, batch_df.index.difference(kept.index)))
+
+
+def bench_post_dates(args):
+    """Row-wise get_posted_datetime against the vectorized parse_posted_dates."""
+    rng = random.Random(0)
+    texts = [
+        "Posted today", "Posted yesterday", "Posted last week", "Posted last month",
+        "Posted 1 second ago", "Posted 45 minutes ago", "Posted 3 hours ago", "Posted 2 days ago",
+        "Posted 2 weeks ago", "Posted 5 months ago",
+    ]
+    df = pd.DataFrame({
+        "datetime": pd.Timestamp.now().floor("s"),
+        "job_post_date": [rng.choice(texts) for _ in range(args.rows)],
+    })
+
+    started = time.perf_counter()
+    rowwise = df.apply(lambda row: get_posted_datetime(row["datetime"], row["job_post_date"]), axis=1)
+    rowwise_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    vectorized, n_unrecognized = parse_posted_dates(df["datetime"], df["job_post_date"])
+    vectorized_seconds = time.perf_counter() - started
+
+    same = (pd.to_datetime(rowwise) == vectorized).all()
+    print(f"row-wise: {rowwise_seconds * 1000:.1f}ms, vectorized: {vectorized_seconds * 1000:.1f}ms "
+          f"({rowwise_seconds / vectorized_seconds:.1f}x) on {len(df)} rows, identical results: {same}, "
+          f"unrecognized: {n_unrecognized}")
+
+
+def write_synthetic_staging(staging_path, n_rows, n_files=10, seed=0, start_date=None, days=1):
+    """Synthetic staging dataset of `n_rows` rows spread over `n_files` files and `days` scrape dates."""
+    rng = random.Random(seed)
+    descriptions = [" ".join(rng.choice(LOREM_WORDS) for _ in range(40)) for _ in range(1000)]
+    start_date = start_date or pd.Timestamp.now().floor("D") - pd.Timedelta(days=days - 1)
+    rows_per_file = n_rows // n_files
+    for f in range(n_files):
+        ids = range(f * rows_per_file, (f + 1) * rows_per_file)
+        df = pd.DataFrame({
+            "job_id": [fake_job_id(i) for i in ids],
+            "job_title": [f"Job {i}" for i in ids],
+            "job_description": [descriptions[i % len(descriptions)] for i in ids],
+            "job_link": [f"http://www.upwork.com/jobs/~{fake_job_id(i)}/" for i in ids],
+            "job_post_date": "Posted 2 hours ago",
+            "job_type_level": "Fixed price",
+            "job_experience_level": "Intermediate",
+            "is_fixed_price": "$500",
+            "duration_label": "1 to 3 months",
+            "datetime": [start_date + pd.Timedelta(days=i % days, minutes=i % 1440) for i in ids],
+            "match_level": [rng.random() for _ in ids],
+            "apply": [rng.random() < 0.3 for _ in ids],
+            "reason": "Synthetic",
+            "model": "synthetic",
+        })
+        append_dataset(df, staging_path, STAGING_SCHEMA, "staging")
+
+
+def bench_unsent(args):
+    """Unsent job selection: pandas load + isin against the DuckDB anti-join stream."""
+    with tempfile.TemporaryDirectory() as staging_path, tempfile.TemporaryDirectory() as sent_path:
+        started = time.perf_counter()
+        write_synthetic_staging(staging_path, args.rows)
+        sent_ids = duckdb.query(f"""
+            SELECT job_id FROM {read_dataset_sql(staging_path)} WHERE apply AND random() < 0.8
+        """).to_df()
+        sent_ids.to_csv(sent_ledger_path(sent_path), index=False)
+        print(f"setup: {args.rows} staging rows, {len(sent_ids)} sent in {time.perf_counter() - started:.1f}s")
+
+        # Previous implementation of send_jobs + run_core
+        started = time.perf_counter()
+        job_df = duckdb.query(f"""
+            SELECT * FROM {read_dataset_sql(staging_path)} WHERE apply = TRUE ORDER BY match_level;
+        """).to_df()
+        # job_ids are zero-prefixed strings, as the previous code compared them
+        already_sent_ids = pd.read_csv(sent_ledger_path(sent_path), dtype={"job_id": str})['job_id'].tolist()
+        job_df = job_df[job_df["job_id"].isin(already_sent_ids) == False]
+        pandas_seconds = time.perf_counter() - started
+        n_pandas = len(job_df)
+        del job_df, already_sent_ids
+
+        started = time.perf_counter()
+        first_row = None
+        n_jobs = 0
+        for _ in iter_unsent_jobs(staging_path, sent_path):
+            n_jobs += 1
+            if first_row is None:
+                first_row = time.perf_counter() - started
+        duckdb_seconds = time.perf_counter() - started
+
+        # Both sides must select the same jobs for the timings to compare
+        assert n_pandas == n_jobs, f"pandas isin selected {n_pandas} jobs, the DuckDB anti-join {n_jobs}"
+        print(f"pandas isin: {n_pandas} jobs in {pandas_seconds:.2f}s")
+        print(f"duckdb anti-join stream: {n_jobs} jobs in {duckdb_seconds:.2f}s "
+              f"(first row after {first_row or 0:.2f}s)")
+
+
+def bench_partitions(args):
+    """
+    send_jobs selection over a year of synthetic staging history, partitioned by scrape date:
+    every partition against the last `--window-days` days, before and after compaction.
+    """
+    with tempfile.TemporaryDirectory() as staging_path, tempfile.TemporaryDirectory() as sent_path:
+        started = time.perf_counter()
+        write_synthetic_staging(staging_path, args.rows, days=365)
+        sent_ids = duckdb.query(f"""
+            SELECT job_id FROM {read_dataset_sql(staging_path)} WHERE apply AND random() < 0.8
+        """).to_df()
+        sent_ids.to_csv(sent_ledger_path(sent_path), index=False)
+        print(f"setup: {args.rows} staging rows in {len(partition_dates(staging_path))} partitions, "
+              f"{len(dataset_files(staging_path))} files in {time.perf_counter() - started:.1f}s")
+
+        for layout in ("small files", "compacted"):
+            if layout == "compacted":
+                compact_dataset(staging_path, STAGING_SCHEMA, "staging")
+            for label, window_days in (("all history", None), (f"last {args.window_days} days", args.window_days)):
+                timings = []
+                for _ in range(args.repeat):
+                    started = time.perf_counter()
+                    n_jobs = sum(1 for _ in iter_unsent_jobs(staging_path, sent_path, window_days=window_days))
+                    timings.append(time.perf_counter() - started)
+                report(f"{layout}, {label} ({n_jobs} jobs)", timings)
+
+
+def bench_descriptions(args):
+    """
+    Disk footprint and read time of a synthetic history of `--rows` jobs with the descriptions
+    inline in raw, staging and the sent ledger, as written before the text store, then after
+    `main.py compact` moved them to the text store and slimmed the ledger.
+    """
+    with tempfile.TemporaryDirectory() as work_path:
+        raw_path, staging_path, sent_path = (os.path.join(work_path, name) for name in ("raw", "staging", "sent"))
+        # Read by get_text_store on first use
+        os.environ["TEXT_STORE_PATH"] = os.path.join(work_path, "texts.sqlite")
+
+        started = time.perf_counter()
+        rng = random.Random(0)
+        jobs_df = synthetic_jobs(args.rows)
+        staging_df = jobs_df.assign(
+            match_level=[rng.random() for _ in range(len(jobs_df))],
+            apply=[rng.random() < 0.3 for _ in range(len(jobs_df))],
+            reason="Synthetic", model="synthetic",
+        )
+        for df, path, schema, prefix in ((jobs_df, raw_path, RAW_SCHEMA, "raw"), (staging_df, staging_path, STAGING_SCHEMA, "staging")):
+            for rows in np.array_split(np.arange(len(df)), 20):
+                table = conform_table(pa.Table.from_pandas(df.iloc[rows], preserve_index=False), schema)
+                write_dataset_file(table, path, prefix)
+        os.makedirs(sent_path)
+        staging_df[staging_df["apply"]].sample(frac=0.8, random_state=0).to_csv(sent_ledger_path(sent_path), index=False)
+        print(f"setup: {args.rows} jobs in {time.perf_counter() - started:.1f}s")
+
+        def measure(layout):
+            sizes = {
+                "raw": directory_bytes(raw_path),
+                "staging": directory_bytes(staging_path),
+                "sent ledger": os.path.getsize(sent_ledger_path(sent_path)),
+                "text store": os.path.getsize(os.environ["TEXT_STORE_PATH"]) if os.path.exists(os.environ["TEXT_STORE_PATH"]) else 0,
+            }
+            print(f"{layout}: {sum(sizes.values()) / 1e6:.1f}MB on disk (" +
+                  ", ".join(f"{name} {size / 1e6:.1f}MB" for name, size in sizes.items()) + ")")
+
+            timings = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                n_chars = sum(len(job_description(row)) for row in iter_unsent_jobs(staging_path, sent_path))
+                timings.append(time.perf_counter() - started)
+            report(f"{layout}, unsent jobs with their descriptions ({n_chars / 1e6:.1f}M characters)", timings)
+
+        measure("inline descriptions")
+        compact_dataset(raw_path, RAW_SCHEMA, "raw")
+        compact_dataset(staging_path, STAGING_SCHEMA, "staging")
+        compact_ledger(sent_ledger_path(sent_path))
+        measure("text store")
+
+
+def bench_workers(args):
+    """
+    main.py (scrape, then evaluate) in several processes sharing one data directory, for each
+    of `--workers` worker counts, against the fake Upwork and OpenAI servers. Reports the
+    throughput against the first count, the pages fetched and the jobs evaluated twice.
+    Use enough `--queries` for every worker to lease some.
+    """
+    main_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+    n_queries = max(1, args.queries)
+    jobs_per_query = -(-args.jobs // n_queries)
+    first = None
+    for n_workers in [int(n) for n in args.workers.split(",")]:
+        with tempfile.TemporaryDirectory() as data_path, \
+                FakeUpworkServer(jobs_per_query, latency=args.page_latency) as upwork, \
+                FakeOpenAIServer(latency=args.latency, error_rate=args.error_rate,
+                                 rate_limit_rate=args.rate_limit_rate) as openai_server:
+            env = {
+                **os.environ,
+                "RAW_PATH": os.path.join(data_path, "raw"),
+                "STAGING_PATH": os.path.join(data_path, "staging"),
+                "SENT_PATH": os.path.join(data_path, "sent"),
+                "APPLIED_PATH": os.path.join(data_path, "applied"),
+                "METRICS_PATH": os.path.join(data_path, "logs", "metrics.sqlite"),
+                "QUERY_URLS": " ".join(upwork.query_url(f"query{i}") for i in range(n_queries)),
+                "SCRAPE_MAX_PAGES": str(jobs_per_query // upwork.per_page + 2),
+                "OPENAI_BASE_URL": openai_server.base_url,
+                "OPENAI_API_KEY": "fake",
+                "EVAL_CONCURRENCY": str(args.concurrency),
+                "EVAL_REQUESTS_PER_MINUTE": str(args.rpm),
+                "EVAL_TOKENS_PER_MINUTE": "1000000000",
+                # Every worker evaluates its claims right away, through the async path
+                "EVAL_BATCH_THRESHOLD": "1000000000",
+                "LEASE_TTL": "30",
+            }
+            started = time.monotonic()
+            # Run from the data directory, so no .env of the repository is loaded
+            processes = [
+                subprocess.Popen([sys.executable, main_script], env={**env, "WORKER_ID": f"worker{i}"},
+                                 cwd=data_path, stdout=subprocess.DEVNULL)
+                for i in range(n_workers)
+            ]
+            failed = sum(process.wait() != 0 for process in processes)
+            elapsed = time.monotonic() - started
+
+            n_staged, n_rows = duckdb.query(f"""
+                SELECT count(DISTINCT job_id), count(*) FROM {read_dataset_sql(env['STAGING_PATH'])}
+            """).fetchone()
+            throughput = n_staged / elapsed
+            first = first or (n_workers, throughput)
+            print(
+                f"{n_workers} workers: {n_staged} jobs staged in {elapsed:.1f}s ({throughput:.1f} jobs/s, "
+                f"x{throughput / first[1]:.2f} against {first[0]}), {upwork.counts.get('pages', 0)} pages, "
+                f"{openai_server.counts.get('responses', 0)} LLM responses, {n_rows - n_staged} jobs staged twice"
+                + (f", {failed} workers failed" if failed else "")
+            )
+
+
+def bench_views(args):
+    """
+    Memory held for the buttons of `--sent` sent jobs: one pandas row per job, as the views
+    used to keep, against custom_ids only, plus the staging lookup done on each click.
+    """
+    with tempfile.TemporaryDirectory() as staging_path:
+        write_synthetic_staging(staging_path, args.sent)
+        jobs_df = duckdb.query(f"SELECT * FROM {read_dataset_sql(staging_path)}").to_df()
+
+        tracemalloc.start()
+        rows = [row for _, row in jobs_df.iterrows()]
+        held, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"rows in views: {held / 1e6:.1f}MB for {len(rows)} sent jobs ({held / len(rows):.0f}B per job)")
+        del rows
+
+        tracemalloc.start()
+        custom_ids = [f"job:{action}:0:{job_id}" for job_id in jobs_df["job_id"] for action in ("apply", "skip")]
+        held, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        # The custom_ids live in the Discord messages, the bot only builds them while sending
+        print(f"custom_ids: {held / 1e6:.1f}MB if all were kept ({held / args.sent:.0f}B per job), 0B retained")
+        del custom_ids
+
+        job_ids = jobs_df["job_id"].sample(args.repeat, random_state=0).tolist()
+        timings = []
+        for job_id in job_ids:
+            started = time.perf_counter()
+            assert get_staged_job(staging_path, job_id) is not None
+            timings.append(time.perf_counter() - started)
+        report("click lookup", timings)
+
+
+# Metrics where a lower value is the regression, every other compared metric is a cost
+E2E_HIGHER_IS_BETTER = ("jobs_per_second", "sent_per_second")
+
+
+def directory_bytes(path):
+    return sum(
+        os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names
+    )
+
+
+def run_e2e(args):
+    """
+    One offline run of the bot's pipeline (scrape -> evaluate -> send) for `--jobs` jobs,
+    against the fake Upwork, OpenAI and Discord stand-ins. Returns the measured metrics.
+    """
+    n_queries = max(1, args.queries)
+    jobs_per_query = -(-args.jobs // n_queries)
+    fixture = None
+    if args.fixture:
+        with open(args.fixture, encoding="utf-8") as f:
+            fixture = f.read()
+
+    with tempfile.TemporaryDirectory() as data_path, \
+            FakeUpworkServer(jobs_per_query, fixture=fixture, latency=args.page_latency) as upwork, \
+            FakeOpenAIServer(latency=args.latency, error_rate=args.error_rate,
+                             rate_limit_rate=args.rate_limit_rate) as openai_server:
+        os.environ.update({
+            "RAW_PATH": os.path.join(data_path, "raw"),
+            "STAGING_PATH": os.path.join(data_path, "staging"),
+            "SENT_PATH": os.path.join(data_path, "sent"),
+            "APPLIED_PATH": os.path.join(data_path, "applied"),
+            "LOG_PATH": os.path.join(data_path, "logs", "pipeline.log"),
+            "METRICS_PATH": os.path.join(data_path, "logs", "metrics.sqlite"),
+            "QUERY_URLS": " ".join(upwork.query_url(f"query{i}") for i in range(n_queries)),
+            "SCRAPE_MAX_PAGES": str(jobs_per_query // upwork.per_page + 2),
+            "OPENAI_BASE_URL": openai_server.base_url,
+            "OPENAI_API_KEY": "fake",
+            "EVAL_CONCURRENCY": str(args.concurrency),
+            "EVAL_REQUESTS_PER_MINUTE": str(args.rpm),
+            "EVAL_TOKENS_PER_MINUTE": "1000000000",
+            "PIPELINE_MODE": "inprocess",
+            # Cover letters are streamed, which the fake server does not do
+            "PREGEN_MIN_MATCH": "2",
+            "EMBEDS_PER_MESSAGE": str(args.embeds_per_message),
+            "DISCORD_MESSAGES_PER_WINDOW": "5",
+            "DISCORD_WINDOW_SECONDS": str(5 / args.discord_rate),
+        })
+        # Settings are read when the bot module is imported
+        sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+        import bot
+
+        channel = FakeDiscordChannel(rate_limit=5, per=5 / args.discord_rate)
+        started = time.monotonic()
+        asyncio.run(bot.run_core(channel))
+        elapsed = time.monotonic() - started
+
+        n_staged = duckdb.query(
+            f"SELECT count(DISTINCT job_id) FROM {read_dataset_sql(os.environ['STAGING_PATH'])}"
+        ).fetchone()[0]
+        n_sent = channel.counts.get("embeds", 0)
+        first_notification = min((m.created_at for m in channel.messages if m.embeds), default=None)
+        result = {
+            "n_jobs": args.jobs,
+            "n_staged": n_staged,
+            "n_sent": n_sent,
+            "n_pages": upwork.counts.get("pages", 0),
+            "n_discord_429": channel.counts.get("429", 0),
+            "n_discord_400": channel.counts.get("400", 0),
+            "seconds": elapsed,
+            "jobs_per_second": n_staged / elapsed,
+            "sent_per_second": n_sent / elapsed,
+            "first_notification_seconds": first_notification - started if first_notification else None,
+            # ru_maxrss is in kilobytes on Linux
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            "bytes_written": directory_bytes(data_path),
+        }
+        for stage, row in bot.get_metrics().summary(last_runs=1)["stages"].iterrows():
+            result[f"{stage}_p50"] = row["p50"]
+            result[f"{stage}_p95"] = row["p95"]
+        return result
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """Print every metric against the baseline and return the regressions past `tolerance`."""
+    regressions = []
+    for size, metrics in results.items():
+        for name, value in metrics.items():
+            base = baseline.get(size, {}).get(name)
+            if name.startswith("n_") or not base or value is None:
+                continue
+            change = (value - base) / base
+            worse = -change if name in E2E_HIGHER_IS_BETTER else change
+            flag = "  REGRESSION" if worse > tolerance else ""
+            print(f"{size:>7} {name:<32} {base:>12.3f} -> {value:>12.3f} ({change:+.1%}){flag}")
+            if flag:
+                regressions.append((size, name))
+    return regressions
+
+
+def bench_e2e(args):
+    """
+    Offline end-to-end runs at each of `--sizes` jobs, each in its own process so peak RSS
+    is per size. Results are compared with `--baseline` and saved with `--save-baseline`.
+    Exits with status 1 when a metric regressed by more than `--tolerance`.
+    """
+    results = {}
+    for size in [int(size) for size in args.sizes.split(",")]:
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+            result_file = f.name
+        command = [sys.executable, os.path.abspath(__file__), "e2e-run", *sys.argv[2:],
+                   "--jobs", str(size), "--result-file", result_file]
+        print(f"e2e: {size} jobs...")
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+        with open(result_file, encoding="utf-8") as f:
+            results[str(size)] = json.load(f)
+        os.remove(result_file)
+        metrics = results[str(size)]
+        print(
+            f"e2e: {size} jobs, {metrics['n_staged']} staged and {metrics['n_sent']} sent in {metrics['seconds']:.1f}s, "
+            f"{metrics['jobs_per_second']:.1f} jobs/s, peak RSS {metrics['peak_rss_mb']:.0f}MB, "
+            f"{metrics['bytes_written'] / 1e6:.1f}MB written"
+        )
+        for name, value in metrics.items():
+            if name.endswith("_p50"):
+                stage = name[:-4]
+                print(f"    {stage:<20} p50 {value:.3f}s  p95 {metrics[f'{stage}_p95']:.3f}s")
+
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare_to_baseline(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"e2e: {len(regressions)} regressions past {args.tolerance:.0%}.")
+            sys.exit(1)
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+def bench_e2e_run(args):
+    """Single size of the e2e benchmark, run by bench_e2e in a child process."""
+    result = run_e2e(args)
+    with open(args.result_file, "w", encoding="utf-8") as f:
+        json.dump(result, f)
+
+
+BENCHMARKS = {
+    "extraction": bench_extraction,
+    "evaluation": bench_evaluation,
+    "batch": bench_batch,
+    "prefilter": bench_prefilter,
+    "post-dates": bench_post_dates,
+    "unsent": bench_unsent,
+    "partitions": bench_partitions,
+    "descriptions": bench_descriptions,
+    "workers": bench_workers,
+    "multi-eval": bench_multi_eval,
+    "views": bench_views,
+    "route-filter": bench_route_filter,
+    "reposts": bench_reposts,
+    "e2e": bench_e2e,
+    "e2e-run": bench_e2e_run,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pipeline benchmarks")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--cards", type=int, default=50, help="cards on the synthetic search page")
+    parser.add_argument("--fixture", help="saved search results HTML, replaces the synthetic page")
+    parser.add_argument("--missing-fields", action="store_true", help="drop optional fields from some cards")
+    parser.add_argument("--jobs", type=int, default=500, help="number of synthetic jobs")
+    parser.add_argument("--edit-rate", type=float, default=0.05, help="share of the words edited in a repost")
+    parser.add_argument("--repost-threshold", type=float, default=0.6,
+                        help="minimum similarity of a repost")
+    parser.add_argument("--latency", type=float, default=0.2, help="fake OpenAI latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.02, help="fake OpenAI 5xx rate")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.05, help="fake OpenAI 429 rate")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rpm", type=int, default=5000, help="requests per minute limit")
+    parser.add_argument("--checkpoint-every", type=int, default=20)
+    parser.add_argument("--jobs-per-request", type=int, default=10, help="jobs per multi-job evaluation request")
+    parser.add_argument("--real", action="store_true", help="use the OpenAI API instead of the fake server")
+    parser.add_argument("--rows", type=int, default=100_000, help="rows of the synthetic dataset (use 1000000 for unsent)")
+    parser.add_argument("--window-days", type=int, default=14, help="read window of the partitions benchmark")
+    parser.add_argument("--sent", type=int, default=50_000, help="sent jobs for the views benchmark")
+    parser.add_argument("--staging-path", default=os.getenv("STAGING_PATH"), help="staging dataset to replay")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="job counts of the e2e runs")
+    parser.add_argument("--queries", type=int, default=3, help="fake Upwork queries of the e2e runs")
+    parser.add_argument("--assets", type=int, default=20, help="images per fake search page")
+    parser.add_argument("--page-latency", type=float, default=0.0, help="fake Upwork latency in seconds")
+    parser.add_argument("--embeds-per-message", type=int, default=10)
+    parser.add_argument("--workers", default="1,2,4", help="worker process counts of the workers benchmark")
+    parser.add_argument("--discord-rate", type=float, default=1.0, help="Discord messages per second")
+    parser.add_argument("--baseline", help="e2e results to compare with")
+    parser.add_argument("--save-baseline", help="write the e2e results to this file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="relative change reported as a regression")
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    result = BENCHMARKS[args.benchmark](args)
+    if asyncio.iscoroutine(result):
+        asyncio.run(result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Settings shared by main.py and bot.py, read from the environment (.env).
+"""
+import os
+from dotenv import load_dotenv
+
+load_dotenv(dotenv_path=".env")
+
+
+def env_list(name):
+    value = os.getenv(name)
+    return [item.strip() for item in value.split(",") if item.strip()] if value else None
+
+
+SCRAPE_CONCURRENCY = int(os.getenv("SCRAPE_CONCURRENCY", "3"))
+
+# Options of get_upwork_jobs and stream_pipeline: result pages followed per query until its
+# watermark, and bounds of the poll interval adapted to each query's rate of new jobs
+SCRAPE_OPTIONS = dict(
+    max_concurrency=SCRAPE_CONCURRENCY,
+    max_pages=int(os.getenv("SCRAPE_MAX_PAGES", "5")),
+    poll_min_interval=int(os.getenv("POLL_MIN_INTERVAL", "600")),
+    poll_max_interval=int(os.getenv("POLL_MAX_INTERVAL", "21600")),
+    poll_target_new_jobs=int(os.getenv("POLL_TARGET_NEW_JOBS", "20")),
+    # Requests aborted by the browser: resource types and domains, SCRAPE_ROUTE_FILTER=0 turns it off
+    route_filter=os.getenv("SCRAPE_ROUTE_FILTER", "1") != "0",
+    block_resource_types=env_list("SCRAPE_BLOCK_RESOURCE_TYPES"),
+    allowed_domains=env_list("SCRAPE_ALLOWED_DOMAINS"),
+    blocked_domains=env_list("SCRAPE_BLOCKED_DOMAINS"),
+)
+
+# Replace with your query URLs, they are all scraped with a single browser.
+# QUERY_URLS in the environment (separated by whitespace) takes precedence.
+# They are always loaded with sort=recency, the watermarks need the newest jobs first.
+QUERY_URLS = os.getenv("QUERY_URLS", "").split() or [
+    "https://www.upwork.com/nx/search/jobs/?amount=100-499,500-999,1000-4999,5000-&q=statistics&t=0,1&page=1&per_page=50",
+    "https://www.upwork.com/nx/search/jobs/?amount=100-499,500-999,1000-4999,5000-&per_page=50&q=data%20analyst&t=0,1",
+    "https://www.upwork.com/nx/search/jobs/?amount=100-499,500-999,1000-4999,5000-&per_page=50&q=data%20scientist&t=0,1",
+]
+
+# Raw and staging are partitioned by scrape date. Reads only cover the last DATA_WINDOW_DAYS
+# days (0 reads all history), `main.py retention` drops or archives partitions older than
+# RETENTION_DAYS. Keep the window shorter than the retention, or dropped jobs look pending.
+DATA_WINDOW_DAYS = int(os.getenv("DATA_WINDOW_DAYS", "14")) or None
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "90"))
+ARCHIVE_PATH = os.getenv("ARCHIVE_PATH")
+
+# Options of staging_jobs and stream_pipeline
+STAGING_OPTIONS = dict(
+    batch_threshold=int(os.getenv("EVAL_BATCH_THRESHOLD", "200")),
+    batch_poll_interval=int(os.getenv("EVAL_BATCH_POLL_INTERVAL", "30")),
+    cache_path=os.getenv("EVAL_CACHE_PATH"),
+    cache_max_entries=int(os.getenv("EVAL_CACHE_MAX_ENTRIES", "50000")),
+    cache_max_age_days=int(os.getenv("EVAL_CACHE_MAX_AGE_DAYS", "30")),
+    prefilter_threshold=float(os.getenv("PREFILTER_THRESHOLD", "1")),
+    prefilter_include_terms=env_list("PREFILTER_INCLUDE_TERMS"),
+    prefilter_exclude_terms=env_list("PREFILTER_EXCLUDE_TERMS"),
+    repost_index_path=os.getenv("REPOST_INDEX_PATH"),
+    # 0 disables the repost detection. With word 2-gram signatures, reposts with 5% of
+    # their words edited score about 0.85 and unrelated jobs below 0.2 (benchmark.py reposts)
+    repost_threshold=float(os.getenv("REPOST_THRESHOLD", "0.6")) or None,
+    window_days=DATA_WINDOW_DAYS,
+    concurrency=int(os.getenv("EVAL_CONCURRENCY", "8")),
+    requests_per_minute=int(os.getenv("EVAL_REQUESTS_PER_MINUTE", "500")),
+    tokens_per_minute=int(os.getenv("EVAL_TOKENS_PER_MINUTE", "200000")),
+    checkpoint_every=int(os.getenv("EVAL_CHECKPOINT_EVERY", "20")),
+    jobs_per_request=int(os.getenv("EVAL_JOBS_PER_REQUEST", "1")),
+)
+
+# 'inprocess' streams scrape -> evaluate -> send inside the bot, 'subprocess' runs main.py
+PIPELINE_MODE = os.getenv("PIPELINE_MODE", "inprocess")
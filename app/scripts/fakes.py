@@ -0,0 +1,546 @@
+"""
+Local stand-ins for the external services used by the pipeline.
+They are only used by benchmark.py and for offline runs.
+"""
+import asyncio
+import collections
+import hashlib
+import html
+import json
+import random
+import re
+import threading
+import time
+import uuid
+import email.policy
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+LOREM_WORDS = (
+    "data analysis python dashboard machine learning model statistics report sql "
+    "pipeline automation scraping forecast regression client business insights "
+    "visualization excel cleaning experiment survey marketing product team website "
+    "design logo video content writer translation mobile app wordpress shopify"
+).split()
+
+POST_DATES = [
+    "Posted 5 minutes ago", "Posted 2 hours ago", "Posted yesterday",
+    "Posted 3 days ago", "Posted last week", "Posted 2 weeks ago",
+]
+
+
+def fake_job_id(i):
+    return f"0{10**17 + i}"
+
+
+def build_job_card(i, rng, missing_fields=False):
+    """HTML of one job card, with the same structure as the Upwork search results."""
+    title = " ".join(rng.choice(LOREM_WORDS) for _ in range(6)).capitalize()
+    description = " ".join(rng.choice(LOREM_WORDS) for _ in range(rng.randint(80, 250)))
+    post_date = rng.choice(POST_DATES)
+    job_id = fake_job_id(i)
+
+    optional = [
+        '<li data-test="job-type-label"><strong>Fixed price</strong></li>',
+        '<li data-test="experience-level"><strong>Intermediate</strong></li>',
+        '<li data-test="is-fixed-price"><strong>$500</strong></li>',
+        '<li data-test="duration-label"><strong>1 to 3 months</strong></li>',
+    ]
+    if missing_fields:
+        optional = [li for li in optional if rng.random() > 0.5]
+        post_date_html = "" if rng.random() > 0.5 else f'<small class="text-light">{post_date}</small>'
+        description_html = "" if rng.random() > 0.5 else f"<p>{html.escape(description)}</p>"
+    else:
+        post_date_html = f'<small class="text-light">{post_date}</small>'
+        description_html = f"<p>{html.escape(description)}</p>"
+
+    return (
+        f'<article class="job-tile cursor-pointer" data-ev-job-uid="{job_id}">'
+        f'{post_date_html}'
+        f'<h2 class="job-tile-title"><a href="/jobs/{html.escape(title.replace(" ", "-"))}_~{job_id}/?referrer_url_path=/nx/search/jobs/">'
+        f'{html.escape(title)}</a></h2>'
+        f'<ul class="job-tile-info-list">{"".join(optional)}</ul>'
+        f'{description_html}'
+        '</article>'
+    )
+
+
+def build_search_page(n_cards=50, start=0, seed=0, missing_fields=False):
+    """A synthetic search results page with `n_cards` job cards, ids starting at `start`."""
+    rng = random.Random(seed + start)
+    cards = "".join(build_job_card(start + i, rng, missing_fields) for i in range(n_cards))
+    return (
+        "<!DOCTYPE html><html><head><title>Upwork search</title></head><body>"
+        f'<section class="card-list-container">{cards}</section>'
+        "</body></html>"
+    )
+
+
+# Fields of one job post in an evaluation prompt, up to the next section
+JOB_POST_PATTERN = re.compile(r"## Job Post[^\n]*\n(.*?)\n\n(?=## )", re.S)
+JOB_ID_PATTERN = re.compile(r"^- Job ID: (.*)\n", re.M)
+
+
+def fake_job_evaluation(job_post):
+    """Deterministic evaluation of one job post, derived from its fields without the Job ID."""
+    digest = int(hashlib.sha256(JOB_ID_PATTERN.sub("", job_post).encode("utf-8")).hexdigest()[:8], 16)
+    match_level = round((digest % 1000) / 1000, 3)
+    return {
+        "match_level": match_level,
+        "apply": match_level >= 0.7,
+        "reason": f"Fake evaluation with match level {match_level}.",
+    }
+
+
+def fake_evaluation(text, drop_rate=0.0, rng=None):
+    """
+    Deterministic evaluation answer of a single or multi-job prompt: one JSON object, or a
+    JSON array with an item per Job ID. With `drop_rate`, array items are left out or
+    malformed at random, to exercise the per-item validation.
+    """
+    job_posts = JOB_POST_PATTERN.findall(text)
+    if not any(JOB_ID_PATTERN.search(job_post) for job_post in job_posts):
+        return json.dumps(fake_job_evaluation(job_posts[0] if job_posts else text))
+
+    rng = rng or random.Random(0)
+    items = []
+    for job_post in job_posts:
+        item = {"job_id": JOB_ID_PATTERN.search(job_post).group(1), **fake_job_evaluation(job_post)}
+        draw = rng.random()
+        if draw < drop_rate / 2:
+            continue
+        if draw < drop_rate:
+            item["match_level"] = "high"
+        items.append(item)
+    return json.dumps(items)
+
+
+def fake_response(model, text, input_tokens):
+    """Body of a Responses API answer with a single output_text item."""
+    return {
+        "id": f"resp_{uuid.uuid4().hex}",
+        "object": "response",
+        "created_at": int(time.time()),
+        "status": "completed",
+        "model": model,
+        "output": [{
+            "type": "message",
+            "id": f"msg_{uuid.uuid4().hex}",
+            "status": "completed",
+            "role": "assistant",
+            "content": [{"type": "output_text", "text": text, "annotations": []}],
+        }],
+        "parallel_tool_calls": True,
+        "tool_choice": "auto",
+        "tools": [],
+        "usage": {
+            "input_tokens": input_tokens,
+            "input_tokens_details": {"cached_tokens": 0},
+            "output_tokens": len(text) // 4,
+            "output_tokens_details": {"reasoning_tokens": 0},
+            "total_tokens": input_tokens + len(text) // 4,
+        },
+    }
+
+
+def prompt_text(prompt):
+    if isinstance(prompt, str):
+        return prompt
+    return "\n".join(message["content"] for message in prompt)
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    server_version = "FakeOpenAI/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(length)
+
+    def read_json(self):
+        return json.loads(self.read_body() or b"{}")
+
+    def read_upload(self):
+        """The fields of a multipart/form-data upload, as bytes."""
+        content_type = self.headers.get("Content-Type", "")
+        message = BytesParser(policy=email.policy.default).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode("utf-8") + self.read_body()
+        )
+        fields = {}
+        for part in message.iter_parts():
+            fields[part.get_param("name", header="content-disposition")] = part.get_payload(decode=True)
+        return fields
+
+    def do_POST(self):
+        fake = self.server.fake
+        path = self.path.split("?")[0].rstrip("/")
+
+        if path.endswith("/responses"):
+            return self.post_response(fake)
+        if path.endswith("/files"):
+            fields = self.read_upload()
+            return self.send_json(200, fake.create_file(fields.get("file", b""), fields.get("purpose", b"").decode()))
+        if path.endswith("/batches"):
+            return self.send_json(200, fake.create_batch(self.read_json()))
+        self.send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def do_GET(self):
+        fake = self.server.fake
+        parts = self.path.split("?")[0].rstrip("/").split("/")
+
+        if len(parts) >= 2 and parts[-1] == "content" and parts[-3] == "files":
+            data = fake.files.get(parts[-2], {}).get("data")
+            if data is None:
+                return self.send_json(404, {"error": {"message": "File not found"}})
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        if parts[-2] == "batches":
+            batch = fake.get_batch(parts[-1])
+            if batch is None:
+                return self.send_json(404, {"error": {"message": "Batch not found"}})
+            return self.send_json(200, batch)
+        self.send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def post_response(self, fake):
+        body = self.read_json()
+        fake.count("requests")
+
+        if fake.latency:
+            time.sleep(fake.latency)
+        if fake.rng_random() < fake.rate_limit_rate:
+            fake.count("429")
+            return self.send_json(429, {"error": {"message": "Rate limit reached", "type": "requests"}},
+                                  {"retry-after": "0"})
+        if fake.rng_random() < fake.error_rate:
+            fake.count("500")
+            return self.send_json(500, {"error": {"message": "Internal error", "type": "server_error"}})
+
+        text = prompt_text(body.get("input", ""))
+        fake.count("responses")
+        self.send_json(200, fake_response(body.get("model"), fake.answer(text), len(text) // 4))
+
+
+class FakeOpenAIServer:
+    """
+    OpenAI-compatible server on localhost with configurable latency, 5xx and 429 rates.
+    It serves the Responses API and a stand-in of the Files and Batch APIs, where a batch
+    completes `batch_delay` seconds after it is created.
+    Point the pipeline at it with OPENAI_BASE_URL=<server.base_url> and any OPENAI_API_KEY.
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, rate_limit_rate=0.0, answer=fake_evaluation, seed=0,
+                 batch_delay=0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.answer = answer
+        self.batch_delay = batch_delay
+        self.counts = {}
+        self.files = {}
+        self.batches = {}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), FakeOpenAIHandler)
+        self.httpd.fake = self
+        self.thread = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}/v1"
+
+    def rng_random(self):
+        with self._lock:
+            return self._rng.random()
+
+    def count(self, key):
+        with self._lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def create_file(self, data, purpose):
+        file_id = f"file-{uuid.uuid4().hex}"
+        with self._lock:
+            self.files[file_id] = {"data": data, "purpose": purpose}
+        return {
+            "id": file_id, "object": "file", "bytes": len(data), "created_at": int(time.time()),
+            "filename": f"{file_id}.jsonl", "purpose": purpose, "status": "processed",
+        }
+
+    def create_batch(self, body):
+        """Run every request of the input file right away, the batch is reported done later."""
+        lines = self.files[body["input_file_id"]]["data"].decode("utf-8").splitlines()
+        output = []
+        for line in lines:
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            text = prompt_text(request["body"].get("input", ""))
+            output.append(json.dumps({
+                "id": f"batch_req_{uuid.uuid4().hex}",
+                "custom_id": request["custom_id"],
+                "response": {
+                    "status_code": 200,
+                    "request_id": uuid.uuid4().hex,
+                    "body": fake_response(request["body"].get("model"), self.answer(text), len(text) // 4),
+                },
+                "error": None,
+            }))
+        output_file = self.create_file("\n".join(output).encode("utf-8"), "batch_output")
+
+        batch_id = f"batch_{uuid.uuid4().hex}"
+        batch = {
+            "id": batch_id, "object": "batch", "endpoint": body["endpoint"],
+            "input_file_id": body["input_file_id"], "completion_window": body["completion_window"],
+            "status": "in_progress", "created_at": int(time.time()),
+            "output_file_id": None, "error_file_id": None,
+            "request_counts": {"total": len(output), "completed": 0, "failed": 0},
+        }
+        with self._lock:
+            self.batches[batch_id] = {"batch": batch, "done_at": time.time() + self.batch_delay,
+                                      "output_file_id": output_file["id"]}
+        self.count("batches")
+        return batch
+
+    def get_batch(self, batch_id):
+        with self._lock:
+            entry = self.batches.get(batch_id)
+            if entry is None:
+                return None
+            batch = entry["batch"]
+            if batch["status"] == "in_progress" and time.time() >= entry["done_at"]:
+                batch["status"] = "completed"
+                batch["output_file_id"] = entry["output_file_id"]
+                batch["completed_at"] = int(time.time())
+                counts = batch["request_counts"]
+                counts["completed"] = counts["total"]
+            return dict(batch)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class FakeUpworkHandler(BaseHTTPRequestHandler):
+    server_version = "FakeUpwork/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        fake = self.server.fake
+        if self.path.startswith("/assets/"):
+            return self.send_asset(fake)
+        params = parse_qs(urlsplit(self.path).query)
+        page = int(params.get("page", ["1"])[0])
+        per_page = int(params.get("per_page", [str(fake.per_page)])[0])
+
+        if fake.latency:
+            time.sleep(fake.latency)
+        data = fake.with_assets(fake.page(params.get("q", [""])[0], page, per_page)).encode("utf-8")
+        fake.count("pages", 1)
+        fake.count("bytes", len(data))
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_asset(self, fake):
+        content_types = {".png": "image/png", ".woff2": "font/woff2", ".css": "text/css", ".js": "text/javascript"}
+        extension = self.path[self.path.rfind("."):]
+        if extension == ".css":
+            data = f"@font-face {{ font-family: Fake; src: url('/assets/font.woff2'); }} body {{ font-family: Fake; }}".encode()
+        elif extension == ".js":
+            data = b"window.fakeTracker = true;" + b" " * fake.asset_bytes
+        else:
+            data = bytes(fake.asset_bytes)
+        fake.count("assets", 1)
+        fake.count("asset_bytes", len(data))
+        self.send_response(200)
+        self.send_header("Content-Type", content_types.get(extension, "application/octet-stream"))
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class FakeUpworkServer:
+    """
+    Search results server on localhost. Each distinct `q` gets its own `jobs_per_query` jobs,
+    newest first, served `per_page` per page with the `page` parameter. Pages past the last
+    job have an empty job list. A recorded `fixture` page replaces page 1 of every query.
+    With `assets`, each page also loads that many images of `asset_bytes`, a stylesheet
+    with a web font, and a tracker script from another host name (localhost).
+    """
+
+    def __init__(self, jobs_per_query=50, per_page=50, fixture=None, latency=0.0, seed=0, assets=0,
+                 asset_bytes=20_000):
+        self.jobs_per_query = jobs_per_query
+        self.assets = assets
+        self.asset_bytes = asset_bytes
+        self.per_page = per_page
+        self.fixture = fixture
+        self.latency = latency
+        self.seed = seed
+        self.queries = {}
+        self.counts = {}
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), FakeUpworkHandler)
+        self.httpd.fake = self
+        self.thread = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def query_url(self, q, per_page=None):
+        return f"{self.base_url}/nx/search/jobs/?q={q}&per_page={per_page or self.per_page}"
+
+    def count(self, key, amount):
+        with self._lock:
+            self.counts[key] = self.counts.get(key, 0) + amount
+
+    def with_assets(self, content):
+        if not self.assets:
+            return content
+        port = self.httpd.server_address[1]
+        assets = (
+            '<link rel="stylesheet" href="/assets/style.css">'
+            + "".join(f'<img src="/assets/image{i}.png" width="64" height="64">' for i in range(self.assets))
+            + f'<script src="http://localhost:{port}/assets/tracker.js"></script>'
+        )
+        return content.replace("</body>", f"{assets}</body>")
+
+    def page(self, q, page, per_page):
+        if self.fixture is not None and page == 1:
+            return self.fixture
+        with self._lock:
+            offset = self.queries.setdefault(q, len(self.queries)) * 10**6
+        start = (page - 1) * per_page
+        n_cards = max(0, min(per_page, self.jobs_per_query - start))
+        if not n_cards:
+            # Visible, so waiting for the job list does not time out
+            return (
+                "<!DOCTYPE html><html><body>"
+                '<section class="card-list-container"><p>No jobs found.</p></section>'
+                "</body></html>"
+            )
+        return build_search_page(n_cards, start=offset + start, seed=self.seed)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class FakeMessage:
+    def __init__(self, channel, message_id, content=None, embeds=None):
+        self.channel = channel
+        self.id = message_id
+        self.content = content
+        self.embeds = embeds or []
+        self.created_at = time.monotonic()
+
+    async def edit(self, content=None, embeds=None, **kwargs):
+        self.channel.count("edits")
+        self.content = content if content is not None else self.content
+        self.embeds = embeds if embeds is not None else self.embeds
+        return self
+
+
+class FakeDiscordHTTPError(Exception):
+    """What a send rejected by Discord raises, like discord.HTTPException."""
+
+    def __init__(self, status, text):
+        super().__init__(f"{status} Bad Request: {text}")
+        self.status = status
+        self.text = text
+
+
+class FakeDiscordChannel:
+    """
+    In-memory stand-in of a Discord text channel with its per-channel bucket of
+    `rate_limit` messages every `per` seconds. Like discord.py, a send over the limit gets
+    a 429 and waits for the bucket to reset, each one is counted.
+    Like Discord, a message with more than 10 embeds or more than 6000 characters over its
+    embeds (len() of a discord.Embed) gets a 400, counted and raised as FakeDiscordHTTPError.
+    Send latencies (wait included) are kept in `latencies`.
+    """
+
+    MAX_EMBEDS = 10
+    MAX_EMBEDS_CHARS = 6000
+
+    def __init__(self, rate_limit=5, per=5.0, latency=0.05):
+        self.rate_limit = rate_limit
+        self.per = per
+        self.latency = latency
+        self.sent_at = collections.deque()
+        self.messages = []
+        self.latencies = []
+        self.counts = {}
+
+    def count(self, key, amount=1):
+        self.counts[key] = self.counts.get(key, 0) + amount
+
+    async def send(self, content=None, embeds=None, view=None, **kwargs):
+        started = time.monotonic()
+        embeds = embeds or []
+        if len(embeds) > self.MAX_EMBEDS:
+            self.count("400")
+            raise FakeDiscordHTTPError(400, f"Must be {self.MAX_EMBEDS} or fewer embeds in length.")
+        if sum(len(embed) for embed in embeds) > self.MAX_EMBEDS_CHARS:
+            self.count("400")
+            raise FakeDiscordHTTPError(400, f"Embed size exceeds maximum size of {self.MAX_EMBEDS_CHARS}")
+        while True:
+            now = time.monotonic()
+            while self.sent_at and now - self.sent_at[0] >= self.per:
+                self.sent_at.popleft()
+            if len(self.sent_at) < self.rate_limit:
+                break
+            self.count("429")
+            await asyncio.sleep(self.per - (now - self.sent_at[0]))
+        self.sent_at.append(time.monotonic())
+
+        await asyncio.sleep(self.latency)
+        message = FakeMessage(self, len(self.messages) + 1, content, embeds)
+        self.messages.append(message)
+        self.count("messages")
+        self.count("embeds", len(embeds))
+        self.latencies.append(time.monotonic() - started)
+        return message
@@ -3,8 +3,11 @@ import pandas as pd
 import openai
 from dotenv import load_dotenv
 from utils import *
+from config import *
 import asyncio
+import atexit
 import os
+import sys
 
 
 load_dotenv(dotenv_path=".env")
@@ -20,13 +23,38 @@ if not openai.api_key:
 os.makedirs(RAW_PATH, exist_ok=True)
 os.makedirs(STAGING_PATH, exist_ok=True)
 
-query_url = "https://www.upwork.com/nx/search/jobs/?amount=100-499,500-999,1000-4999,5000-&q=statistics&t=0,1&page=1&per_page=50"  # Replace with your query URL
-asyncio.run(get_upwork_jobs(query_url, RAW_PATH))
+# Leases still held by this worker are released when the process exits
+leases = get_leases()
+if leases is not None:
+    atexit.register(leases.close)
 
-query_url = "https://www.upwork.com/nx/search/jobs/?amount=100-499,500-999,1000-4999,5000-&per_page=50&q=data%20analyst&t=0,1"  # Replace with your query URL
-asyncio.run(get_upwork_jobs(query_url, RAW_PATH))
+# Compaction and retention rewrite files every worker reads, one worker at a time
+if len(sys.argv) > 1 and sys.argv[1] in ("compact", "retention"):
+    if leases is not None and not leases.acquire("maintenance"):
+        print("Another worker is running compaction or retention, try again later.")
+        sys.exit(1)
 
-query_url = "https://www.upwork.com/nx/search/jobs/?amount=100-499,500-999,1000-4999,5000-&per_page=50&q=data%20scientist&t=0,1"  # Replace with your query URL
-asyncio.run(get_upwork_jobs(query_url, RAW_PATH))
+# python app/scripts/main.py compact -> merge the small files written by each run and slim the ledgers
+if len(sys.argv) > 1 and sys.argv[1] == "compact":
+    compact_dataset(RAW_PATH, RAW_SCHEMA, "raw")
+    compact_dataset(STAGING_PATH, STAGING_SCHEMA, "staging")
+    compact_ledger(sent_ledger_path(SENT_PATH))
+    if APPLIED_PATH:
+        compact_ledger(applied_ledger_path(APPLIED_PATH))
+    sys.exit(0)
 
-staging_jobs(RAW_PATH, STAGING_PATH)
\ No newline at end of file
+# python app/scripts/main.py retention -> drop (or move to ARCHIVE_PATH) the partitions older than RETENTION_DAYS
+if len(sys.argv) > 1 and sys.argv[1] == "retention":
+    apply_retention(RAW_PATH, RETENTION_DAYS, ARCHIVE_PATH and os.path.join(ARCHIVE_PATH, "raw"))
+    apply_retention(STAGING_PATH, RETENTION_DAYS, ARCHIVE_PATH and os.path.join(ARCHIVE_PATH, "staging"))
+    sys.exit(0)
+
+# Spans of this process join the run started by the bot, if it started one
+metrics = get_metrics()
+metrics.start_run(os.getenv("METRICS_RUN_ID"))
+
+# python app/scripts/main.py --due -> only scrape the queries whose poll interval elapsed
+asyncio.run(get_upwork_jobs(QUERY_URLS, RAW_PATH, only_due="--due" in sys.argv, **SCRAPE_OPTIONS))
+
+staging_jobs(RAW_PATH, STAGING_PATH, **STAGING_OPTIONS)
+metrics.finish_run()
@@ -1,13 +1,30 @@
 import pandas as pd
+import numpy as np
 import openai 
 import json
-from playwright.async_api import async_playwright
+from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
 import re
 from datetime import timedelta
 import pyarrow as pa
 import pyarrow.parquet as pq
 import duckdb
 import random
+import asyncio
+import time
+import os
+import glob
+import uuid
+import hashlib
+import sqlite3
+import shutil
+import zstandard
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+import contextlib
+import collections
+import threading
+import socket
+import fcntl
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 def get_posted_datetime(timestamp, posted_text):
     """
@@ -56,354 +73,2692 @@ def get_posted_datetime(timestamp, posted_text):
     
     raise ValueError(f"Unrecognized format: '{posted_text}'")
 
-async def get_upwork_jobs(query_url, RAW_PATH):
+# Offsets of the fixed phrases, checked in this order like in get_posted_datetime
+POSTED_PHRASE_SECONDS = [
+    ("today", 0),
+    ("yesterday", 86400),
+    ("last week", 7 * 86400),
+    ("last month", 30 * 86400),
+    ("last year", 365 * 86400),
+]
+
+POSTED_UNIT_SECONDS = {
+    "second": 1,
+    "minute": 60,
+    "hour": 3600,
+    "day": 86400,
+    "week": 7 * 86400,
+    "month": 30 * 86400,  # Approximate a month as 30 days
+}
+
+
+def parse_posted_dates(timestamps, posted_texts):
+    """
+    Vectorized get_posted_datetime over whole columns.
+    Returns the post dates and the number of unrecognized values, which become NaT
+    instead of raising.
+    """
+    text = posted_texts.fillna("").astype(str).str.lower().str.strip()
+    offset = pd.Series(float("nan"), index=text.index, dtype="float64")
+
+    for phrase, seconds in POSTED_PHRASE_SECONDS:
+        offset = offset.mask(offset.isna() & text.str.contains(phrase, regex=False), seconds)
+
+    # Expressions like "posted 3 weeks ago"
+    extracted = text.str.extract(r"posted\s+(\d+)\s+(second|minute|hour|day|week|month)s?\s+ago")
+    relative = extracted[0].astype("float64") * extracted[1].map(POSTED_UNIT_SECONDS)
+    offset = offset.fillna(relative)
+
+    post_dates = pd.to_datetime(timestamps) - pd.to_timedelta(offset, unit="s")
+    return post_dates, int(offset.isna().sum())
+
+
+RAW_SCHEMA = pa.schema([
+    ("job_id", pa.string()),
+    ("job_title", pa.string()),
+    # Null in the files, descriptions are written to the text store and referenced by
+    # description_key. Only rows written before the text store hold the text here.
+    ("job_description", pa.string()),
+    ("description_key", pa.string()),
+    ("job_link", pa.string()),
+    ("job_post_date", pa.string()),
+    ("job_type_level", pa.string()),
+    ("job_experience_level", pa.string()),
+    ("is_fixed_price", pa.string()),
+    ("duration_label", pa.string()),
+    ("datetime", pa.timestamp('ns'))
+])
+
+STAGING_SCHEMA = pa.schema(list(RAW_SCHEMA) + [
+    ("match_level", pa.float64()),
+    ("apply", pa.bool_()),
+    ("reason", pa.string()),
+    ("model", pa.string()),
+    ("repost_of", pa.string())
+])
+
+
+# Datasets are partitioned Hive-style by the scrape date of their rows: {path}/scrape_date=YYYY-MM-DD/
+PARTITION_KEY = "scrape_date"
+
+
+def partition_path(path, date):
+    return os.path.join(path, f"{PARTITION_KEY}={date}")
+
+
+def partition_dates(path):
+    """Scrape dates of the partitions of a dataset, oldest first."""
+    if not os.path.isdir(path):
+        return []
+    prefix = f"{PARTITION_KEY}="
+    return sorted(
+        name[len(prefix):] for name in os.listdir(path)
+        if name.startswith(prefix) and os.path.isdir(os.path.join(path, name))
+    )
+
+
+def window_start(window_days):
+    """First scrape date of a window of the last `window_days` days, None when there is no window."""
+    if not window_days:
+        return None
+    return (pd.Timestamp.now().floor("D") - pd.Timedelta(days=window_days - 1)).strftime("%Y-%m-%d")
+
+
+def dataset_globs(path, window_days=None):
+    """
+    Parquet globs of a dataset: its unpartitioned files, written before partitioning, and
+    the partitions of the last `window_days` scrape dates (all of them when None).
+    Only directories with files are returned, DuckDB fails on a glob without matches.
+    """
+    since = window_start(window_days)
+    globs = [os.path.join(path, "*.parquet")]
+    globs += [
+        os.path.join(partition_path(path, date), "*.parquet")
+        for date in partition_dates(path) if since is None or date >= since
+    ]
+    return [pattern for pattern in globs if glob.glob(pattern)]
+
+
+def dataset_files(path, window_days=None):
+    return [f for pattern in dataset_globs(path, window_days) for f in sorted(glob.glob(pattern))]
+
+
+def dataset_exists(path, window_days=None):
+    return len(dataset_globs(path, window_days)) > 0
+
+
+# DuckDB types of the arrow types used in the dataset schemas
+DUCKDB_TYPES = {
+    pa.string(): "VARCHAR",
+    pa.float64(): "DOUBLE",
+    pa.bool_(): "BOOLEAN",
+    pa.timestamp('ns'): "TIMESTAMP",
+}
+
+
+# Files are named {prefix}_{write time}_{worker}_{uuid8}.parquet, the write time of their
+# name orders the rows written for the same job_id. Files written before it sort first.
+FILE_STAMP_FORMAT = "%Y%m%d%H%M%S%f"
+FILE_STAMP_PATTERN = r"_(\d{14,})_[^/]*$"
+WRITE_ORDER_SQL = f"regexp_extract(filename, '{FILE_STAMP_PATTERN}', 1) DESC, filename DESC"
+
+
+def file_stamp(file):
+    """Write time in the name of a dataset file, None for files named before it was added."""
+    match = re.search(FILE_STAMP_PATTERN, file)
+    return match.group(1) if match else None
+
+
+def read_dataset_sql(path, window_days=None, schema=None, filename=False):
+    """
+    DuckDB table function reading the files of a dataset, pruned to the last `window_days` scrape dates.
+    With a `schema`, the columns that none of the files have yet (files written before the
+    column was added) are selected as nulls, so queries can always refer to them.
+    With `filename`, the path of the file of each row is added in a filename column.
+    """
+    patterns = ", ".join(f"'{pattern}'" for pattern in dataset_globs(path, window_days))
+    # The partition column is not added, `datetime` already holds the scrape date
+    source = (f"read_parquet([{patterns}], union_by_name = true, hive_partitioning = false"
+              f"{', filename = true' if filename else ''})")
+    if schema is None or not patterns:
+        return source
+
+    # Only the file footers are read to describe the columns
+    columns = {name for name, *_ in duckdb.query(f"DESCRIBE SELECT * FROM {source}").fetchall()}
+    missing = [
+        f"CAST(NULL AS {DUCKDB_TYPES.get(field.type, 'VARCHAR')}) AS {field.name}"
+        for field in schema if field.name not in columns
+    ]
+    if not missing:
+        return source
+    return f"(SELECT *, {', '.join(missing)} FROM {source})"
+
+
+def read_latest_sql(path, columns="*", window_days=None, schema=None):
+    """
+    SQL subquery reading a parquet dataset with exactly one row per job_id,
+    the most recently written one, pruned to the last `window_days` scrape dates.
+    """
+    return f"""(
+        SELECT {columns}
+        FROM (
+            SELECT * EXCLUDE (filename)
+            FROM {read_dataset_sql(path, window_days, schema, filename=True)}
+            QUALIFY row_number() OVER (PARTITION BY job_id ORDER BY {WRITE_ORDER_SQL}) = 1
+        )
+    )"""
+
+
+def conform_table(table, schema):
+    """Select and cast the columns of an arrow table to `schema`, adding missing columns as nulls."""
+    for field in schema:
+        if field.name not in table.column_names:
+            table = table.append_column(field.name, pa.nulls(len(table), type=field.type))
+    return table.select(schema.names).cast(schema)
+
+
+class TextStore:
+    """
+    Content-addressed store of job descriptions in a SQLite file. Each text is kept once,
+    zstd-compressed, under a hash of its content, and the datasets only hold that key.
+    """
+
+    def __init__(self, path, level=10):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Shared by the stages of the stream pipeline, which read and write it from worker threads
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.conn.execute("CREATE TABLE IF NOT EXISTS texts (key TEXT PRIMARY KEY, data BLOB NOT NULL)")
+        self.conn.commit()
+        self.compressor = zstandard.ZstdCompressor(level=level)
+        self.decompressor = zstandard.ZstdDecompressor()
+
+    @staticmethod
+    def key(text):
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT count(*) FROM texts").fetchone()[0]
+
+    def put_many(self, texts):
+        """Store `texts` and return their keys, None for the missing texts."""
+        keys = [self.key(text) if isinstance(text, str) else None for text in texts]
+        new = {key: text for key, text in zip(keys, texts) if key is not None}
+        with self.lock:
+            # Texts already stored are not compressed again
+            for start in range(0, len(new), 500):
+                chunk = list(new)[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                for (key,) in self.conn.execute(f"SELECT key FROM texts WHERE key IN ({placeholders})", chunk):
+                    del new[key]
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO texts VALUES (?, ?)",
+                [(key, self.compressor.compress(text.encode("utf-8"))) for key, text in new.items()]
+            )
+            self.conn.commit()
+        return keys
+
+    def get_many(self, keys):
+        """Texts of `keys`, keyed by key. Unknown keys are left out."""
+        unique_keys = list({key for key in keys if isinstance(key, str)})
+        texts = {}
+        with self.lock:
+            for start in range(0, len(unique_keys), 500):
+                chunk = unique_keys[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                for key, data in self.conn.execute(f"SELECT key, data FROM texts WHERE key IN ({placeholders})", chunk):
+                    texts[key] = self.decompressor.decompress(data).decode("utf-8")
+        return texts
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def close(self):
+        self.conn.close()
+
+
+_text_store = None
+_text_store_lock = threading.Lock()
+
+
+def get_text_store():
+    """Text store of this process, at TEXT_STORE_PATH (default {RAW_PATH}/_texts.sqlite), opened on first use."""
+    global _text_store
+    with _text_store_lock:
+        if _text_store is None:
+            _text_store = TextStore(
+                os.getenv("TEXT_STORE_PATH") or os.path.join(os.getenv("RAW_PATH") or "data", "_texts.sqlite")
+            )
+    return _text_store
+
+
+def job_description(row):
+    """Description of a job row (dict or Series), fetched from the text store when the row only has its key."""
+    text = row.get("job_description")
+    if isinstance(text, str):
+        return text
+    key = row.get("description_key")
+    return (get_text_store().get(key) if isinstance(key, str) else None) or ""
+
+
+def with_descriptions(jobs_df):
+    """Fill the job_description column of the rows read from a dataset, in one text store read."""
+    if "description_key" not in jobs_df.columns:
+        return jobs_df
+    jobs_df = jobs_df.copy()
+    if "job_description" not in jobs_df.columns:
+        jobs_df["job_description"] = None
+    missing = jobs_df["job_description"].isna()
+    texts = get_text_store().get_many(jobs_df.loc[missing, "description_key"])
+    jobs_df.loc[missing, "job_description"] = jobs_df.loc[missing, "description_key"].map(texts).fillna("")
+    return jobs_df
+
+
+def store_descriptions(table):
+    """Move the job descriptions of an arrow table to the text store, leaving their keys in description_key."""
+    texts = table.column("job_description").to_pylist()
+    stored = get_text_store().put_many(texts)
+    keys = [key or stored_key for key, stored_key in zip(table.column("description_key").to_pylist(), stored)]
+    table = table.set_column(
+        table.schema.get_field_index("description_key"), "description_key", pa.array(keys, pa.string())
+    )
+    return table.set_column(
+        table.schema.get_field_index("job_description"), "job_description", pa.nulls(len(table), pa.string())
+    )
+
+
+def worker_id():
+    """
+    Name of this worker in leases and file names: WORKER_ID, or the host name, which is
+    unique per container. Set WORKER_ID when several workers run on the same host.
+    """
+    return re.sub(r"[^\w.-]", "_", os.getenv("WORKER_ID") or socket.gethostname())
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    """Exclusive lock on `{path}.lock` across processes, held for the with block."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(f"{path}.lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def write_dataset_file(table, path, prefix, stamp=None):
+    """
+    Atomically write an arrow table as a new parquet file in `path`, named with the current
+    time, or `stamp` to keep the write order of rows rewritten by compaction.
+    """
+    os.makedirs(path, exist_ok=True)
+    # The worker id keeps the names of concurrent workers apart
+    stamp = stamp or pd.Timestamp.now().strftime(FILE_STAMP_FORMAT)
+    file_name = f"{prefix}_{stamp}_{worker_id()}_{uuid.uuid4().hex[:8]}.parquet"
+    tmp_path = os.path.join(path, f".{file_name}.tmp")
+    pq.write_table(table, tmp_path)
+    # Readers glob *.parquet, so they never see a partially written file
+    os.replace(tmp_path, os.path.join(path, file_name))
+    return os.path.join(path, file_name)
+
+
+def write_partitioned(table, path, prefix, stamp=None):
+    """
+    Write an arrow table as one new file per scrape date partition, with its descriptions
+    moved to the text store. Returns the files written.
+    """
+    if "description_key" in table.column_names:
+        table = store_descriptions(table)
+    dates = table.column("datetime").to_pandas().dt.strftime("%Y-%m-%d")
+    # Rows without a scrape datetime go to today's partition
+    dates = dates.fillna(pd.Timestamp.now().strftime("%Y-%m-%d"))
+    return [
+        write_dataset_file(table.filter(pa.array(dates == date)), partition_path(path, date), prefix, stamp)
+        for date in sorted(dates.unique())
+    ]
+
+
+def append_dataset(df, path, schema, prefix):
+    """Persist only the given rows as new small files in their partitions, the existing files are never rewritten."""
+    with get_metrics().span("parquet_write", prefix):
+        table = conform_table(pa.Table.from_pandas(df, preserve_index=False), schema)
+        return write_partitioned(table, path, prefix)
+
+
+def compact_dataset(path, schema, prefix):
+    """
+    Merge the small files of each partition of a dataset into a single file with one row
+    per job_id. Files written before the dataset was partitioned are moved to their
+    partitions first.
+    """
+    unpartitioned = sorted(glob.glob(os.path.join(path, "*.parquet")))
+    if unpartitioned:
+        table = latest_rows(unpartitioned)
+        # Partitioned files were all written after these ones, the newest stamp keeps them older
+        write_partitioned(conform_table(table, schema), path, prefix, newest_stamp(unpartitioned))
+        for f in unpartitioned:
+            os.remove(f)
+        print(f"Compaction: moved {len(unpartitioned)} unpartitioned files of {path} to partitions ({len(table)} rows).")
+
+    for date in partition_dates(path):
+        compact_partition(partition_path(path, date), schema, prefix)
+
+
+def latest_rows(files):
+    """Arrow table of the most recently written row of each job_id in `files`."""
+    file_list = ", ".join(f"'{f}'" for f in files)
+    return duckdb.query(f"""
+        SELECT * EXCLUDE (filename)
+        FROM read_parquet([{file_list}], union_by_name = true, hive_partitioning = false, filename = true)
+        QUALIFY row_number() OVER (PARTITION BY job_id ORDER BY {WRITE_ORDER_SQL}) = 1
+        ;
+    """).fetch_arrow_table()
+
+
+def newest_stamp(files):
+    """Newest write time in the names of `files`, the lowest one when none of them has it."""
+    stamps = [stamp for stamp in map(file_stamp, files) if stamp]
+    return max(stamps) if stamps else "0" * 14
+
+
+def compact_partition(path, schema, prefix):
+    files = sorted(glob.glob(os.path.join(path, "*.parquet")))
+    if len(files) <= 1:
+        return
+
+    table = conform_table(latest_rows(files), schema)
+    if "description_key" in table.column_names:
+        table = store_descriptions(table)
+    # Files written to other partitions meanwhile, or after this read, stay newer
+    new_file = write_dataset_file(table, path, prefix, newest_stamp(files))
+    for f in files:
+        os.remove(f)
+    print(f"Compaction: merged {len(files)} files of {path} into {os.path.basename(new_file)} ({len(table)} rows).")
+
+
+def apply_retention(path, retention_days, archive_path=None):
+    """
+    Drop the partitions of a dataset older than `retention_days` days, or move them to the
+    same partition of `archive_path`. Unpartitioned files are left alone, compact_dataset
+    moves them to partitions. Returns the number of rows removed from `path`.
+    """
+    since = window_start(retention_days)
+    if since is None:
+        return 0
+
+    removed = 0
+    for date in partition_dates(path):
+        if date >= since:
+            break
+        source = partition_path(path, date)
+        files = sorted(glob.glob(os.path.join(source, "*.parquet")))
+        n_rows = sum(pq.ParquetFile(f).metadata.num_rows for f in files)
+        if archive_path:
+            target = partition_path(archive_path, date)
+            os.makedirs(target, exist_ok=True)
+            for f in files:
+                shutil.move(f, os.path.join(target, os.path.basename(f)))
+        shutil.rmtree(source)
+        removed += n_rows
+        print(f"Retention: {'archived' if archive_path else 'dropped'} {PARTITION_KEY}={date} of {path} "
+              f"({len(files)} files, {n_rows} rows).")
+
+    print(f"Retention: removed {removed} rows older than {since} from {path}.")
+    return removed
+
+
+class SeenIndex:
+    """
+    Persistent set of the job_ids already in the raw dataset, one id per line in
+    `{RAW_PATH}/_seen_ids.txt`. It is rebuilt from the raw dataset when the file is missing
+    and new ids are appended to the file, so loading it never touches the parquet files.
+    """
+
+    def __init__(self, path, ids=None):
+        self.path = path
+        self.ids = set(ids or [])
+        self.new_ids = []
+
+    @classmethod
+    def load(cls, RAW_PATH, path=None):
+        path = path or os.path.join(RAW_PATH, "_seen_ids.txt")
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                return cls(path, (line.strip() for line in f if line.strip()))
+
+        index = cls(path)
+        if dataset_exists(RAW_PATH):
+            ids = duckdb.query(f"SELECT DISTINCT job_id FROM {read_dataset_sql(RAW_PATH)};").fetchall()
+            index.add(job_id for (job_id,) in ids)
+        return index
+
+    def __contains__(self, job_id):
+        return job_id in self.ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, job_ids):
+        for job_id in job_ids:
+            if job_id and job_id not in self.ids:
+                self.ids.add(job_id)
+                self.new_ids.append(job_id)
+
+    def save(self):
+        """Append the ids added since the last save, creating the file if needed."""
+        if not self.new_ids and os.path.exists(self.path):
+            return
+        # Other workers append to the same file
+        with file_lock(self.path), open(self.path, "a", encoding="utf-8") as f:
+            f.writelines(f"{job_id}\n" for job_id in self.new_ids)
+        self.new_ids = []
+
+
+class QuerySchedule:
+    """
+    Watermark and poll interval of each query URL, in `{RAW_PATH}/_queries.json`.
+    The watermark is the newest job_id of the last scrape of a query: its result pages are
+    followed until the watermark shows up. The poll interval follows the observed rate of
+    new jobs, so that about `target_new_jobs` are waiting at each poll, within
+    `min_interval` and `max_interval` seconds.
+    """
+
+    def __init__(self, path, queries=None, min_interval=600, max_interval=6 * 3600, target_new_jobs=20):
+        self.path = path
+        self.queries = queries or {}
+        self.updated = set()
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.target_new_jobs = target_new_jobs
+
+    @classmethod
+    def load(cls, RAW_PATH, path=None, **options):
+        path = path or os.path.join(RAW_PATH, "_queries.json")
+        return cls(path, cls.read(path), **options)
+
+    @staticmethod
+    def read(path):
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def refresh(self, query_url):
+        """Reload the state of `query_url`, another worker may have scraped it since the schedule was loaded."""
+        with file_lock(self.path):
+            state = (self.read(self.path) or {}).get(query_url)
+        if state is not None:
+            self.queries[query_url] = state
+
+    def get(self, query_url):
+        return self.queries.setdefault(query_url, {
+            "watermark": None, "interval": self.min_interval, "rate": None,
+            "last_poll": None, "next_poll": None, "pages": 0, "new_jobs": 0,
+        })
+
+    def watermark(self, query_url):
+        return self.get(query_url)["watermark"]
+
+    def due(self, query_urls, now=None):
+        now = now or time.time()
+        return [url for url in query_urls if (self.get(url)["next_poll"] or 0) <= now]
+
+    def seconds_until_due(self, query_urls, now=None):
+        now = now or time.time()
+        return max(0.0, min(((self.get(url)["next_poll"] or 0) - now for url in query_urls), default=0.0))
+
+    def update(self, query_url, new_jobs, pages, newest_id, reached_watermark, now=None):
+        """Record a scrape of `query_url` and schedule its next poll."""
+        now = now or time.time()
+        state = self.get(query_url)
+        if state["last_poll"]:
+            rate = new_jobs / max(now - state["last_poll"], 1.0)
+            # Smoothed, a single quiet or busy hour should not swing the interval
+            state["rate"] = rate if state["rate"] is None else (rate + state["rate"]) / 2
+
+        if state["watermark"] and not reached_watermark:
+            # Ran out of pages before the watermark, jobs were missed: poll as often as allowed
+            interval = self.min_interval
+        elif state["rate"]:
+            interval = self.target_new_jobs / state["rate"]
+        else:
+            interval = state["interval"] * 2
+        interval = min(self.max_interval, max(self.min_interval, interval))
+
+        state.update(
+            watermark=newest_id or state["watermark"], interval=interval,
+            last_poll=now, next_poll=now + interval,
+            pages=state["pages"] + pages, new_jobs=state["new_jobs"] + new_jobs,
+        )
+        self.updated.add(query_url)
+
+    def save(self):
+        """Write the queries updated by this worker over the current file, which other workers also update."""
+        with file_lock(self.path):
+            queries = self.read(self.path) or {}
+            queries.update({url: self.queries[url] for url in self.updated})
+            tmp_path = f"{self.path}.{worker_id()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(queries, f, indent=2)
+            os.replace(tmp_path, self.path)
+        self.queries = {**self.queries, **queries}
+        self.updated.clear()
+
+
+def page_url(query_url, page):
+    """
+    `query_url` pointing to result page `page`, newest jobs first. The watermark stop relies
+    on that order, so any other sort of the query URL is replaced.
+    """
+    parts = urlsplit(query_url)
+    params = [
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True) if key not in ("page", "sort")
+    ]
+    params.append(("sort", "recency"))
+    if page > 1:
+        params.append(("page", str(page)))
+    return urlunsplit(parts._replace(query=urlencode(params, safe=",")))
+
+
+class LeaseStore:
+    """
+    Coordination of the workers sharing one data directory, in a SQLite file:
+    - named leases (a query URL, the Batch API job), held by one worker at a time,
+    - claims on job_ids, taken atomically before the jobs are evaluated.
+    Leases and claims expire `ttl` seconds after their owner's last heartbeat, so the work
+    of a worker that died is taken over. A daemon thread renews them every ttl / 3 seconds
+    while they are held.
+    """
+
+    def __init__(self, path, owner=None, ttl=300):
+        self.path = path
+        self.owner = owner or worker_id()
+        self.ttl = ttl
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=30)
+        for table, key in (("leases", "name"), ("claims", "job_id")):
+            self.conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {table} (
+                    {key} TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    held INTEGER NOT NULL
+                )
+            """)
+        self.conn.commit()
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+    def acquire(self, name):
+        """Take the lease `name` if it is free, expired or already ours. Returns whether it is held."""
+        now = time.time()
+        cursor = self.conn.execute("""
+            INSERT INTO leases VALUES (?, ?, ?, 1)
+            ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at, held = 1
+            WHERE leases.expires_at < ? OR leases.owner = ?
+        """, (name, self.owner, now + self.ttl, now, self.owner))
+        self.conn.commit()
+        if cursor.rowcount:
+            self.start_heartbeat()
+        return cursor.rowcount == 1
+
+    def release(self, name, keep_for=0):
+        """Stop renewing the lease `name`. Other workers can take it in `keep_for` seconds."""
+        self.conn.execute(
+            "UPDATE leases SET held = 0, expires_at = ? WHERE name = ? AND owner = ?",
+            (time.time() + keep_for, name, self.owner)
+        )
+        self.conn.commit()
+
+    def claim_jobs(self, job_ids):
+        """Claim the `job_ids` that no other worker holds, in one transaction. Returns the claimed ones."""
+        job_ids = list(dict.fromkeys(job_ids))
+        now = time.time()
+        self.conn.executemany("""
+            INSERT INTO claims VALUES (?, ?, ?, 1)
+            ON CONFLICT (job_id) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at, held = 1
+            WHERE claims.expires_at < ? OR claims.owner = ?
+        """, [(job_id, self.owner, now + self.ttl, now, self.owner) for job_id in job_ids])
+        self.conn.commit()
+
+        claimed = set()
+        # Stay below the SQLite limit of variables per query
+        for start in range(0, len(job_ids), 500):
+            chunk = job_ids[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            claimed.update(job_id for (job_id,) in self.conn.execute(
+                f"SELECT job_id FROM claims WHERE owner = ? AND job_id IN ({placeholders})", [self.owner, *chunk]
+            ))
+        if claimed:
+            self.start_heartbeat()
+        return claimed
+
+    def settle_jobs(self, job_ids):
+        """
+        Stop renewing the claims of `job_ids`, once their results are written or given up.
+        They still expire `ttl` seconds later: a worker that listed the jobs as pending
+        before their staging rows were written cannot claim them again in the meantime,
+        and failed jobs are free to be claimed after that.
+        """
+        job_ids = list(job_ids)
+        expires_at = time.time() + self.ttl
+        for start in range(0, len(job_ids), 500):
+            chunk = job_ids[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            self.conn.execute(
+                f"UPDATE claims SET held = 0, expires_at = ? WHERE owner = ? AND job_id IN ({placeholders})",
+                [expires_at, self.owner, *chunk]
+            )
+        self.conn.commit()
+
+    def renew(self, conn=None):
+        """Heartbeat: push back the expiry of everything held by this worker and drop the long expired claims."""
+        conn = conn or self.conn
+        now = time.time()
+        for table in ("leases", "claims"):
+            conn.execute(f"UPDATE {table} SET expires_at = ? WHERE owner = ? AND held = 1", (now + self.ttl, self.owner))
+        conn.execute("DELETE FROM claims WHERE expires_at < ?", (now - self.ttl,))
+        conn.commit()
+
+    def start_heartbeat(self):
+        if self._heartbeat is not None and self._heartbeat.is_alive():
+            return
+
+        def beat():
+            # SQLite connections are per thread
+            conn = sqlite3.connect(self.path, timeout=30)
+            try:
+                while not self._stop.wait(self.ttl / 3):
+                    self.renew(conn)
+            finally:
+                conn.close()
+
+        self._heartbeat = threading.Thread(target=beat, name="lease-heartbeat", daemon=True)
+        self._heartbeat.start()
+
+    def close(self):
+        """Stop the heartbeat and release the leases still held, the held claims are settled."""
+        self._stop.set()
+        self.conn.execute(
+            "UPDATE leases SET held = 0, expires_at = ? WHERE owner = ? AND held = 1", (time.time(), self.owner)
+        )
+        self.conn.execute(
+            "UPDATE claims SET held = 0, expires_at = ? WHERE owner = ? AND held = 1", (time.time() + self.ttl, self.owner)
+        )
+        self.conn.commit()
+        self.conn.close()
+
+
+_leases = None
+
+
+def get_leases():
+    """
+    Lease store of this process, at LEASE_PATH (default {RAW_PATH}/_leases.sqlite), opened
+    on first use, with leases of LEASE_TTL seconds. None when LEASE_TTL is 0 (single worker).
+    """
+    global _leases
+    ttl = int(os.getenv("LEASE_TTL", "300"))
+    if _leases is None and ttl:
+        _leases = LeaseStore(
+            os.getenv("LEASE_PATH") or os.path.join(os.getenv("RAW_PATH") or "data", "_leases.sqlite"), ttl=ttl
+        )
+    return _leases
+
+
+def claim_pending_jobs(jobs_df, leases):
+    """The rows of `jobs_df` claimed by this worker, the others are being evaluated by other workers."""
+    if leases is None or jobs_df.empty:
+        return jobs_df
+    claimed = leases.claim_jobs(jobs_df["job_id"])
+    if len(claimed) < len(jobs_df):
+        print(f"Staging Step: {len(jobs_df) - len(claimed)} pending jobs are claimed by other workers.")
+    return jobs_df[jobs_df["job_id"].isin(claimed)]
+
+
+# Columns of staging read by the Discord embed and the job buttons
+# The description is read with job_description(row), from the text store for new rows
+EMBED_COLUMNS = [
+    "job_id", "job_title", "job_description", "description_key", "job_link", "job_type_level",
+    "job_experience_level", "is_fixed_price", "duration_label", "match_level", "reason"
+]
+
+# Ledgers only record the decision taken on a job, the job itself stays in staging
+LEDGER_COLUMNS = ["job_id", "recorded_at", "decision"]
+
+
+def sent_ledger_path(SENT_PATH):
+    return os.path.join(SENT_PATH, "jobs-sent.csv")
+
+
+def applied_ledger_path(APPLIED_PATH):
+    return os.path.join(APPLIED_PATH, "jobs-applied.csv")
+
+
+def append_ledger(path, rows, decision):
+    """Append the job_ids of `rows` to a CSV ledger with the current time and `decision`."""
+    rows_df = pd.DataFrame({
+        "job_id": [row["job_id"] for row in rows],
+        "recorded_at": pd.Timestamp.now().isoformat(),
+        "decision": decision,
+    })
+    # Several workers append to the same ledger, and compaction rewrites it
+    with file_lock(path):
+        if os.path.exists(path):
+            # A ledger written before LEDGER_COLUMNS is slimmed first, so the new rows keep
+            # their recorded_at and decision
+            if list(pd.read_csv(path, nrows=0).columns) != LEDGER_COLUMNS:
+                rewrite_ledger(path)
+            rows_df.to_csv(path, mode='a', index=False, header=False)
+        else:
+            rows_df.to_csv(path, mode='w', index=False, header=True)
+
+
+def rewrite_ledger(path):
+    """Rewrite a ledger with exactly LEDGER_COLUMNS. The caller holds the lock of the ledger."""
+    header = pd.read_csv(path, nrows=0).columns
+    columns = [column for column in LEDGER_COLUMNS if column in header]
+    ledger_df = pd.read_csv(path, usecols=columns, dtype=str).reindex(columns=LEDGER_COLUMNS)
+    tmp_path = f"{path}.tmp"
+    ledger_df.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    return len(ledger_df)
+
+
+def compact_ledger(path):
+    """Rewrite a ledger with only LEDGER_COLUMNS, dropping the job fields older ledgers copied."""
+    if not os.path.exists(path):
+        return
+    if list(pd.read_csv(path, nrows=0).columns) == LEDGER_COLUMNS:
+        print(f"Compaction: {path} only has ledger columns, nothing to do.")
+        return
+
+    with file_lock(path):
+        size = os.path.getsize(path)
+        n_rows = rewrite_ledger(path)
+    print(f"Compaction: rewrote {path} with {n_rows} rows, {size / 1e6:.1f}MB -> {os.path.getsize(path) / 1e6:.1f}MB.")
+
+
+def sent_ids_sql(SENT_PATH, exclude_last=0):
+    """
+    SQL subquery with the job_ids of the sent ledger, without its last `exclude_last` rows,
+    or None when nothing was sent yet.
+    The last rows are the latest by recorded_at, DuckDB does not keep the order of a CSV
+    scan. Rows of one append share their recorded_at and are ordered by job_id, rows of
+    ledgers older than recorded_at come first.
+    """
+    ledger = sent_ledger_path(SENT_PATH)
+    if not os.path.exists(ledger):
+        return None
+    read_ledger = f"read_csv('{ledger}', header = true, all_varchar = true)"
+    if not exclude_last:
+        return f"(SELECT job_id FROM {read_ledger})"
+    return f"""(
+        SELECT job_id FROM (
+            SELECT
+                job_id,
+                row_number() OVER (
+                    ORDER BY TRY_CAST(recorded_at AS TIMESTAMP) NULLS FIRST, job_id
+                ) AS position,
+                count(*) OVER () AS total
+            FROM {read_ledger}
+        )
+        WHERE position <= total - {int(exclude_last)}
+    )"""
+
+
+def unsent_jobs_sql(STAGING_PATH, SENT_PATH, exclude_last=0, columns=EMBED_COLUMNS, window_days=None):
+    """
+    Applicable staging jobs of the last `window_days` scrape dates missing from the sent
+    ledger, only with `columns`, in match_level order.
+    """
+    sent_ids = sent_ids_sql(SENT_PATH, exclude_last)
+    anti_join = f"ANTI JOIN {sent_ids} AS sent USING (job_id)" if sent_ids else ""
+    projection = ", ".join(f"staging.{column}" for column in columns)
+    return f"""
+        SELECT {projection}
+        FROM {read_latest_sql(STAGING_PATH, window_days=window_days, schema=STAGING_SCHEMA)} AS staging
+        {anti_join}
+        WHERE staging.apply = TRUE AND staging.repost_of IS NULL
+        ORDER BY staging.match_level
+    """
+
+
+def iter_unsent_jobs(STAGING_PATH, SENT_PATH, exclude_last=0, batch_size=100, window_days=None):
+    """
+    Stream the applicable jobs that were not sent yet, as dicts with the embed columns.
+    Selection, projection and the anti-join against the ledger run in DuckDB and rows are
+    fetched in batches of `batch_size` instead of being materialized in pandas.
+    Only the partitions of the last `window_days` scrape dates are read.
+    """
+    if not dataset_exists(STAGING_PATH, window_days):
+        return
+    con = duckdb.connect()
+    try:
+        with get_metrics().span("parquet_read", "unsent_jobs"):
+            reader = con.execute(unsent_jobs_sql(
+                STAGING_PATH, SENT_PATH, exclude_last, window_days=window_days
+            )).fetch_record_batch(batch_size)
+        for batch in reader:
+            yield from batch.to_pylist()
+    finally:
+        con.close()
+
+
+def get_staged_job(STAGING_PATH, job_id, window_days=None):
+    """
+    Latest staged record of `job_id` as a dict, or None. The job_id filter is pushed down to
+    the parquet scan, so a lookup does not read the whole dataset. The partitions of the
+    last `window_days` scrape dates are searched first, then the whole history.
+    """
+    rows = []
+    con = duckdb.connect()
+    started = time.perf_counter()
+    try:
+        for window in dict.fromkeys([window_days, None]):
+            if rows or not dataset_exists(STAGING_PATH, window):
+                continue
+            rows = con.execute(f"""
+                SELECT * EXCLUDE (filename)
+                FROM {read_dataset_sql(STAGING_PATH, window, STAGING_SCHEMA, filename=True)}
+                WHERE job_id = ?
+                ORDER BY {WRITE_ORDER_SQL}
+                LIMIT 1
+            """, [job_id]).fetch_arrow_table().to_pylist()
+    finally:
+        con.close()
+    get_metrics().add_span("parquet_read", time.perf_counter() - started, "staged_job")
+    return rows[0] if rows else None
+
+
+# Resources the scraper never reads, only text and links of the cards are extracted
+BLOCKED_RESOURCE_TYPES = ("image", "media", "font")
+
+# Analytics and third-party tags loaded by the search page
+BLOCKED_DOMAINS = (
+    "google-analytics.com", "googletagmanager.com", "doubleclick.net", "googleadservices.com",
+    "facebook.net", "facebook.com", "hotjar.com", "segment.io", "segment.com", "bing.com",
+    "linkedin.com", "twitter.com", "ads-twitter.com", "optimizely.com", "nr-data.net", "newrelic.com",
+)
+
+
+def domain_matches(hostname, domains):
+    return any(hostname == domain or hostname.endswith(f".{domain}") for domain in domains)
+
+
+class RouteFilter:
+    """
+    Aborts the browser requests the scraper does not need: resources of `blocked_types`,
+    hosts in `blocked_domains` and, when `allowed_domains` is given, hosts outside of it.
+    """
+
+    def __init__(self, blocked_types=BLOCKED_RESOURCE_TYPES, allowed_domains=None, blocked_domains=BLOCKED_DOMAINS):
+        self.blocked_types = set(blocked_types or ())
+        self.allowed_domains = tuple(allowed_domains or ())
+        self.blocked_domains = tuple(blocked_domains or ())
+        self.blocked = 0
+
+    def allows(self, resource_type, url):
+        # The page itself is never blocked, whatever its host
+        if resource_type == "document":
+            return True
+        hostname = urlsplit(url).hostname or ""
+        if resource_type in self.blocked_types or domain_matches(hostname, self.blocked_domains):
+            return False
+        return not self.allowed_domains or domain_matches(hostname, self.allowed_domains)
+
+    async def handle(self, route):
+        if self.allows(route.request.resource_type, route.request.url):
+            await route.continue_()
+        else:
+            self.blocked += 1
+            await route.abort()
+
+    async def install(self, context):
+        await context.route("**/*", self.handle)
+
+
+def new_route_filter(route_filter=True, block_resource_types=None, allowed_domains=None, blocked_domains=None):
+    """RouteFilter from the scrape options, None when `route_filter` is off."""
+    if not route_filter:
+        return None
+    return RouteFilter(
+        blocked_types=BLOCKED_RESOURCE_TYPES if block_resource_types is None else block_resource_types,
+        allowed_domains=allowed_domains,
+        blocked_domains=BLOCKED_DOMAINS if blocked_domains is None else blocked_domains,
+    )
+
+
+def storage_state_path(RAW_PATH):
+    """Cookies and consent of the browser context, reused across runs."""
+    return os.path.join(RAW_PATH, "_storage_state.json")
+
+
+def track_transfer(page, stats):
+    """
+    Count the requests of `page` and the bytes they transferred (headers and bodies) into
+    `stats`. Sizes are read asynchronously, await the returned tasks before closing the page.
+    """
+    tasks = []
+
+    async def add_sizes(request):
+        sizes = await request.sizes()
+        stats["requests"] += 1
+        stats["bytes"] += sizes["responseHeadersSize"] + sizes["responseBodySize"] + sizes["requestHeadersSize"]
+
+    page.on("requestfinished", lambda request: tasks.append(asyncio.ensure_future(add_sizes(request))))
+    return tasks
+
+
+USER_AGENT = (
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+    '(KHTML, like Gecko) Chrome/113.0.0.0 Safari/537.36'
+)
+
+
+# Selectors of every field read from a job card
+JOB_CARD_SELECTORS = {
+    "job_post_date": "small[class^='text-light']",
+    "job_title": "h2",
+    "job_description": "p",
+    "job_type_level": 'li[data-test="job-type-label"]',
+    "job_experience_level": 'li[data-test="experience-level"]',
+    "is_fixed_price": 'li[data-test="is-fixed-price"]',
+    "duration_label": 'li[data-test="duration-label"]',
+}
+JOB_LIST_SELECTOR = "section.card-list-container"
+JOB_CARD_SELECTOR = "article[class^='job-tile']"
+
+# Reads only the link of every card, enough to get the job_id
+JOB_LINK_JS = """
+(cards) => cards.map((card) => {
+    const link = card.querySelector('h2 a');
+    return link ? link.getAttribute('href') : null;
+})
+"""
+
+# Reads every field of the cards at `indexes` (all cards if null), in a single round trip
+JOB_CARD_JS = """
+(cards, {selectors, indexes}) => (indexes === null ? cards : indexes.map((i) => cards[i])).map((card) => {
+    const record = {};
+    for (const [field, selector] of Object.entries(selectors)) {
+        const element = card.querySelector(selector);
+        record[field] = element ? element.innerText : null;
+    }
+    const link = card.querySelector('h2 a');
+    record.job_link = link ? link.getAttribute('href') : null;
+    return record;
+})
+"""
+
+
+def new_scrape_stats():
+    return {
+        "cards": 0, "skipped": 0, "extracted": 0, "extract_seconds": 0.0, "pages": 0,
+        "load_seconds": 0.0, "requests": 0, "bytes": 0,
+        "first_job_id": None, "reached_watermark": False,
+    }
+
+
+def extract_job_id(link):
+    # extract the job_id from the job_link, it is between the last '~' and '/'
+    job_id_match = re.search(r'~([^/]+)', link) if link else None
+    return job_id_match.group(1) if job_id_match else None
+
+
+def build_job_record(fields, datetime_now):
+    """Turn the raw fields of a card into a job record, None if the card has no title or link."""
+    title = fields.get("job_title")
+    link = fields.get("job_link")
+    if not title or not link:
+        return None
+
+    return {
+        "job_id": extract_job_id(link),
+        "job_title": title,
+        "job_description": fields.get("job_description") or "",
+        "job_link": link,
+        "job_post_date": fields.get("job_post_date"),
+        "job_type_level": fields.get("job_type_level"),
+        "job_experience_level": fields.get("job_experience_level"),
+        "is_fixed_price": fields.get("is_fixed_price"),
+        "duration_label": fields.get("duration_label"),
+        "datetime": datetime_now}
+
+
+async def extract_job_cards_selectors(page, datetime_now, seen_ids, stats, stop_at=None):
+    """Extract the job cards with one query_selector/inner_text round trip per field."""
     jobs = []
-    datetime_now = pd.Timestamp.now().strftime("%Y-%m-%d %H:%M:%S")
-    print(f"Scraping Upwork jobs at {datetime_now}...")
 
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=True)  # Set to True for headless mode
-        
-        context = await browser.new_context(
-            user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
-                    '(KHTML, like Gecko) Chrome/113.0.0.0 Safari/537.36',
-            locale='en-US',
-            viewport={'width': 1280, 'height': 720},
-        )
+    job_card = await page.query_selector(JOB_LIST_SELECTOR)
+    job_elements = await job_card.query_selector_all(JOB_CARD_SELECTOR) if job_card else []
+    stats["cards"] += len(job_elements)
+
+    for job_element in job_elements:
+        link_element = await job_element.query_selector('h2 a')
+        link = await link_element.get_attribute('href') if link_element else None
+        job_id = extract_job_id(link)
+        stats["first_job_id"] = stats["first_job_id"] or job_id
+        if stop_at and job_id == stop_at:
+            stats["reached_watermark"] = True
+            break
+        if job_id in seen_ids:
+            stats["skipped"] += 1
+            continue
+
+        started = time.perf_counter()
+        fields = {"job_link": link}
+        for field, selector in JOB_CARD_SELECTORS.items():
+            element = await job_element.query_selector(selector)
+            fields[field] = await element.inner_text() if element else None
+
+        record = build_job_record(fields, datetime_now)
+        stats["extracted"] += 1
+        stats["extract_seconds"] += time.perf_counter() - started
+        if record:
+            jobs.append(record)
+
+    return jobs
+
+
+async def extract_job_cards_evaluate(page, datetime_now, seen_ids, stats, stop_at=None):
+    """
+    Extract the job cards with in-page evaluations: one for the links of all cards,
+    then one for every field of the cards whose job_id was not seen before.
+    """
+    card_selector = f"{JOB_LIST_SELECTOR} {JOB_CARD_SELECTOR}"
+    indexes = None
+    if seen_ids or stop_at:
+        links = await page.eval_on_selector_all(card_selector, JOB_LINK_JS)
+        job_ids = [extract_job_id(link) for link in links]
+        stats["first_job_id"] = job_ids[0] if job_ids else None
+        if stop_at and stop_at in job_ids:
+            # Cards from the watermark on were already scraped by an earlier run
+            stats["reached_watermark"] = True
+            job_ids = job_ids[:job_ids.index(stop_at)]
+        indexes = [i for i, job_id in enumerate(job_ids) if job_id not in seen_ids]
+        stats["cards"] += len(links)
+        stats["skipped"] += len(links) - len(indexes)
+        if not indexes:
+            return []
+
+    started = time.perf_counter()
+    cards = await page.eval_on_selector_all(
+        card_selector, JOB_CARD_JS, {"selectors": JOB_CARD_SELECTORS, "indexes": indexes}
+    )
+    if indexes is None:
+        stats["cards"] += len(cards)
+        stats["first_job_id"] = extract_job_id(cards[0].get("job_link")) if cards else None
+    stats["extracted"] += len(cards)
+    stats["extract_seconds"] += time.perf_counter() - started
+
+    jobs = [build_job_record(fields, datetime_now) for fields in cards]
+    return [job for job in jobs if job]
+
+
+async def extract_job_cards(page, datetime_now, mode="evaluate", seen_ids=None, stats=None, stop_at=None):
+    """
+    Extract the job cards of an already loaded search results page.
+    `mode` is 'evaluate' (one round trip for the whole page) or 'selectors'
+    (one round trip per field, kept for comparison).
+    Cards whose job_id is in `seen_ids` are skipped after reading only their link, and so
+    are the card with the job_id `stop_at` and every card after it.
+    Cards missing optional fields get None instead of failing.
+    """
+    seen_ids = seen_ids if seen_ids is not None else set()
+    stats = stats if stats is not None else new_scrape_stats()
+
+    # Wait for the job list to load
+    await page.wait_for_selector(JOB_LIST_SELECTOR)  # Adjust selector if needed
+
+    if mode == "selectors":
+        return await extract_job_cards_selectors(page, datetime_now, seen_ids, stats, stop_at)
+    return await extract_job_cards_evaluate(page, datetime_now, seen_ids, stats, stop_at)
+
+
+async def scrape_query(context, query_url, semaphore, datetime_now, seen_ids=None, stats=None, on_jobs=None,
+                       schedule=None, max_pages=1, leases=None, lease_hold=0):
+    """
+    Scrape a single query URL on its own page of a shared browser context.
+    Result pages are followed until the watermark of the query in `schedule`, a page
+    without any unseen job, or `max_pages`.
+    `on_jobs(jobs)` is called as soon as the query is done, before the other queries finish.
+    With `leases`, the query is skipped when another worker holds its lease, and after a
+    successful scrape the lease is kept `lease_hold` more seconds so nobody scrapes it again
+    before its next poll.
+    """
+    async with semaphore:
+        # Taken once a page is free, so queued queries stay available to the other workers
+        lease = f"query:{query_url}"
+        if leases is not None and not leases.acquire(lease):
+            print(f"Raw Step: {query_url} is leased by another worker, skipped.")
+            return []
+        if leases is not None and schedule is not None:
+            schedule.refresh(query_url)
+        try:
+            jobs = await _scrape_query(
+                context, query_url, datetime_now, seen_ids, stats, on_jobs, schedule, max_pages
+            )
+        except BaseException:
+            if leases is not None:
+                leases.release(lease)
+            raise
+        if leases is not None:
+            leases.release(lease, keep_for=lease_hold)
+        return jobs
+
+
+async def _scrape_query(context, query_url, datetime_now, seen_ids=None, stats=None, on_jobs=None,
+                        schedule=None, max_pages=1):
+    stats = stats if stats is not None else new_scrape_stats()
+    watermark = schedule.watermark(query_url) if schedule else None
+    started = time.perf_counter()
+    jobs = []
+    newest_id = None
+    reached_watermark = False
+    n_pages = 0
+    page = await context.new_page()
+    transfers = track_transfer(page, stats)
+    try:
+        for page_number in range(1, max_pages + 1):
+            # Navigate to the Upwork query URL
+            load_started = time.perf_counter()
+            with get_metrics().span("page_load", query_url):
+                await page.goto(page_url(query_url, page_number))
+            stats["load_seconds"] += time.perf_counter() - load_started
+            page_stats = new_scrape_stats()
+            try:
+                page_jobs = await extract_job_cards(
+                    page, datetime_now, seen_ids=seen_ids, stats=page_stats, stop_at=watermark
+                )
+            except PlaywrightTimeoutError:
+                # Past the last result page there is no job list to wait for
+                if page_number == 1:
+                    raise
+                reached_watermark = True
+                break
+            n_pages += 1
+            for key in ("cards", "skipped", "extracted", "extract_seconds"):
+                stats[key] += page_stats[key]
+            newest_id = newest_id or page_stats["first_job_id"]
+            jobs.extend(page_jobs)
+            # Older pages only hold jobs scraped by earlier runs
+            if page_stats["reached_watermark"] or not page_jobs:
+                reached_watermark = True
+                break
+    finally:
+        await asyncio.gather(*transfers, return_exceptions=True)
+        await page.close()
+    stats["pages"] += n_pages
+
+    elapsed = time.perf_counter() - started
+    get_metrics().add_span("scrape_query", elapsed, query_url)
+    print(f"Raw Step: Found {len(jobs)} new job elements on {n_pages} pages in {elapsed:.2f}s for {query_url}")
+    if schedule is not None:
+        schedule.update(query_url, len(jobs), n_pages, newest_id, reached_watermark)
+    if on_jobs is not None:
+        result = on_jobs(jobs)
+        # The stream pipeline saves the jobs off the event loop
+        if asyncio.iscoroutine(result):
+            await result
+    return jobs
+
+
+async def scrape_queries(query_urls, max_concurrency=3, datetime_now=None, seen_ids=None, on_jobs=None,
+                         schedule=None, max_pages=1, route_filter=None, storage_state=None,
+                         leases=None, lease_hold=0):
+    """
+    Scrape several query URLs with one browser and one context for the whole run.
+    Each query gets its own page and at most `max_concurrency` pages are open at once.
+    With a `schedule`, each query follows up to `max_pages` result pages until its watermark
+    and the schedule is saved with the new watermarks and poll times.
+    `route_filter` (a RouteFilter) aborts the requests the scraper does not need, and the
+    context cookies are loaded from and saved to the `storage_state` file.
+    With `leases` (a LeaseStore), queries leased by other workers are skipped.
+    Returns the merged list of job records, without the jobs in `seen_ids`.
+    """
+    if not query_urls:
+        return []
+    datetime_now = datetime_now or pd.Timestamp.now().strftime("%Y-%m-%d %H:%M:%S")
+    started = time.perf_counter()
+    stats = new_scrape_stats()
+
+    async with async_playwright() as p:
+        with get_metrics().span("browser_start"):
+            browser = await p.chromium.launch(headless=True)  # Set to True for headless mode
+        try:
+            context = await browser.new_context(
+                user_agent=USER_AGENT,
+                locale='en-US',
+                viewport={'width': 1280, 'height': 720},
+                storage_state=storage_state if storage_state and os.path.exists(storage_state) else None,
+            )
+            if route_filter is not None:
+                await route_filter.install(context)
+            semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+            results = await asyncio.gather(
+                *[
+                    scrape_query(context, query_url, semaphore, datetime_now, seen_ids=seen_ids,
+                                 stats=stats, on_jobs=on_jobs, schedule=schedule, max_pages=max_pages,
+                                 leases=leases, lease_hold=lease_hold)
+                    for query_url in query_urls
+                ],
+                return_exceptions=True
+            )
+            if storage_state:
+                await context.storage_state(path=storage_state)
+        finally:
+            # Close the browser
+            await browser.close()
+            if schedule is not None:
+                schedule.save()
+
+    jobs = []
+    for query_url, result in zip(query_urls, results):
+        if isinstance(result, Exception):
+            get_metrics().count("scrape_errors")
+            print(f"Raw Step: Failed to scrape {query_url}: {result}")
+            continue
+        jobs.extend(result)
+
+    print(f"Raw Step: Scraped {len(query_urls)} queries in {time.perf_counter() - started:.2f}s.")
+    if stats["pages"]:
+        print(f"Raw Step: Fetched {stats['pages']} pages, {len(jobs) / stats['pages']:.1f} new jobs per page.")
+        blocked = route_filter.blocked if route_filter is not None else 0
+        print(
+            f"Raw Step: Page loads took {stats['load_seconds'] / stats['pages']:.2f}s on average, "
+            f"{stats['bytes'] / 1e6:.2f}MB in {stats['requests']} requests, {blocked} requests blocked."
+        )
+        get_metrics().count("scrape_bytes", stats["bytes"])
+        get_metrics().count("scrape_blocked_requests", blocked)
+
+    # Time saved is estimated from the average cost of a full card extraction in this run
+    seconds_per_card = stats["extract_seconds"] / stats["extracted"] if stats["extracted"] else 0.0
+    print(
+        f"Raw Step: Skipped {stats['skipped']} of {stats['cards']} cards already seen, "
+        f"saving about {stats['skipped'] * seconds_per_card:.2f}s of extraction."
+    )
+    return jobs
+
+
+def load_query_schedule(query_urls, RAW_PATH, only_due=False, poll_min_interval=600,
+                        poll_max_interval=6 * 3600, poll_target_new_jobs=20):
+    """The query schedule and the queries to scrape now, all of them unless `only_due`."""
+    schedule = QuerySchedule.load(
+        RAW_PATH, min_interval=poll_min_interval, max_interval=poll_max_interval,
+        target_new_jobs=poll_target_new_jobs
+    )
+    if only_due:
+        due_urls = schedule.due(query_urls)
+        print(f"Raw Step: {len(due_urls)} of {len(query_urls)} queries are due.")
+        query_urls = due_urls
+    return schedule, query_urls
+
+
+async def get_upwork_jobs(query_urls, RAW_PATH, max_concurrency=3, max_pages=1, only_due=False, route_filter=True,
+                          block_resource_types=None, allowed_domains=None, blocked_domains=None, **poll_options):
+    if isinstance(query_urls, str):
+        query_urls = [query_urls]
+
+    datetime_now = pd.Timestamp.now().strftime("%Y-%m-%d %H:%M:%S")
+    print(f"Scraping Upwork jobs at {datetime_now}...")
+    schedule, query_urls = load_query_schedule(query_urls, RAW_PATH, only_due, **poll_options)
+
+    # Loaded once per run, cards already seen are skipped before extracting their fields
+    seen_index = SeenIndex.load(RAW_PATH)
+    print(f"Raw Step: Found {len(seen_index)} raw job IDs.")
+
+    jobs = await scrape_queries(
+        query_urls, max_concurrency=max_concurrency, datetime_now=datetime_now, seen_ids=seen_index,
+        schedule=schedule, max_pages=max_pages, storage_state=storage_state_path(RAW_PATH),
+        route_filter=new_route_filter(route_filter, block_resource_types, allowed_domains, blocked_domains),
+        leases=get_leases(), lease_hold=schedule.min_interval
+    )
+    save_raw_jobs(jobs, RAW_PATH, seen_index)
+
+
+def save_raw_jobs(jobs, RAW_PATH, seen_index):
+    """Append the jobs not in `seen_index` to the raw dataset and return them as a DataFrame."""
+    if not jobs:
+        print("Raw Step: Found 0 new jobs to download.")
+        seen_index.save()
+        return pd.DataFrame(columns=RAW_SCHEMA.names)
+
+    with get_metrics().span("dedup"):
+        jobs_df = pd.DataFrame(jobs)
+        jobs_df["datetime"] = pd.to_datetime(jobs_df["datetime"], errors='coerce')
+        # The same job often shows up in more than one query
+        jobs_df = jobs_df.drop_duplicates(subset="job_id")
+        jobs_df = jobs_df[~jobs_df['job_id'].isin(seen_index.ids)].reset_index(drop=True)
+    print(f"Raw Step: Found {len(jobs_df)} new jobs to download.")
+
+    # Only the new jobs are written, as a new file of the raw dataset
+    if not jobs_df.empty:
+        append_dataset(jobs_df, RAW_PATH, RAW_SCHEMA, "raw")
+
+    # The index is only updated once the rows are safely on disk
+    seen_index.add(jobs_df['job_id'])
+    seen_index.save()
+    return jobs_df
+
+
+# Regex fragments matched at the start of a word, in lower case text
+PREFILTER_INCLUDE_TERMS = [
+    "data", "statistic", "analy", "machine learning", r"ml\b", r"ai\b", r"llms?\b", r"nlp\b",
+    "python", r"sql\b", "scrap", "crawl", "dashboard", "power bi", "tableau", "model",
+    "forecast", "regression", "predict", "etl", "pipeline", "automat", "excel", "spreadsheet",
+    "a/b test", "experiment", "survey", "research", "visuali", "deep learning", "dataset",
+]
+PREFILTER_EXCLUDE_TERMS = [
+    "logo", "graphic design", "video edit", "voice over", "translat", "transcri", "wordpress",
+    "shopify", r"seo\b", "social media manag", "copywrit", "ghostwrit", "illustrat", "3d model",
+    "cold call", "appointment sett", "virtual assistant", "customer service",
+]
+
+
+def terms_pattern(terms):
+    return r"\b(?:" + "|".join(terms) + ")"
+
+
+def prefilter_scores(jobs_df, include_terms=PREFILTER_INCLUDE_TERMS, exclude_terms=PREFILTER_EXCLUDE_TERMS):
+    """
+    Keyword score of every row in one vectorized pass over job_title and job_description.
+    Title matches weigh more than description matches, which are capped so a long
+    description cannot outweigh an off-topic title.
+    """
+    title = jobs_df["job_title"].fillna("").str.lower()
+    description = jobs_df["job_description"].fillna("").str.lower()
+    include = terms_pattern(include_terms)
+    exclude = terms_pattern(exclude_terms)
+
+    return (
+        2 * title.str.count(include) + description.str.count(include).clip(upper=10)
+        - 3 * title.str.count(exclude) - description.str.count(exclude).clip(upper=5)
+    )
+
+
+def prefilter_jobs(jobs_df, threshold=1, include_terms=PREFILTER_INCLUDE_TERMS, exclude_terms=PREFILTER_EXCLUDE_TERMS):
+    """
+    Split `jobs_df` into the rows worth an LLM call and the rows rejected by the keyword score.
+    Rejected rows come back with their evaluation columns filled in (apply = False, model = 'prefilter').
+    """
+    scores = prefilter_scores(jobs_df, include_terms, exclude_terms)
+    rejected = scores < threshold
+
+    rejected_df = jobs_df[rejected].assign(
+        match_level=0.0,
+        apply=False,
+        reason="Prefilter: keyword score " + scores[rejected].astype(str) + f" below threshold {threshold}",
+        model="prefilter",
+    )
+    return jobs_df[~rejected], rejected_df
+
+
+def pending_staging_jobs(RAW_PATH, STAGING_PATH, window_days=None):
+    """
+    The raw jobs that are not in staging yet, and the number of jobs already in staging,
+    both within the last `window_days` scrape dates. Staging rows keep the scrape datetime
+    of their raw row, so both datasets are pruned to the same partitions.
+    """
+    if not dataset_exists(RAW_PATH, window_days):
+        return pd.DataFrame(columns=RAW_SCHEMA.names), 0
+    with get_metrics().span("parquet_read", "pending_staging"):
+        return _pending_staging_jobs(RAW_PATH, STAGING_PATH, window_days)
+
+
+def _pending_staging_jobs(RAW_PATH, STAGING_PATH, window_days=None):
+
+    if dataset_exists(STAGING_PATH, window_days):
+        staging_job_ids = f"(SELECT DISTINCT job_id FROM {read_dataset_sql(STAGING_PATH, window_days)})"
+        n_staging = duckdb.query(f"SELECT count(*) FROM {staging_job_ids}").fetchone()[0]
+        jobs_df = duckdb.query(f"""
+            SELECT raw.*
+            FROM {read_latest_sql(RAW_PATH, window_days=window_days)} AS raw
+            ANTI JOIN {staging_job_ids} AS staging USING (job_id)
+            ;
+        """).to_df()
+    else:
+        n_staging = 0
+        jobs_df = duckdb.query(f"SELECT * FROM {read_latest_sql(RAW_PATH, window_days=window_days)};").to_df()
+
+    return jobs_df, n_staging
+
+
+def prepare_staging_rows(jobs_df):
+    """Columns added to the raw jobs before they are evaluated, descriptions included."""
+    jobs_df = with_descriptions(jobs_df)
+    jobs_df = jobs_df.copy()
+    jobs_df['post_date'], n_unrecognized = parse_posted_dates(jobs_df['datetime'], jobs_df['job_post_date'])
+    if n_unrecognized:
+        print(f"Staging Step: {n_unrecognized} jobs have an unrecognized post date.")
+    jobs_df['job_link'] = "http://www.upwork.com" + jobs_df['job_link']
+    return jobs_df
+
+
+def stage_without_llm(jobs_df, STAGING_PATH, cache, prefilter_threshold=1,
+                      prefilter_include_terms=None, prefilter_exclude_terms=None, reposts=None):
+    """
+    Write to staging the jobs that need no LLM call: the ones rejected by the prefilter
+    (None disables it), the ones found in the evaluation cache and the reposts of an
+    evaluated job found in `reposts` (None disables it), which inherit its evaluation.
+    Near-duplicates among the jobs left are held in `reposts` and written with the
+    evaluation of their original (write_results).
+    Returns the jobs left for the LLM and the cached results, keyed by index.
+    Reposts are not returned, they are never sent again.
+    """
+    n_jobs = len(jobs_df)
+    if prefilter_threshold is not None:
+        jobs_df, rejected_df = prefilter_jobs(
+            jobs_df, prefilter_threshold,
+            prefilter_include_terms or PREFILTER_INCLUDE_TERMS,
+            prefilter_exclude_terms or PREFILTER_EXCLUDE_TERMS
+        )
+        if not rejected_df.empty:
+            append_dataset(rejected_df, STAGING_PATH, STAGING_SCHEMA, "staging")
+        print(f"Staging Step: Prefilter rejected {len(rejected_df)} of {n_jobs} jobs, "
+              f"{len(rejected_df)} LLM calls avoided.")
+
+    cached = cache.get_many(jobs_df)
+    write_results(jobs_df, cached, STAGING_PATH, reposts=reposts)
+    print(f"Staging Step: Evaluation cache hits {cache.hits}, misses {cache.misses} ({len(cache)} entries).")
+    jobs_df = jobs_df.drop(index=list(cached))
+
+    if reposts is not None:
+        found = reposts.find_many(jobs_df)
+        write_results(jobs_df, found, STAGING_PATH)
+        jobs_df = jobs_df.drop(index=list(found))
+        n_held = reposts.held_count()
+        jobs_df = reposts.hold_duplicates(jobs_df)
+        print(f"Staging Step: Found {len(found)} reposts of evaluated jobs ({len(reposts)} jobs indexed), "
+              f"{reposts.held_count() - n_held} of jobs not evaluated yet.")
+
+    return jobs_df, cached
+
+
+def open_evaluation_cache(STAGING_PATH, cache_path=None, cache_max_entries=50_000, cache_max_age_days=30):
+    return EvaluationCache(
+        cache_path or os.path.join(STAGING_PATH, "_eval_cache.sqlite"),
+        max_entries=cache_max_entries, max_age_days=cache_max_age_days
+    )
+
+
+async def evaluate_pending_jobs(pending_df, STAGING_PATH, cache, reposts=None, leases=None, batch_threshold=None,
+                                batch_poll_interval=30, batch_wait=True, **eval_options):
+    """
+    Evaluate the jobs left for the LLM: through the Batch API when there are at least
+    `batch_threshold` of them or a batch is still pending, and this worker holds the "batch"
+    lease, otherwise with evaluate_jobs_async and `eval_options`.
+    With `batch_wait` False the batch is only submitted or checked once (evaluate_jobs_batch).
+    Returns the number of jobs written to staging.
+    """
+    if pending_df.empty:
+        return 0
+    use_batch = os.path.exists(pending_batch_path(STAGING_PATH)) or (
+        batch_threshold is not None and len(pending_df) >= batch_threshold
+    )
+    if use_batch and leases is not None and not leases.acquire("batch"):
+        # The jobs of that batch stay claimed by its owner, the ones claimed here are not in it
+        print("Staging Step: The Batch API job belongs to another worker, evaluating without it.")
+        use_batch = False
+    if not use_batch:
+        return await evaluate_jobs_async(pending_df, STAGING_PATH, cache=cache, reposts=reposts, **eval_options)
+    try:
+        return await evaluate_jobs_batch(
+            pending_df, STAGING_PATH, poll_interval=batch_poll_interval, cache=cache, reposts=reposts, wait=batch_wait
+        )
+    finally:
+        if leases is not None:
+            leases.release("batch")
+
+
+def staging_jobs(RAW_PATH, STAGING_PATH, batch_threshold=None, batch_poll_interval=30,
+                 cache_path=None, cache_max_entries=50_000, cache_max_age_days=30,
+                 prefilter_threshold=1, prefilter_include_terms=None, prefilter_exclude_terms=None,
+                 repost_index_path=None, repost_threshold=0.6, window_days=None, **eval_options):
+    """
+    Evaluate the raw jobs of the last `window_days` scrape dates that are not in staging yet.
+    Jobs rejected by the prefilter, found in the evaluation cache or reposts of an evaluated
+    job (`repost_threshold` None disables the detection) are written right away.
+    Backlogs of at least `batch_threshold` jobs (or with a batch still pending) go through
+    the Batch API, smaller ones through evaluate_jobs_async with `eval_options`
+    (concurrency, rate limits, checkpointing).
+    With several workers, each one only evaluates the pending jobs it claimed, and the
+    Batch API is used by the worker holding the "batch" lease.
+    """
+    leases = get_leases()
+    jobs_df, n_staging = pending_staging_jobs(RAW_PATH, STAGING_PATH, window_days)
+    print(f"Staging Step: Found {n_staging} staging job IDs.")
+    jobs_df = claim_pending_jobs(jobs_df, leases)
+    print(f"Staging Step: Found {len(jobs_df)} new jobs to evaluate.")
+
+    if not jobs_df.empty:
+        jobs_df = prepare_staging_rows(jobs_df)
+
+        cache = open_evaluation_cache(STAGING_PATH, cache_path, cache_max_entries, cache_max_age_days)
+        reposts = open_repost_index(STAGING_PATH, repost_index_path, repost_threshold)
+        try:
+            pending_df, _ = stage_without_llm(
+                jobs_df, STAGING_PATH, cache, prefilter_threshold,
+                prefilter_include_terms, prefilter_exclude_terms, reposts
+            )
+            written = len(jobs_df) - len(pending_df)
+            written += asyncio.run(evaluate_pending_jobs(
+                pending_df, STAGING_PATH, cache, reposts, leases, batch_threshold, batch_poll_interval, **eval_options
+            ))
+            cache.evict()
+        finally:
+            cache.close()
+            if reposts is not None:
+                reposts.close()
+            if leases is not None:
+                leases.settle_jobs(jobs_df["job_id"])
+
+        print(f"Staging Step: {written} of {len(jobs_df)} new jobs were evaluated.")
+    else:
+        print("Staging Step: No new jobs need evaluation.")
+
+
+async def stream_pipeline(query_urls, RAW_PATH, STAGING_PATH, send_queue, max_concurrency=3,
+                          max_pages=1, only_due=False, poll_min_interval=600, poll_max_interval=6 * 3600,
+                          poll_target_new_jobs=20, route_filter=True, block_resource_types=None,
+                          allowed_domains=None, blocked_domains=None, cache_path=None, cache_max_entries=50_000, cache_max_age_days=30,
+                          prefilter_threshold=1, prefilter_include_terms=None, prefilter_exclude_terms=None,
+                          repost_index_path=None, repost_threshold=0.6, window_days=None, batch_threshold=None,
+                          batch_poll_interval=30, requests_per_minute=500, tokens_per_minute=200_000,
+                          **eval_options):
+    """
+    Scrape and evaluate in the current process, with the stages connected by asyncio queues:
+    the new jobs of each query go to evaluation as soon as that query is scraped, and every
+    job evaluated with apply = True is put on `send_queue` right away, as a dict.
+    None is put on `send_queue` when the pipeline is done, even if it failed.
+    Raw jobs left pending by earlier runs are evaluated first. A backlog of at least
+    `batch_threshold` jobs (or with a batch still pending) goes through the Batch API
+    instead, next to the streamed jobs. The batch is submitted without waiting for it, and
+    each later run checks it once and merges it when it finished; its results are only
+    written to staging, for the caller to send with the other unsent jobs.
+    With several workers, queries leased by another worker are skipped and only the jobs
+    claimed by this one are evaluated.
+    """
+    eval_queue = asyncio.Queue()
+    try:
+        leases = get_leases()
+        datetime_now = pd.Timestamp.now().strftime("%Y-%m-%d %H:%M:%S")
+        print(f"Scraping Upwork jobs at {datetime_now}...")
+        # DuckDB, parquet and SQLite work runs in threads, the event loop keeps scraping and sending
+        schedule, query_urls = await asyncio.to_thread(
+            load_query_schedule,
+            query_urls, RAW_PATH, only_due, poll_min_interval, poll_max_interval, poll_target_new_jobs
+        )
+
+        seen_index = await asyncio.to_thread(SeenIndex.load, RAW_PATH)
+        print(f"Raw Step: Found {len(seen_index)} raw job IDs.")
+
+        backlog_df, _ = await asyncio.to_thread(pending_staging_jobs, RAW_PATH, STAGING_PATH, window_days)
+        batch_backlog = not backlog_df.empty and (os.path.exists(pending_batch_path(STAGING_PATH)) or (
+            batch_threshold is not None and len(backlog_df) >= batch_threshold
+        ))
+        if not backlog_df.empty:
+            print(f"Staging Step: Found {len(backlog_df)} jobs pending from earlier runs.")
+            if not batch_backlog:
+                eval_queue.put_nowait(backlog_df)
+
+        # Shared by the stages, so together they stay within the rate limits
+        limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        stores_lock = asyncio.Lock()
+
+        async def open_stores():
+            """Evaluation cache and repost index of one stage, their SQLite connections are not shared."""
+            cache = await asyncio.to_thread(
+                open_evaluation_cache, STAGING_PATH, cache_path, cache_max_entries, cache_max_age_days
+            )
+            try:
+                # Building the index the first time reads the whole staging history, only one stage does it
+                async with stores_lock:
+                    reposts = await asyncio.to_thread(open_repost_index, STAGING_PATH, repost_index_path, repost_threshold)
+            except BaseException:
+                cache.close()
+                raise
+            return cache, reposts
+
+        # Queries finishing together must not add to the seen index at the same time
+        raw_lock = asyncio.Lock()
+
+        async def on_jobs(jobs):
+            async with raw_lock:
+                new_df = await asyncio.to_thread(save_raw_jobs, jobs, RAW_PATH, seen_index)
+            if not new_df.empty:
+                eval_queue.put_nowait(new_df)
+
+        def forward(row, result):
+            if result.get("apply"):
+                send_queue.put_nowait({**row.to_dict(), **result})
+
+        async def scrape_stage():
+            try:
+                await scrape_queries(
+                    query_urls, max_concurrency=max_concurrency, datetime_now=datetime_now,
+                    seen_ids=seen_index, on_jobs=on_jobs, schedule=schedule, max_pages=max_pages,
+                    storage_state=storage_state_path(RAW_PATH),
+                    route_filter=new_route_filter(route_filter, block_resource_types, allowed_domains, blocked_domains),
+                    leases=leases, lease_hold=poll_min_interval
+                )
+            finally:
+                await eval_queue.put(None)
+
+        async def evaluate_stage():
+            client = openai.AsyncOpenAI(max_retries=0)
+            cache = reposts = None
+            try:
+                cache, reposts = await open_stores()
+                while True:
+                    jobs_df = await eval_queue.get()
+                    if jobs_df is None:
+                        break
+                    jobs_df = claim_pending_jobs(jobs_df, leases)
+                    if jobs_df.empty:
+                        continue
+
+                    try:
+                        jobs_df = await asyncio.to_thread(prepare_staging_rows, jobs_df)
+                        pending_df, cached = await asyncio.to_thread(
+                            stage_without_llm, jobs_df, STAGING_PATH, cache, prefilter_threshold,
+                            prefilter_include_terms, prefilter_exclude_terms, reposts
+                        )
+                        for i, result in cached.items():
+                            forward(jobs_df.loc[i], result)
+
+                        if not pending_df.empty:
+                            written = await evaluate_jobs_async(
+                                pending_df, STAGING_PATH, client=client, limiter=limiter, cache=cache,
+                                reposts=reposts, on_result=forward, **eval_options
+                            )
+                            print(f"Staging Step: {written} of {len(pending_df)} new jobs were evaluated.")
+                    finally:
+                        if leases is not None:
+                            leases.settle_jobs(jobs_df["job_id"])
+                await asyncio.to_thread(cache.evict)
+            finally:
+                if cache is not None:
+                    cache.close()
+                if reposts is not None:
+                    reposts.close()
+                await client.close()
+
+        async def batch_stage():
+            jobs_df = claim_pending_jobs(backlog_df, leases)
+            if jobs_df.empty:
+                return
+            cache = reposts = None
+            try:
+                cache, reposts = await open_stores()
+                jobs_df = await asyncio.to_thread(prepare_staging_rows, jobs_df)
+                pending_df, cached = await asyncio.to_thread(
+                    stage_without_llm, jobs_df, STAGING_PATH, cache, prefilter_threshold,
+                    prefilter_include_terms, prefilter_exclude_terms, reposts
+                )
+                for i, result in cached.items():
+                    forward(jobs_df.loc[i], result)
+                # Jobs evaluated without the Batch API, when too few are left, are still streamed.
+                # A batch takes up to 24h, the run does not wait for it
+                written = await evaluate_pending_jobs(
+                    pending_df, STAGING_PATH, cache, reposts, leases, batch_threshold, batch_poll_interval,
+                    batch_wait=False, limiter=limiter, on_result=forward, **eval_options
+                )
+                print(f"Staging Step: {written} of {len(pending_df)} jobs pending from earlier runs were evaluated.")
+            finally:
+                if cache is not None:
+                    cache.close()
+                if reposts is not None:
+                    reposts.close()
+                if leases is not None:
+                    leases.settle_jobs(jobs_df["job_id"])
+
+        # Every stage always runs to the end
+        stages = [scrape_stage(), evaluate_stage()] + ([batch_stage()] if batch_backlog else [])
+        results = await asyncio.gather(*stages, return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+    finally:
+        # Also when the setup fails, the consumer of send_queue waits for this None
+        await send_queue.put(None)
+
+
+def json_to_table(json_data):
+    """Convert JSON data to a pandas DataFrame."""
+    try:
+        # If the JSON data is a string, parse it
+        if isinstance(json_data, str):
+            json_data = json.loads(json_data)
+        return pd.json_normalize(json_data)
+    except json.JSONDecodeError:
+        print("Error decoding JSON:", json_data)
+        return pd.DataFrame()
+
+
+EVALUATION_SYSTEM_PROMPT = (
+    "You are an expert evaluator of freelance data science opportunities. Your task is to assess how well an Upwork job "
+    "post aligns with the professional profile of Thiago Miranda, a senior data scientist. Always return your response in valid, clean JSON format with no extra commentary."
+)
+
+FREELANCER_PROFILE = (
+    "## Freelancer Profile – Thiago Miranda\n"
+    "- Location: Dublin, Ireland\n"
+    "- Experience: 6+ years in data science and analytics using Python, R, and SQL, with strong expertise in machine learning, statistical modeling, web scraping, data visualization, and cloud services.\n"
+    "- Skills:\n"
+    "  • Data Science: machine learning (XGBoost, random forest, deep learning), NLP, LLMs, IRT models\n"
+    "  • Analytics: data wrangling, hypothesis testing, A/B testing, storytelling\n"
+    "  • Tools: Python, R, SQL (MySQL, Presto, SQL Server), AWS (SageMaker, Lambda, S3), Docker, Tableau, Power BI, Google Analytics, Git\n"
+    "- Projects: Created a football data analysis tool using web scraping, Streamlit, DuckDB, and PyArrow. Developed a CAT API integrated with Django for adaptive testing using IRT models.\n"
+    "- Domains: Education, Business, Marketplaces, Digital Products\n"
+    "- Education: MSc in Statistics, BSc in Statistics\n"
+    "- Preferences: Freelance roles involving ML, data analytics, automation, scraping, dashboards, or statistical modeling\n"
+    "- Languages: Portuguese (native), English (advanced)\n"
+)
+
+EVALUATION_INSTRUCTIONS = (
+    "## Instructions\n"
+    "Evaluate how well this job post matches the freelancer profile and return your response in valid JSON format with the following keys:\n"
+    "- match_level: a float from 0.0 to 1.0 indicating compatibility\n"
+    "- apply: true or false\n"
+    "- reason: a short, clear explanation of your decision\n\n"
+    "## JSON Format\n"
+    "{\n"
+    "  \"match_level\": float,\n"
+    "  \"apply\": boolean,\n"
+    "  \"reason\": string\n"
+    "}\n"
+)
+
+# Changes whenever the static parts of the evaluation prompt change
+PROFILE_VERSION = hashlib.sha256(
+    (EVALUATION_SYSTEM_PROMPT + FREELANCER_PROFILE + EVALUATION_INSTRUCTIONS).encode("utf-8")
+).hexdigest()[:16]
+
+
+def build_prompt_filter(row):
+    return [
+        {
+            "role": "system",
+            "content": EVALUATION_SYSTEM_PROMPT
+        },
+        {
+            "role": "user",
+            "content": (
+                FREELANCER_PROFILE +
+                "## Job Post\n"
+                f"- Title: {row['job_title']}\n"
+                f"- Description: {job_description(row)}\n"
+                f"- Experience Level Required: {row['job_experience_level']}\n"
+                f"- Fixed Price: {row['is_fixed_price']}\n"
+                f"- Duration: {row['duration_label']}\n\n" +
+                EVALUATION_INSTRUCTIONS
+            )
+        }
+    ]
+
+
+MULTI_EVALUATION_INSTRUCTIONS = (
+    "## Instructions\n"
+    "Evaluate, independently, how well each job post above matches the freelancer profile and return a valid JSON array "
+    "with one object per job post, in the same order, with the following keys:\n"
+    "- job_id: the Job ID of the post, copied exactly\n"
+    "- match_level: a float from 0.0 to 1.0 indicating compatibility\n"
+    "- apply: true or false\n"
+    "- reason: a short, clear explanation of your decision\n\n"
+    "## JSON Format\n"
+    "[\n"
+    "  {\"job_id\": string, \"match_level\": float, \"apply\": boolean, \"reason\": string}\n"
+    "]\n"
+)
+
+
+def build_prompt_filter_multi(rows):
+    """
+    Evaluation prompt of several jobs in one request. The system prompt and the profile
+    come first and never change, so the provider's prompt caching applies to them.
+    """
+    job_posts = "".join(
+        f"## Job Post {number}\n"
+        f"- Job ID: {row['job_id']}\n"
+        f"- Title: {row['job_title']}\n"
+        f"- Description: {job_description(row)}\n"
+        f"- Experience Level Required: {row['job_experience_level']}\n"
+        f"- Fixed Price: {row['is_fixed_price']}\n"
+        f"- Duration: {row['duration_label']}\n\n"
+        for number, row in enumerate(rows, start=1)
+    )
+    return [
+        {
+            "role": "system",
+            "content": EVALUATION_SYSTEM_PROMPT
+        },
+        {
+            "role": "user",
+            "content": FREELANCER_PROFILE + job_posts + MULTI_EVALUATION_INSTRUCTIONS
+        }
+    ]
+
+
+def build_prompt_apply(row):
+    impact_hooks = [
+        "This project is a perfect match for my skills — my background in machine learning, web scraping, and statistical modeling ensures I can deliver top-quality results quickly and reliably.",
+        "I bring exactly the expertise you're looking for — from Python automations to AWS deployments, I’ve delivered high-impact projects that align perfectly with your needs.",
+        "With deep experience in data extraction, machine learning, and process automation, I'm confident I can deliver outstanding results for your project.",
+        "Your project demands expertise in data science and automation — and that’s precisely what I specialize in, delivering clean, scalable solutions in Python and AWS.",
+        "If you're looking for someone who combines strong technical skills in Python, R, SQL, and AWS with business-driven results, I’m your ideal partner for this project.",
+    ]
+    hook = random.choice(impact_hooks)
+    
+    perfil_usuario = """
+    I am a Data Scientist with over six years of experience driving business growth through machine learning, 
+    data analytics, web scraping, and automation. I specialize in developing ML models (XGBoost, Random Forest, Deep Learning), 
+    automating ETL processes, and creating scalable data pipelines using Python, R, SQL, and AWS (SageMaker, Lambda, S3). 
+    I have hands-on experience with Large Language Models (LLMs), Natural Language Processing (NLP), and Computerized Adaptive Testing (CAT) systems. 
+    My projects always focus on delivering actionable insights and operational efficiencies. 
+    I am comfortable working in fast-paced environments, adapting to new challenges, 
+    and communicating effectively with both technical and non-technical stakeholders.
+    """
+        
+    prompt = f"""
+    You are a professional freelancer specialized in writing personalized Upwork cover letters.
+
+    Generate a **customized cover letter** for the following Upwork job opportunity:
+
+    ---
+    **Job Title:** {row['job_title']}
+    **Job Description:** {job_description(row)}
+    **Experience Level Required:** {row['job_experience_level']}
+    **Fixed Price:** {row['is_fixed_price']}
+    **Duration:** {row['duration_label']}
+    ---
+
+    **Profile Information:**
+    {perfil_usuario}
+
+    **Instructions:**
+    1. Start the letter with these two powerful sentences to immediately catch the client's attention:
+    "{hook}"
+
+    2. After the opening, continue with a brief paragraph that:
+    - Highlights my relevant experience (based on the job description and required skills),
+    - Shows confidence and a business-driven mindset,
+    - Avoids generic statements (be specific).
+
+    3. End with a **short call to action** inviting the client to discuss further.
+
+    4. Maintain a **professional, confident, and direct tone**.
+
+    5. Keep the entire cover letter around **150–180 words** to stay concise and impactful.
+
+    **Important:** Focus on making the first two sentences extremely convincing, because they are the ones the client will see first.
+    """
+
+    return prompt
+
+
+EVALUATION_MODEL = "gpt-4o-mini"
+
+
+def parse_evaluation(content, model):
+    """Validate the JSON answer of an evaluation prompt."""
+    try:
+        # extract everything between the first and last curly braces 
+        content = content[content.find("{"):content.rfind("}") + 1]
+        
+        # Tentar fazer parsing do JSON de forma segura
+        result = json.loads(content)
+
+        # Validação mínima dos campos esperados
+        return {
+            "match_level": float(result.get("match_level", 0)),
+            "apply": bool(result.get("apply", False)),
+            "reason": result.get("reason", ""),
+            "model": model
+        }
+    except (json.JSONDecodeError, AttributeError, TypeError, ValueError):
+        return {
+            "match_level": None,
+            "apply": None,
+            "reason": "Invalid JSON response",
+            "model": model
+        }
+
+
+def parse_multi_evaluation(content, job_ids, model):
+    """
+    Validate the JSON array answer of a multi-job evaluation prompt, item by item.
+    Returns the valid results keyed by job_id, items that are malformed, out of range or
+    for an unknown job_id are left out.
+    """
+    try:
+        items = json.loads(content[content.find("["):content.rfind("]") + 1])
+    except json.JSONDecodeError:
+        return {}
+    if not isinstance(items, list):
+        return {}
+
+    job_ids = set(job_ids)
+    results = {}
+    for item in items:
+        try:
+            job_id = str(item["job_id"])
+            match_level = float(item["match_level"])
+            apply = item["apply"]
+        except (KeyError, TypeError, ValueError):
+            continue
+        if job_id not in job_ids or not 0.0 <= match_level <= 1.0 or not isinstance(apply, bool):
+            continue
+        results[job_id] = {
+            "match_level": match_level,
+            "apply": apply,
+            "reason": str(item.get("reason", "")),
+            "model": model
+        }
+    return results
+
+
+def evaluate_job(row):
+    model = EVALUATION_MODEL
+    prompt = build_prompt_filter(row)
+    # calculate the number of tokens in the prompt
+    
+    client = openai.OpenAI()
+    
+    try:
+        
+        # Use the OpenAI API to get a response
+        with get_metrics().span("evaluate", row["job_id"]):
+            response = client.responses.create(
+                model=model,  # ou gpt-3.5-turbo se quiser economizar
+                input=prompt
+            )
+        get_metrics().record_usage(model, response.usage)
+
+        return pd.Series(parse_evaluation(response.output_text, model))
+
+    except Exception as e:
+        get_metrics().count("llm_errors")
+        print(f"Error: {str(e)}")
+        return pd.Series({
+            "match_level": None,
+            "apply": None,
+            "reason": f"Error: {str(e)}",
+            "model": model
+        })
+
+
+class TokenBucket:
+    """Allows `rate` units per second, with bursts of up to `capacity` units."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self, amount=1):
+        """Wait until `amount` units are available and take them."""
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+
+class WindowLimiter:
+    """Allows at most `limit` acquisitions in any `period` seconds, without a burst on top like TokenBucket."""
+
+    def __init__(self, limit, period):
+        self.limit = limit
+        self.period = period
+        self.acquired = collections.deque()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Wait until fewer than `limit` acquisitions happened in the last `period` seconds."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                while self.acquired and now - self.acquired[0] >= self.period:
+                    self.acquired.popleft()
+                if len(self.acquired) < self.limit:
+                    self.acquired.append(now)
+                    return
+                await asyncio.sleep(self.period - (now - self.acquired[0]))
+
+
+class RateLimiter:
+    """Requests per minute and tokens per minute limits of the OpenAI API."""
+
+    def __init__(self, requests_per_minute=500, tokens_per_minute=200_000):
+        self.requests = TokenBucket(requests_per_minute / 60, requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute / 60, tokens_per_minute)
+
+    async def acquire(self, n_tokens):
+        await self.requests.acquire(1)
+        await self.tokens.acquire(n_tokens)
+
+
+def estimate_tokens(prompt, max_output_tokens=200):
+    """Rough token count of a prompt (~4 characters per token) plus the expected answer."""
+    if isinstance(prompt, str):
+        n_chars = len(prompt)
+    else:
+        n_chars = sum(len(message["content"]) for message in prompt)
+    return n_chars // 4 + max_output_tokens
+
+
+def is_retryable(error):
+    """429s, 5xx and connection errors are worth retrying, other API errors are not."""
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return isinstance(error, openai.APIConnectionError)
+
+
+async def call_with_retries(call, max_retries=5, base_delay=1.0, max_delay=60.0):
+    """Await `call()` retrying retryable errors with exponential backoff and jitter."""
+    for attempt in range(max_retries + 1):
+        try:
+            return await call()
+        except Exception as e:
+            if attempt == max_retries or not is_retryable(e):
+                get_metrics().count("llm_errors")
+                raise
+            get_metrics().count("llm_retries")
+            delay = min(max_delay, base_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+            print(f"Retrying after {type(e).__name__} in {delay:.1f}s (attempt {attempt + 1} of {max_retries}).")
+            await asyncio.sleep(delay)
+
+
+async def evaluate_job_async(client, row, limiter, model=EVALUATION_MODEL):
+    """
+    Async version of evaluate_job sharing `client` and `limiter` between workers.
+    Returns None when the request still fails after the retries, so the job is
+    evaluated again on the next run.
+    """
+    prompt = build_prompt_filter(row)
+    n_tokens = estimate_tokens(prompt)
+
+    async def call():
+        await limiter.acquire(n_tokens)
+        return await client.responses.create(model=model, input=prompt)
+
+    try:
+        with get_metrics().span("evaluate", row["job_id"]):
+            response = await call_with_retries(call)
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        return None
+
+    get_metrics().record_usage(model, response.usage)
+    return parse_evaluation(response.output_text, model)
+
+
+async def evaluate_job_group_async(client, rows, limiter, model=EVALUATION_MODEL):
+    """
+    Evaluate `rows` with a single multi-job request. Jobs missing from the answer or with
+    an invalid item are evaluated again one by one with evaluate_job_async.
+    Returns a result (or None on failure) per row, in order.
+    """
+    if len(rows) == 1:
+        return [await evaluate_job_async(client, rows[0], limiter, model)]
+
+    prompt = build_prompt_filter_multi(rows)
+    n_tokens = estimate_tokens(prompt, max_output_tokens=200 * len(rows))
+
+    async def call():
+        await limiter.acquire(n_tokens)
+        return await client.responses.create(model=model, input=prompt)
+
+    results = {}
+    try:
+        with get_metrics().span("evaluate_group", f"{len(rows)} jobs"):
+            response = await call_with_retries(call)
+        get_metrics().record_usage(model, response.usage)
+        results = parse_multi_evaluation(response.output_text, [row["job_id"] for row in rows], model)
+    except Exception as e:
+        print(f"Error: {str(e)}")
+
+    missing = [row for row in rows if row["job_id"] not in results]
+    if missing:
+        get_metrics().count("multi_eval_fallbacks", len(missing))
+        retried = await asyncio.gather(*[evaluate_job_async(client, row, limiter, model) for row in missing])
+        results.update({row["job_id"]: result for row, result in zip(missing, retried)})
+    return [results[row["job_id"]] for row in rows]
+
+
+class EvaluationCache:
+    """
+    Persistent cache of LLM evaluations in a SQLite file, keyed by a hash of the exact prompt
+    inputs: the job fields, the model and PROFILE_VERSION. Editing the profile or switching
+    models changes the keys, and entries of older profile versions are dropped on eviction.
+    Entries older than `max_age_days` are evicted, then the least recently used ones
+    above `max_entries`.
+    """
 
-        page = await context.new_page()
-
-
-        # Navigate to the Upwork query URL
-        await page.goto(query_url)
-
-        # Wait for the job list to load
-        await page.wait_for_selector('section.card-list-container')  # Adjust selector if needed
-        job_card = await page.query_selector('section.card-list-container')
-
-        # Extract job titles and links
-        job_elements = await job_card.query_selector_all("article[class^='job-tile']")
-        print(f"Raw Step: Found {len(job_elements)} job elements.")
-
-        for job_element in job_elements:
-            job_date_post_element = await job_element.query_selector("small[class^='text-light']")
-            title_element = await job_element.query_selector("h2")
-            link_element = await title_element.query_selector('a')
-
-            job_description_element = await job_element.query_selector('p')
-
-            job_type_level_element = await job_element.query_selector('li[data-test="job-type-label"]')
-            job_experience_level_element = await job_element.query_selector('li[data-test="experience-level"]')
-            is_fixed_price_element = await job_element.query_selector('li[data-test="is-fixed-price"]')
-            duration_label_element = await job_element.query_selector('li[data-test="duration-label"]')
-
-            if title_element and link_element:
-                job_post_date = await job_date_post_element.inner_text()
-                title = await title_element.inner_text()
-                link = await link_element.get_attribute('href')
-                job_description_element = await job_description_element.inner_text()
-
-                job_type_level = await job_type_level_element.inner_text() if job_type_level_element else None
-                job_experience_level = await job_experience_level_element.inner_text() if job_experience_level_element else None
-                is_fixed_price = await is_fixed_price_element.inner_text() if is_fixed_price_element else None
-                duration_label = await duration_label_element.inner_text() if duration_label_element else None
-
-                # extract the job_id from the job_link, it is between the last '~' and '/'
-                job_id = re.search(r'~([^/]+)', link).group(1) if link else None
-
-                # print(f"Job Title: {title}, Job Link: {link}, Job Date Post: {job_date_post}")
-                # Append to the list
-                jobs.append({
-                    "job_id": job_id, 
-                    "job_title": title, 
-                    "job_description": job_description_element,
-                    "job_link": link, 
-                    "job_post_date": job_post_date, 
-                    "job_type_level": job_type_level,
-                    "job_experience_level": job_experience_level,
-                    "is_fixed_price": is_fixed_price,
-                    "duration_label": duration_label,
-                    "datetime": datetime_now})
-    
-        # Close the browser
-        await browser.close()
+    def __init__(self, path, max_entries=50_000, max_age_days=30):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Opened and used from asyncio.to_thread workers, one at a time
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS evaluations (
+                key TEXT PRIMARY KEY,
+                result TEXT NOT NULL,
+                model TEXT NOT NULL,
+                profile_version TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                used_at REAL NOT NULL
+            )
+        """)
+        self.conn.commit()
 
-    jobs_df = pd.DataFrame(jobs)
-    jobs_df["datetime"] = pd.to_datetime(jobs_df["datetime"], errors='coerce')
+    @staticmethod
+    def key(row, model=EVALUATION_MODEL):
+        inputs = [
+            row["job_title"], job_description(row), row["job_experience_level"],
+            row["is_fixed_price"], row["duration_label"], model, PROFILE_VERSION
+        ]
+        return hashlib.sha256(json.dumps([str(value) for value in inputs]).encode("utf-8")).hexdigest()
 
-    try:
-        df_raw = duckdb.query(f"""
-            SELECT * FROM read_parquet('{RAW_PATH}/*.parquet')
-            ;
-        """).to_df()
-    except:
-        df_raw = pd.DataFrame(columns=["job_id"])
-    
-    raw_job_ids = df_raw['job_id'].unique() if not df_raw.empty else []
-    print(f"Raw Step: Found {len(raw_job_ids)} raw job IDs.")
-    # Filter out jobs that have already been downloaded
-    jobs_df = jobs_df[~jobs_df['job_id'].isin(raw_job_ids)]
-    print(f"Raw Step: Found {len(jobs_df)} new jobs to download.")
+    def __len__(self):
+        return self.conn.execute("SELECT count(*) FROM evaluations").fetchone()[0]
 
-    # Append the new jobs to the existing DataFrame
-    if not jobs_df.empty:
-        df_raw = pd.concat([df_raw, jobs_df], ignore_index=True)
-    
-        jobs_df_schema = pa.schema([
-            ("job_id", pa.string()),
-            ("job_title", pa.string()),
-            ("job_description", pa.string()),
-            ("job_link", pa.string()),
-            ("job_post_date", pa.string()),
-            ("job_type_level", pa.string()),
-            ("job_experience_level", pa.string()),
-            ("is_fixed_price", pa.string()),
-            ("duration_label", pa.string()),
-            ("datetime", pa.timestamp('ns'))
-        ])
-        
-        pq.write_to_dataset(
-            pa.Table.from_pandas(df_raw, schema=jobs_df_schema, preserve_index=False), 
-            root_path='app/data/raw', 
-            basename_template='raw_{i}.parquet'
-        )
+    def get_many(self, jobs_df, model=EVALUATION_MODEL):
+        """Cached evaluations of the rows of `jobs_df`, keyed by index."""
+        keys = {i: self.key(row, model) for i, row in jobs_df.iterrows()}
+        found = {}
+        unique_keys = list(set(keys.values()))
+        # Stay below the SQLite limit of variables per query
+        for start in range(0, len(unique_keys), 500):
+            chunk = unique_keys[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            found.update(self.conn.execute(
+                f"SELECT key, result FROM evaluations WHERE key IN ({placeholders})", chunk
+            ).fetchall())
 
-def staging_jobs(RAW_PATH, STAGING_PATH):
-    try:
-        df_raw = duckdb.query(f"""
-            SELECT 
-                *
-            FROM read_parquet('{RAW_PATH}/*.parquet')
-            ;
-        """).to_df()
-    except:
-        df_raw = pd.DataFrame(columns=["job_id"])
+        if found:
+            now = time.time()
+            self.conn.executemany("UPDATE evaluations SET used_at = ? WHERE key = ?", [(now, k) for k in found])
+            self.conn.commit()
 
-    try:
-        df_staging = duckdb.query(f"""
-            SELECT 
-                *
-            FROM read_parquet('{STAGING_PATH}/*.parquet')
-            ;
-        """).to_df()
-    except:
-        df_staging = pd.DataFrame(columns=["job_id"])
+        results = {i: json.loads(found[key]) for i, key in keys.items() if key in found}
+        self.hits += len(results)
+        self.misses += len(keys) - len(results)
+        return results
 
-    staging_job_ids = df_staging['job_id'].unique() if not df_staging.empty else []
-    print(f"Staging Step: Found {len(staging_job_ids)} staging job IDs.")
-    jobs_df = df_raw[~df_raw['job_id'].isin(staging_job_ids)]
-    print(f"Staging Step: Found {len(jobs_df)} new jobs to evaluate.")
-    
+    def put_many(self, jobs_df, results, model=EVALUATION_MODEL):
+        """Store the valid evaluations of `results` (keyed by index of `jobs_df`)."""
+        now = time.time()
+        entries = [
+            (self.key(jobs_df.loc[i], model), json.dumps(result), model, PROFILE_VERSION, now, now)
+            for i, result in results.items()
+            if result.get("match_level") is not None and result.get("model") == model
+        ]
+        self.conn.executemany("INSERT OR REPLACE INTO evaluations VALUES (?, ?, ?, ?, ?, ?)", entries)
+        self.conn.commit()
 
-    if not jobs_df.empty:
-        jobs_df['post_date'] = jobs_df.apply(
-            lambda row: get_posted_datetime(row['datetime'], row['job_post_date']), axis=1
+    def evict(self):
+        """Drop stale profile versions, expired entries and the least recently used overflow."""
+        cutoff = time.time() - self.max_age_days * 86400
+        self.conn.execute(
+            "DELETE FROM evaluations WHERE profile_version != ? OR created_at < ?", (PROFILE_VERSION, cutoff)
         )
-        jobs_df['job_link'] = "http://www.upwork.com" + jobs_df['job_link']
+        self.conn.execute("""
+            DELETE FROM evaluations WHERE key IN (
+                SELECT key FROM evaluations ORDER BY used_at DESC LIMIT -1 OFFSET ?
+            )
+        """, (self.max_entries,))
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+MINHASH_PERMUTATIONS = 128
+# 32 bands of 4 rows and word 2-grams: a 5% edit of a job keeps about 90% of its shingles,
+# 3-grams kept too few of them for the reposts to reach the threshold (benchmark.py reposts)
+MINHASH_BANDS = 32
+MINHASH_SHINGLE_SIZE = 2
+# Fixed seeds, signatures stored on disk must stay comparable across runs
+_minhash_rng = np.random.default_rng(20240501)
+MINHASH_A = _minhash_rng.integers(1, 2**63, MINHASH_PERMUTATIONS, dtype=np.uint64) | np.uint64(1)
+MINHASH_B = _minhash_rng.integers(0, 2**63, MINHASH_PERMUTATIONS, dtype=np.uint64)
+
+
+def job_shingles(row, size=MINHASH_SHINGLE_SIZE):
+    """The word `size`-grams of the title and description of a job."""
+    words = re.findall(r"\w+", f"{row['job_title'] or ''} {job_description(row)}".lower())
+    return {" ".join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+
 
+def minhash_signature(shingles):
+    """MinHash signature of a set of shingles, MINHASH_PERMUTATIONS unsigned 64-bit values."""
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little") for s in shingles],
+        dtype=np.uint64
+    )
+    # Multiply-shift hashing, the uint64 products wrap around on purpose
+    permuted = (hashes[:, None] * MINHASH_A[None, :] + MINHASH_B[None, :]) >> np.uint64(32)
+    return permuted.min(axis=0)
+
+
+class RepostIndex:
+    """
+    On-disk LSH index of the MinHash signatures of the evaluated jobs, in a SQLite file, to
+    find reposts: the same job posted again under a new job_id, with small edits.
+    Signatures are split in `bands` bands; two jobs are candidates when they share the
+    bucket of one band, and a candidate is a repost when the estimated Jaccard similarity
+    of the signatures reaches `threshold`. A lookup reads at most `bucket_limit` jobs per
+    band, so its cost does not grow with the history.
+    Near-duplicates among jobs that are not evaluated yet are held back by hold_duplicates
+    until the first job of their group gets its evaluation in write_results.
+    """
+
+    def __init__(self, path, threshold=0.6, bands=MINHASH_BANDS, bucket_limit=20):
+        self.path = path
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = MINHASH_PERMUTATIONS // bands
+        self.bucket_limit = bucket_limit
+        self.found = 0
+        # job_id of a job waiting for its evaluation -> rows of its held near-duplicates
+        self.held = {}
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Opened and used from asyncio.to_thread workers, one at a time
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS signatures (
+                job_id TEXT PRIMARY KEY,
+                signature BLOB NOT NULL,
+                result TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS buckets (
+                band INTEGER NOT NULL,
+                bucket INTEGER NOT NULL,
+                job_id TEXT NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS buckets_band_bucket ON buckets (band, bucket)")
+        # put_many deletes the buckets of a job_id before indexing it again
+        self.conn.execute("CREATE INDEX IF NOT EXISTS buckets_job_id ON buckets (job_id)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        settings = {"shingle_size": MINHASH_SHINGLE_SIZE, "bands": bands}
+        if dict(self.conn.execute("SELECT name, value FROM settings").fetchall()) != settings:
+            # Signatures of other settings are not comparable, open_repost_index builds the index again
+            self.conn.execute("DELETE FROM signatures")
+            self.conn.execute("DELETE FROM buckets")
+            self.conn.execute("DELETE FROM settings")
+            self.conn.executemany("INSERT INTO settings VALUES (?, ?)", list(settings.items()))
+        self.conn.commit()
+
+    def __len__(self):
+        return self.conn.execute("SELECT count(*) FROM signatures").fetchone()[0]
+
+    def band_buckets(self, signature):
+        """(band, bucket) pairs of a signature, the bucket being a signed 64-bit hash of the band."""
+        return [
+            (band, int.from_bytes(hashlib.blake2b(
+                signature[band * self.rows:(band + 1) * self.rows].tobytes(), digest_size=8
+            ).digest(), "little", signed=True))
+            for band in range(self.bands)
+        ]
+
+    def find(self, job_id, signature):
+        """The most similar indexed job above the threshold, as (job_id, similarity, result), or None."""
+        candidates = set()
+        for band, bucket in self.band_buckets(signature):
+            candidates.update(row[0] for row in self.conn.execute(
+                "SELECT job_id FROM buckets WHERE band = ? AND bucket = ? ORDER BY rowid DESC LIMIT ?",
+                (band, bucket, self.bucket_limit)
+            ))
+        candidates.discard(job_id)
+
+        best = None
+        for candidate_id in candidates:
+            blob, result = self.conn.execute(
+                "SELECT signature, result FROM signatures WHERE job_id = ?", (candidate_id,)
+            ).fetchone()
+            similarity = float((np.frombuffer(blob, dtype=np.uint64) == signature).mean())
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = (candidate_id, similarity, json.loads(result))
+        return best
+
+    def find_many(self, jobs_df):
+        """Reposts among the rows of `jobs_df`, keyed by index, with the result they inherit."""
+        reposts = {}
         for i, row in jobs_df.iterrows():
-            result = evaluate_job(row)
-            if i % 10 == 0:
-                print(f"Staging Step: Evaluating job {i} of {len(jobs_df)}")
-            for key in result.index:
-                jobs_df.loc[i, key] = result[key]
-
-        df_staging = pd.concat([df_staging, jobs_df], ignore_index=True)
-
-        jobs_df_schema = pa.schema([
-            ("job_id", pa.string()),
-            ("job_title", pa.string()),
-            ("job_description", pa.string()),
-            ("job_link", pa.string()),
-            ("job_post_date", pa.string()),
-            ("job_type_level", pa.string()),
-            ("job_experience_level", pa.string()),
-            ("is_fixed_price", pa.string()),
-            ("duration_label", pa.string()),
-            ("datetime", pa.timestamp('ns')),
-            ("match_level", pa.float64()),
-            ("apply", pa.bool_()),
-            ("reason", pa.string()),
-            ("model", pa.string())
-        ])
-
-        pq.write_to_dataset(
-            pa.Table.from_pandas(df_staging, schema=jobs_df_schema, preserve_index=False), 
-            root_path=STAGING_PATH, 
-            basename_template='staging_{i}.parquet'
-        )
+            match = self.find(row["job_id"], minhash_signature(job_shingles(row)))
+            if match is not None:
+                original_id, _, result = match
+                reposts[i] = {**result, "model": "repost", "repost_of": original_id}
+        self.found += len(reposts)
+        get_metrics().count("reposts", len(reposts))
+        return reposts
 
-        print(f"Staging Step: All {len(jobs_df)} new jobs were evaluated.")
-    else:
-        print("Staging Step: No new jobs need evaluation.")
+    def hold_duplicates(self, jobs_df):
+        """
+        Hold back the near-duplicates among the rows of `jobs_df`, which the index cannot find
+        while none of them is evaluated, and return the other rows. A held row is written as
+        a repost of the first row of its group once that one is evaluated (release_duplicates),
+        or stays pending for the next run.
+        """
+        signatures = {}
+        buckets = {}
+        kept = []
+        for i, row in jobs_df.iterrows():
+            signature = minhash_signature(job_shingles(row))
+            keys = self.band_buckets(signature)
+            # Only the first job of each group is in the buckets
+            best = None
+            for j in {j for key in keys for j in buckets.get(key, ())}:
+                similarity = float((signatures[j] == signature).mean())
+                if similarity >= self.threshold and (best is None or similarity > best[1]):
+                    best = (j, similarity)
+            if best is None:
+                kept.append(i)
+                signatures[i] = signature
+                for key in keys:
+                    buckets.setdefault(key, []).append(i)
+            else:
+                self.held.setdefault(jobs_df.at[best[0], "job_id"], []).append(row)
+        return jobs_df.loc[kept]
 
-def json_to_table(json_data):
-    """Convert JSON data to a pandas DataFrame."""
-    try:
-        # If the JSON data is a string, parse it
-        if isinstance(json_data, str):
-            json_data = json.loads(json_data)
-        return pd.json_normalize(json_data)
-    except json.JSONDecodeError:
-        print("Error decoding JSON:", json_data)
-        return pd.DataFrame()
+    def release_duplicates(self, jobs_df, results):
+        """
+        The held near-duplicates of the rows of `jobs_df` with a valid evaluation in `results`
+        (keyed by index), as a DataFrame and the evaluations they inherit, keyed by its index.
+        """
+        rows = []
+        inherited = {}
+        for i, result in results.items():
+            if result.get("match_level") is None or result.get("repost_of"):
+                continue
+            original_id = jobs_df.at[i, "job_id"]
+            evaluation = {key: result.get(key) for key in ("match_level", "apply", "reason")}
+            for row in self.held.pop(original_id, []):
+                inherited[len(rows)] = {**evaluation, "model": "repost", "repost_of": original_id}
+                rows.append(row)
+        self.found += len(rows)
+        get_metrics().count("reposts", len(rows))
+        return pd.DataFrame(rows).reset_index(drop=True), inherited
 
+    def held_count(self):
+        return sum(len(rows) for rows in self.held.values())
 
-def build_prompt_filter(row):
-    return [
-        {
-            "role": "system",
-            "content": (
-                "You are an expert evaluator of freelance data science opportunities. Your task is to assess how well an Upwork job "
-                "post aligns with the professional profile of Thiago Miranda, a senior data scientist. Always return your response in valid, clean JSON format with no extra commentary."
+    def put_many(self, jobs_df, results):
+        """Index the rows of `jobs_df` with a valid evaluation in `results` (keyed by index), reposts excluded."""
+        now = time.time()
+        for i, result in results.items():
+            if result.get("match_level") is None or result.get("repost_of"):
+                continue
+            row = jobs_df.loc[i]
+            signature = minhash_signature(job_shingles(row))
+            evaluation = {key: result.get(key) for key in ("match_level", "apply", "reason", "model")}
+            self.conn.execute(
+                "INSERT OR REPLACE INTO signatures VALUES (?, ?, ?, ?)",
+                (row["job_id"], signature.tobytes(), json.dumps(evaluation), now)
             )
-        },
-        {
-            "role": "user",
-            "content": (
-                "## Freelancer Profile – Thiago Miranda\n"
-                "- Location: Dublin, Ireland\n"
-                "- Experience: 6+ years in data science and analytics using Python, R, and SQL, with strong expertise in machine learning, statistical modeling, web scraping, data visualization, and cloud services.\n"
-                "- Skills:\n"
-                "  • Data Science: machine learning (XGBoost, random forest, deep learning), NLP, LLMs, IRT models\n"
-                "  • Analytics: data wrangling, hypothesis testing, A/B testing, storytelling\n"
-                "  • Tools: Python, R, SQL (MySQL, Presto, SQL Server), AWS (SageMaker, Lambda, S3), Docker, Tableau, Power BI, Google Analytics, Git\n"
-                "- Projects: Created a football data analysis tool using web scraping, Streamlit, DuckDB, and PyArrow. Developed a CAT API integrated with Django for adaptive testing using IRT models.\n"
-                "- Domains: Education, Business, Marketplaces, Digital Products\n"
-                "- Education: MSc in Statistics, BSc in Statistics\n"
-                "- Preferences: Freelance roles involving ML, data analytics, automation, scraping, dashboards, or statistical modeling\n"
-                "- Languages: Portuguese (native), English (advanced)\n"
-                "## Job Post\n"
-                f"- Title: {row['job_title']}\n"
-                f"- Description: {row['job_description']}\n"
-                f"- Experience Level Required: {row['job_experience_level']}\n"
-                f"- Fixed Price: {row['is_fixed_price']}\n"
-                f"- Duration: {row['duration_label']}\n\n"
-                "## Instructions\n"
-                "Evaluate how well this job post matches the freelancer profile and return your response in valid JSON format with the following keys:\n"
-                "- match_level: a float from 0.0 to 1.0 indicating compatibility\n"
-                "- apply: true or false\n"
-                "- reason: a short, clear explanation of your decision\n\n"
-                "## JSON Format\n"
-                "{\n"
-                "  \"match_level\": float,\n"
-                "  \"apply\": boolean,\n"
-                "  \"reason\": string\n"
-                "}\n"
+            self.conn.execute("DELETE FROM buckets WHERE job_id = ?", (row["job_id"],))
+            self.conn.executemany(
+                "INSERT INTO buckets VALUES (?, ?, ?)",
+                [(band, bucket, row["job_id"]) for band, bucket in self.band_buckets(signature)]
             )
-        }
-    ]
+        self.conn.commit()
 
+    def close(self):
+        self.conn.close()
 
-def build_prompt_apply(row):
-    impact_hooks = [
-        "This project is a perfect match for my skills — my background in machine learning, web scraping, and statistical modeling ensures I can deliver top-quality results quickly and reliably.",
-        "I bring exactly the expertise you're looking for — from Python automations to AWS deployments, I’ve delivered high-impact projects that align perfectly with your needs.",
-        "With deep experience in data extraction, machine learning, and process automation, I'm confident I can deliver outstanding results for your project.",
-        "Your project demands expertise in data science and automation — and that’s precisely what I specialize in, delivering clean, scalable solutions in Python and AWS.",
-        "If you're looking for someone who combines strong technical skills in Python, R, SQL, and AWS with business-driven results, I’m your ideal partner for this project.",
-    ]
-    hook = random.choice(impact_hooks)
-    
-    perfil_usuario = """
-    I am a Data Scientist with over six years of experience driving business growth through machine learning, 
-    data analytics, web scraping, and automation. I specialize in developing ML models (XGBoost, Random Forest, Deep Learning), 
-    automating ETL processes, and creating scalable data pipelines using Python, R, SQL, and AWS (SageMaker, Lambda, S3). 
-    I have hands-on experience with Large Language Models (LLMs), Natural Language Processing (NLP), and Computerized Adaptive Testing (CAT) systems. 
-    My projects always focus on delivering actionable insights and operational efficiencies. 
-    I am comfortable working in fast-paced environments, adapting to new challenges, 
-    and communicating effectively with both technical and non-technical stakeholders.
+
+def open_repost_index(STAGING_PATH, path=None, threshold=0.6):
     """
-        
-    prompt = f"""
-    You are a professional freelancer specialized in writing personalized Upwork cover letters.
+    The repost index of STAGING_PATH, None when `threshold` is None.
+    An empty index, new or left empty by an interrupted build, is built from the evaluated
+    jobs already in staging.
+    """
+    if threshold is None:
+        return None
+    path = path or os.path.join(STAGING_PATH, "_repost_index.sqlite")
+    index = RepostIndex(path, threshold)
+    if len(index) == 0 and dataset_exists(STAGING_PATH):
+        staged_df = duckdb.query(f"""
+            SELECT * FROM {read_latest_sql(STAGING_PATH, schema=STAGING_SCHEMA)}
+            WHERE match_level IS NOT NULL AND repost_of IS NULL
+        """).to_df()
+        staged_df = with_descriptions(staged_df)
+        evaluations = staged_df[["match_level", "apply", "reason", "model"]]
+        # Python scalars and None, the evaluations are stored as JSON
+        index.put_many(staged_df, evaluations.astype(object).where(evaluations.notna(), None).to_dict("index"))
+        print(f"Staging Step: Built the repost index with {len(index)} jobs.")
+    return index
 
-    Generate a **customized cover letter** for the following Upwork job opportunity:
 
-    ---
-    **Job Title:** {row['job_title']}
-    **Job Description:** {row['job_description']}
-    **Experience Level Required:** {row['job_experience_level']}
-    **Fixed Price:** {row['is_fixed_price']}
-    **Duration:** {row['duration_label']}
-    ---
+def write_results(jobs_df, results, STAGING_PATH, cache=None, reposts=None):
+    """
+    Append the rows of `jobs_df` whose index is in `results` to staging, with their
+    evaluation columns, and store the valid evaluations in `cache` and `reposts`. The
+    near-duplicates `reposts` held for these jobs are written too, as their reposts.
+    Returns the number of rows of `jobs_df` written.
+    """
+    if not results:
+        return 0
+    results_df = pd.DataFrame.from_dict(results, orient="index")
+    rows_df = jobs_df.loc[results_df.index].drop(columns=results_df.columns, errors="ignore")
+    append_dataset(rows_df.join(results_df), STAGING_PATH, STAGING_SCHEMA, "staging")
+    if cache is not None:
+        cache.put_many(rows_df, results)
+    if reposts is not None:
+        reposts.put_many(rows_df, results)
+        held_df, inherited = reposts.release_duplicates(rows_df, results)
+        write_results(held_df, inherited, STAGING_PATH)
+    return len(results)
 
-    **Profile Information:**
-    {perfil_usuario}
 
-    **Instructions:**
-    1. Start the letter with these two powerful sentences to immediately catch the client's attention:
-    "{hook}"
+async def evaluate_jobs_async(jobs_df, STAGING_PATH, concurrency=8, requests_per_minute=500,
+                              tokens_per_minute=200_000, checkpoint_every=20, client=None, cache=None,
+                              limiter=None, on_result=None, jobs_per_request=1, reposts=None):
+    """
+    Evaluate every row of `jobs_df` with a pool of `concurrency` workers sharing one async
+    client and one rate limiter. Finished results are appended to the staging dataset every
+    `checkpoint_every` jobs, so a restart only evaluates what was not checkpointed yet.
+    With `jobs_per_request` > 1, each request evaluates that many jobs with the profile
+    sent once (evaluate_job_group_async).
+    `on_result(row, result)` is called as soon as each job is evaluated.
+    Returns the number of jobs written to staging.
+    """
+    own_client = client is None
+    # Retries are handled by call_with_retries, with the rate limiter in the loop
+    client = client or openai.AsyncOpenAI(max_retries=0)
+    limiter = limiter or RateLimiter(requests_per_minute, tokens_per_minute)
 
-    2. After the opening, continue with a brief paragraph that:
-    - Highlights my relevant experience (based on the job description and required skills),
-    - Shows confidence and a business-driven mindset,
-    - Avoids generic statements (be specific).
+    queue = asyncio.Queue()
+    for i, row in jobs_df.iterrows():
+        queue.put_nowait((i, row))
 
-    3. End with a **short call to action** inviting the client to discuss further.
+    finished = {}
+    counts = {"done": 0, "failed": 0, "written": 0}
+    checkpoint_lock = asyncio.Lock()
 
-    4. Maintain a **professional, confident, and direct tone**.
+    async def checkpoint():
+        # The parquet and SQLite writes run off the event loop, one checkpoint at a time
+        async with checkpoint_lock:
+            results = dict(finished)
+            finished.clear()
+            counts["written"] += await asyncio.to_thread(
+                write_results, jobs_df, results, STAGING_PATH, cache, reposts
+            )
 
-    5. Keep the entire cover letter around **150–180 words** to stay concise and impactful.
+    async def worker():
+        while True:
+            group = []
+            while len(group) < max(1, jobs_per_request) and not queue.empty():
+                group.append(queue.get_nowait())
+            if not group:
+                return
 
-    **Important:** Focus on making the first two sentences extremely convincing, because they are the ones the client will see first.
-    """
+            results = await evaluate_job_group_async(client, [row for _, row in group], limiter)
+            for (i, row), result in zip(group, results):
+                counts["done"] += 1
+                if result is None:
+                    counts["failed"] += 1
+                else:
+                    finished[i] = result
+                    if on_result is not None:
+                        on_result(row, result)
 
-    return prompt
+                if counts["done"] % 10 == 0:
+                    print(f"Staging Step: Evaluating job {counts['done']} of {len(jobs_df)}")
+            if len(finished) >= checkpoint_every:
+                await checkpoint()
 
+    try:
+        await asyncio.gather(*[worker() for _ in range(max(1, concurrency))])
+    finally:
+        # Whatever finished is kept, even if a worker crashed or the run was cancelled
+        await checkpoint()
+        if own_client:
+            await client.close()
+
+    if counts["failed"]:
+        print(f"Staging Step: {counts['failed']} jobs failed and will be evaluated again on the next run.")
+    return counts["written"]
+
+
+BATCH_FINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+def build_batch_file(jobs_df, model=EVALUATION_MODEL):
+    """JSONL input of the Batch API, one Responses request per job with the job_id as custom_id."""
+    lines = []
+    for _, row in jobs_df.iterrows():
+        lines.append(json.dumps({
+            "custom_id": row["job_id"],
+            "method": "POST",
+            "url": "/v1/responses",
+            "body": {"model": model, "input": build_prompt_filter(row)}
+        }))
+    return "\n".join(lines).encode("utf-8")
+
+
+def response_output_text(body):
+    """The output_text of a raw Responses API body, as returned in batch output files."""
+    texts = []
+    for item in body.get("output") or []:
+        if item.get("type") != "message":
+            continue
+        for content in item.get("content") or []:
+            if content.get("type") == "output_text":
+                texts.append(content.get("text", ""))
+    return "".join(texts)
+
+
+def parse_batch_output(text, model=EVALUATION_MODEL):
+    """Evaluation results of a batch output file, keyed by job_id. Failed requests are left out."""
+    results = {}
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        item = json.loads(line)
+        response = item.get("response") or {}
+        if item.get("error") or response.get("status_code") != 200:
+            get_metrics().count("llm_errors")
+            continue
+        # Batch requests cost half the price
+        get_metrics().record_usage(model, (response.get("body") or {}).get("usage"), price_factor=0.5)
+        results[item["custom_id"]] = parse_evaluation(response_output_text(response.get("body") or {}), model)
+    return results
+
+
+def pending_batch_path(STAGING_PATH):
+    return os.path.join(STAGING_PATH, "_pending_batch.json")
+
+
+async def wait_for_batch(client, batch_id, poll_interval=30):
+    batch = await client.batches.retrieve(batch_id)
+    while batch.status not in BATCH_FINAL_STATUSES:
+        await asyncio.sleep(poll_interval)
+        batch = await client.batches.retrieve(batch_id)
+    return batch
+
+
+async def evaluate_jobs_batch(jobs_df, STAGING_PATH, poll_interval=30, client=None, cache=None, reposts=None,
+                              wait=True):
+    """
+    Evaluate `jobs_df` with the OpenAI Batch API: upload the prompts as a JSONL file, submit
+    the batch, poll until it finishes and append the validated results to staging.
+    The batch id is kept in STAGING_PATH until the results are merged, so a run that stops
+    while polling picks the same batch up again instead of paying for a new one.
+    With `wait` False the batch is checked once instead of polled: an unfinished batch is
+    left for a later call and nothing is written.
+    Jobs without a valid result stay pending. Returns the number of jobs written to staging.
+    """
+    own_client = client is None
+    client = client or openai.AsyncOpenAI()
+    state_path = pending_batch_path(STAGING_PATH)
 
-def evaluate_job(row):
-    model = "gpt-4o-mini"
-    prompt = build_prompt_filter(row)
-    # calculate the number of tokens in the prompt
-    
-    client = openai.OpenAI()
-    
     try:
-        
-        # Use the OpenAI API to get a response
-        response = client.responses.create(
-            model=model,  # ou gpt-3.5-turbo se quiser economizar
-            input=prompt
-        )
+        if os.path.exists(state_path):
+            with open(state_path, encoding="utf-8") as f:
+                batch_id = json.load(f)["batch_id"]
+            print(f"Staging Step: Resuming batch {batch_id}.")
+        else:
+            batch_file = await client.files.create(
+                file=("staging_batch.jsonl", build_batch_file(jobs_df)), purpose="batch"
+            )
+            batch = await client.batches.create(
+                input_file_id=batch_file.id, endpoint="/v1/responses", completion_window="24h"
+            )
+            batch_id = batch.id
+            os.makedirs(STAGING_PATH, exist_ok=True)
+            with open(state_path, "w", encoding="utf-8") as f:
+                json.dump({"batch_id": batch_id, "created_at": pd.Timestamp.now().isoformat()}, f)
+            print(f"Staging Step: Submitted batch {batch_id} with {len(jobs_df)} jobs.")
 
-        content = response.output_text
-        # extract everything between the first and last curly braces 
-        content = content[content.find("{"):content.rfind("}") + 1]
-        
-        # Tentar fazer parsing do JSON de forma segura
-        result = json.loads(content)
-        
-        
-        
-        # Validação mínima dos campos esperados
-        match_level = float(result.get("match_level", 0))
-        apply = bool(result.get("apply", False))
-        reason = result.get("reason", "")
+        if wait:
+            batch = await wait_for_batch(client, batch_id, poll_interval)
+        else:
+            batch = await client.batches.retrieve(batch_id)
+            if batch.status not in BATCH_FINAL_STATUSES:
+                print(f"Staging Step: Batch {batch_id} is '{batch.status}', its results are merged on a later run.")
+                return 0
+        print(f"Staging Step: Batch {batch_id} finished with status '{batch.status}'.")
 
-        return pd.Series({
-            "match_level": match_level,
-            "apply": apply,
-            "reason": reason,
-            "model": model
-        })
+        results = {}
+        if batch.output_file_id:
+            output = await client.files.content(batch.output_file_id)
+            results = parse_batch_output(output.text)
+
+        # Merge by job_id, a resumed batch may cover jobs that are not pending anymore
+        results = {i: results[job_id] for i, job_id in jobs_df["job_id"].items() if job_id in results}
+        written = await asyncio.to_thread(write_results, jobs_df, results, STAGING_PATH, cache, reposts)
+
+        os.remove(state_path)
+        return written
+    finally:
+        if own_client:
+            await client.close()
 
-    except json.JSONDecodeError:
-        return pd.Series({
-            "match_level": None,
-            "apply": None,
-            "reason": "Invalid JSON response",
-            "model": model
-        })
-    except Exception as e:
-        print(f"Error: {str(e)}")
-        return pd.Series({
-            "match_level": None,
-            "apply": None,
-            "reason": f"Error: {str(e)}",
-            "model": model
-        })
-    
 
 def apply_job(row):
     model = "gpt-4.1"
@@ -424,4 +2779,436 @@ def apply_job(row):
 
     except Exception as e:
         print(f"Error: {str(e)}")
-        return ""
\ No newline at end of file
+        return ""
+
+APPLY_MODEL = "gpt-4.1"
+
+_async_client = None
+
+
+def get_async_client():
+    """AsyncOpenAI client shared by the coroutines of a long running process (the bot)."""
+    global _async_client
+    if _async_client is None:
+        _async_client = openai.AsyncOpenAI()
+    return _async_client
+
+
+async def stream_cover_letter(row, client=None, model=APPLY_MODEL):
+    """
+    Async generator of the cover letter text of `row`, yielding the deltas as the model
+    writes them. Errors are raised, so the caller can show them.
+    """
+    client = client or get_async_client()
+    prompt = build_prompt_apply(row)
+
+    started = time.perf_counter()
+    stream = await call_with_retries(
+        lambda: client.responses.create(model=model, input=prompt, stream=True), max_retries=3
+    )
+    async for event in stream:
+        if event.type == "response.output_text.delta":
+            yield event.delta
+        elif event.type == "response.completed":
+            get_metrics().add_span("cover_letter", time.perf_counter() - started, row["job_id"])
+            get_metrics().record_usage(model, event.response.usage)
+        elif event.type == "response.failed":
+            error = getattr(event.response, "error", None)
+            raise RuntimeError(getattr(error, "message", None) or "The cover letter generation failed")
+        elif event.type == "error":
+            raise RuntimeError(getattr(event, "message", None) or "The cover letter generation failed")
+
+
+class CoverLetterCache:
+    """
+    Cover letters generated ahead of time, in a SQLite file keyed by job_id, with a TTL.
+    It also keeps the daily count of generations for the budget, and the counters used to
+    tune the pre-generation threshold: hits, misses and wasted letters (the job was skipped
+    or the letter expired unused).
+    """
+
+    def __init__(self, path, ttl_hours=72):
+        self.path = path
+        self.ttl_hours = ttl_hours
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS letters (
+                job_id TEXT PRIMARY KEY,
+                text TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                used_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS generations (day TEXT PRIMARY KEY, count INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS over_budget (job_id TEXT PRIMARY KEY, created_at REAL NOT NULL);
+        """)
+        self.conn.commit()
+
+    def _count(self, name, amount=1):
+        self.conn.execute("""
+            INSERT INTO counters VALUES (?, ?)
+            ON CONFLICT(name) DO UPDATE SET value = value + excluded.value
+        """, (name, amount))
+        self.conn.commit()
+
+    def has(self, job_id):
+        return self.conn.execute("SELECT 1 FROM letters WHERE job_id = ?", (job_id,)).fetchone() is not None
+
+    def get(self, job_id, count=True):
+        """
+        The pre-generated letter of `job_id`, counted as a hit, or None (a miss).
+        With `count` False, for jobs that were never meant to be pre-generated, neither is counted.
+        """
+        cutoff = time.time() - self.ttl_hours * 3600
+        found = self.conn.execute(
+            "SELECT text FROM letters WHERE job_id = ? AND created_at >= ?", (job_id, cutoff)
+        ).fetchone()
+        if found is None:
+            if count:
+                self._count("misses")
+            return None
+        self.conn.execute("UPDATE letters SET used_at = ? WHERE job_id = ?", (time.time(), job_id))
+        if count:
+            self._count("hits")
+        else:
+            self.conn.commit()
+        return found[0]
+
+    def put(self, job_id, text):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO letters VALUES (?, ?, ?, NULL)", (job_id, text, time.time())
+        )
+        self._count("generated")
+
+    def mark_over_budget(self, job_id):
+        """`job_id` was not pre-generated because the daily budget was spent."""
+        self.conn.execute("INSERT OR REPLACE INTO over_budget VALUES (?, ?)", (job_id, time.time()))
+        self.conn.commit()
+
+    def over_budget(self, job_id):
+        return self.conn.execute("SELECT 1 FROM over_budget WHERE job_id = ?", (job_id,)).fetchone() is not None
+
+    def mark_skipped(self, job_id):
+        """A skipped job makes its unused pre-generated letter a wasted generation."""
+        deleted = self.conn.execute("DELETE FROM letters WHERE job_id = ? AND used_at IS NULL", (job_id,)).rowcount
+        if deleted:
+            self._count("wasted", deleted)
+        self.conn.commit()
+
+    def try_spend(self, daily_budget):
+        """Take one generation from today's budget, False when it is exhausted."""
+        day = pd.Timestamp.now().strftime("%Y-%m-%d")
+        with self.conn:
+            used = self.conn.execute("SELECT count FROM generations WHERE day = ?", (day,)).fetchone()
+            if used and used[0] >= daily_budget:
+                return False
+            self.conn.execute("""
+                INSERT INTO generations VALUES (?, 1)
+                ON CONFLICT(day) DO UPDATE SET count = count + 1
+            """, (day,))
+        return True
+
+    def evict(self):
+        """Drop expired letters, the unused ones count as wasted."""
+        cutoff = time.time() - self.ttl_hours * 3600
+        wasted = self.conn.execute(
+            "DELETE FROM letters WHERE created_at < ? AND used_at IS NULL", (cutoff,)
+        ).rowcount
+        self.conn.execute("DELETE FROM letters WHERE created_at < ?", (cutoff,))
+        self.conn.execute("DELETE FROM over_budget WHERE created_at < ?", (cutoff,))
+        if wasted:
+            self._count("wasted", wasted)
+        self.conn.commit()
+
+    def stats(self):
+        counters = dict(self.conn.execute("SELECT name, value FROM counters").fetchall())
+        hits, misses = counters.get("hits", 0), counters.get("misses", 0)
+        return {
+            "generated": counters.get("generated", 0),
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "wasted": counters.get("wasted", 0),
+        }
+
+
+class CoverLetterPregenerator:
+    """
+    Background stage generating the cover letters of sent jobs with a match_level of at
+    least `min_match_level`, at most `concurrency` at a time and `daily_budget` per day.
+    """
+
+    def __init__(self, cache, min_match_level=0.8, concurrency=2, daily_budget=50):
+        self.cache = cache
+        self.min_match_level = min_match_level
+        self.daily_budget = daily_budget
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.tasks = set()
+
+    def eligible(self, row):
+        return (row.get("match_level") or 0) >= self.min_match_level
+
+    def submit(self, row):
+        if not self.eligible(row):
+            return
+        task = asyncio.create_task(self._generate(dict(row)))
+        # Keep a reference until the task is done, asyncio only holds weak ones
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _generate(self, row):
+        async with self.semaphore:
+            if self.cache.has(row["job_id"]):
+                return
+            if not self.cache.try_spend(self.daily_budget):
+                self.cache.mark_over_budget(row["job_id"])
+                return
+            try:
+                text = "".join([chunk async for chunk in stream_cover_letter(row)])
+            except Exception as e:
+                print(f"Error: could not pre-generate the cover letter of {row['job_id']}: {e}")
+                return
+            if text.strip():
+                self.cache.put(row["job_id"], text)
+
+    def lookup(self, row):
+        """
+        Pre-generated letter of `row`, or None. Hits and misses only count the jobs that
+        were meant to be pre-generated: above `min_match_level` and within the budget.
+        """
+        counted = self.eligible(row) and not self.cache.over_budget(row["job_id"])
+        return self.cache.get(row["job_id"], count=counted)
+
+
+# USD per million input and output tokens, for the cost of each LLM call
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4.1": (2.00, 8.00),
+}
+
+
+class MetricsStore:
+    """
+    Local SQLite store of where each run spends time and money: timed spans of the pipeline
+    stages, LLM tokens and their cost per model, and counters such as errors and retries.
+    Records are buffered and written every `flush_every` records and when the run finishes.
+    Records made between runs (button clicks) go to the latest run.
+    Records can be made from any thread (asyncio.to_thread workers), each thread writes
+    with its own connection.
+    """
+
+    def __init__(self, path, flush_every=200):
+        self.path = path
+        self.flush_every = flush_every
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS runs (run_id TEXT PRIMARY KEY, started_at REAL, finished_at REAL);
+            CREATE TABLE IF NOT EXISTS spans (
+                run_id TEXT, stage TEXT, name TEXT, started_at REAL, seconds REAL, ok INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS spans_run_id ON spans (run_id);
+            CREATE TABLE IF NOT EXISTS llm_usage (
+                run_id TEXT, model TEXT, input_tokens INTEGER, output_tokens INTEGER, cost REAL
+            );
+            CREATE TABLE IF NOT EXISTS counters (
+                run_id TEXT, name TEXT, value INTEGER NOT NULL, PRIMARY KEY (run_id, name)
+            );
+        """)
+        self.conn.commit()
+        self.run_id = None
+        self.spans = []
+        self.usage = []
+        self.counts = {}
+
+    @property
+    def conn(self):
+        """SQLite connection of the calling thread, opened on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Only used by its thread, close() closes them all from the closing one
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def start_run(self, run_id=None):
+        """Start a run, or join `run_id` when a parent process already started it."""
+        self.flush()
+        self.run_id = run_id or uuid.uuid4().hex[:12]
+        self.conn.execute("INSERT OR IGNORE INTO runs VALUES (?, ?, NULL)", (self.run_id, time.time()))
+        self.conn.commit()
+        return self.run_id
+
+    def finish_run(self):
+        self.flush()
+        self.conn.execute("UPDATE runs SET finished_at = ? WHERE run_id = ?", (time.time(), self.run_id))
+        self.conn.commit()
+
+    @contextlib.contextmanager
+    def span(self, stage, name=None):
+        """Time the block as a span of `stage`, failed if it raises."""
+        started = time.time()
+        perf_started = time.perf_counter()
+        ok = True
+        try:
+            yield
+        except BaseException:
+            ok = False
+            raise
+        finally:
+            self.add_span(stage, time.perf_counter() - perf_started, name, ok, started)
+
+    def add_span(self, stage, seconds, name=None, ok=True, started=None):
+        """Record a span timed by the caller."""
+        started = started if started is not None else time.time() - seconds
+        with self._lock:
+            self.spans.append((self.run_id, stage, name, started, seconds, int(ok)))
+        self._maybe_flush()
+
+    def record_usage(self, model, usage, price_factor=1.0):
+        """Tokens of an OpenAI response `usage` (object or dict), `price_factor` 0.5 for the Batch API."""
+        if usage is None:
+            return
+        get = usage.get if isinstance(usage, dict) else lambda key: getattr(usage, key, None)
+        input_tokens = get("input_tokens") or 0
+        output_tokens = get("output_tokens") or 0
+        input_price, output_price = MODEL_PRICES.get(model, (0.0, 0.0))
+        cost = (input_tokens * input_price + output_tokens * output_price) / 1e6 * price_factor
+        with self._lock:
+            self.usage.append((self.run_id, model, input_tokens, output_tokens, cost))
+        self._maybe_flush()
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + amount
+
+    def _maybe_flush(self):
+        if len(self.spans) + len(self.usage) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        # The buffers are swapped under the lock, records made meanwhile go to the next flush
+        with self._lock:
+            spans, usage, counts = self.spans, self.usage, self.counts
+            self.spans, self.usage, self.counts = [], [], {}
+        conn = self.conn
+        with conn:
+            conn.executemany("INSERT INTO spans VALUES (?, ?, ?, ?, ?, ?)", spans)
+            conn.executemany("INSERT INTO llm_usage VALUES (?, ?, ?, ?, ?)", usage)
+            conn.executemany("""
+                INSERT INTO counters VALUES (?, ?, ?)
+                ON CONFLICT(run_id, name) DO UPDATE SET value = value + excluded.value
+            """, [(self.run_id, name, value) for name, value in counts.items()])
+
+    def _runs_sql(self, last_runs):
+        return f"(SELECT run_id FROM runs ORDER BY started_at DESC LIMIT {int(last_runs)})"
+
+    def summary(self, last_runs=10):
+        """Latency percentiles per stage, LLM usage per model and counters of the last runs."""
+        self.flush()
+        runs = self._runs_sql(last_runs)
+        spans_df = pd.read_sql(f"SELECT stage, seconds, ok FROM spans WHERE run_id IN {runs}", self.conn)
+        stages_df = spans_df.groupby("stage").agg(
+            count=("seconds", "size"),
+            p50=("seconds", lambda s: s.quantile(0.5)),
+            p95=("seconds", lambda s: s.quantile(0.95)),
+            total=("seconds", "sum"),
+            failed=("ok", lambda s: int((s == 0).sum())),
+        ).sort_values("total", ascending=False)
+        models_df = pd.read_sql(f"""
+            SELECT model, count(*) AS calls, sum(input_tokens) AS input_tokens,
+                   sum(output_tokens) AS output_tokens, sum(cost) AS cost
+            FROM llm_usage WHERE run_id IN {runs} GROUP BY model
+        """, self.conn)
+        counters = dict(self.conn.execute(
+            f"SELECT name, sum(value) FROM counters WHERE run_id IN {runs} GROUP BY name"
+        ).fetchall())
+        n_runs = self.conn.execute(f"SELECT count(*) FROM {runs}").fetchone()[0]
+        return {"runs": n_runs, "stages": stages_df, "models": models_df, "counters": counters}
+
+    def prometheus_text(self, last_runs=10):
+        """
+        Metrics in the Prometheus text format: totals since the store was created, and
+        latency quantiles over the last runs.
+        """
+        self.flush()
+        lines = [
+            "# HELP upwork_stage_seconds Duration of the pipeline stages over the last runs.",
+            "# TYPE upwork_stage_seconds summary",
+        ]
+        for stage, row in self.summary(last_runs)["stages"].iterrows():
+            lines += [
+                f'upwork_stage_seconds{{stage="{stage}",quantile="0.5"}} {row["p50"]:.6f}',
+                f'upwork_stage_seconds{{stage="{stage}",quantile="0.95"}} {row["p95"]:.6f}',
+                f'upwork_stage_seconds_sum{{stage="{stage}"}} {row["total"]:.6f}',
+                f'upwork_stage_seconds_count{{stage="{stage}"}} {int(row["count"])}',
+            ]
+        lines += ["# HELP upwork_llm_tokens_total LLM tokens per model.", "# TYPE upwork_llm_tokens_total counter"]
+        usage = self.conn.execute("""
+            SELECT model, sum(input_tokens), sum(output_tokens), sum(cost), count(*) FROM llm_usage GROUP BY model
+        """).fetchall()
+        for model, input_tokens, output_tokens, _, _ in usage:
+            lines += [
+                f'upwork_llm_tokens_total{{model="{model}",direction="input"}} {input_tokens}',
+                f'upwork_llm_tokens_total{{model="{model}",direction="output"}} {output_tokens}',
+            ]
+        lines += ["# HELP upwork_llm_cost_usd_total LLM cost per model.", "# TYPE upwork_llm_cost_usd_total counter"]
+        lines += [f'upwork_llm_cost_usd_total{{model="{model}"}} {cost:.6f}' for model, _, _, cost, _ in usage]
+        lines += ["# HELP upwork_events_total Errors, retries and other events.", "# TYPE upwork_events_total counter"]
+        for name, value in self.conn.execute("SELECT name, sum(value) FROM counters GROUP BY name").fetchall():
+            lines.append(f'upwork_events_total{{name="{name}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+        self._local = threading.local()
+
+
+_metrics = None
+
+
+def get_metrics():
+    """Metrics store of this process, at METRICS_PATH, opened on first use."""
+    global _metrics
+    if _metrics is None:
+        _metrics = MetricsStore(os.getenv("METRICS_PATH", "logs/metrics.sqlite"))
+    return _metrics
+
+
+def serve_prometheus(port, path=None, host="0.0.0.0"):
+    """
+    Serve GET /metrics in the Prometheus text format from a daemon thread.
+    The handler reads the store file with its own connection, SQLite ones are per thread.
+    """
+    path = path or get_metrics().path
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip("/") != "/metrics":
+                self.send_error(404)
+                return
+            store = MetricsStore(path)
+            try:
+                body = store.prometheus_text().encode()
+            finally:
+                store.close()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    httpd = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
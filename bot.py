@@ -1,171 +1,646 @@
 import os
 import discord
+from discord import app_commands
 from discord.ext import commands
 from dotenv import load_dotenv
 import pandas as pd
 import duckdb
 import asyncio
-from app.scripts.utils import apply_job
+import time
+from datetime import timedelta
+import re
+import io
+import itertools
+import sys
+import collections
+import contextlib
+import threading
+import logging
+from logging.handlers import RotatingFileHandler
+from app.scripts.utils import (
+    stream_cover_letter, stream_pipeline, iter_unsent_jobs, sent_ledger_path, WindowLimiter,
+    applied_ledger_path, append_ledger, job_description,
+    get_staged_job, CoverLetterCache, CoverLetterPregenerator, QuerySchedule,
+    get_metrics, serve_prometheus
+)
+from app.scripts.config import QUERY_URLS, SCRAPE_OPTIONS, STAGING_OPTIONS, PIPELINE_MODE, DATA_WINDOW_DAYS
 
 load_dotenv(dotenv_path=".env")
 TOKEN = os.getenv("DISCORD_TOKEN")
 GUILD_ID = os.getenv("DISCORD_GUILD_ID")
 CHANNEL_ID = os.getenv("DISCORD_CHANNEL_ID")
+RAW_PATH = os.getenv("RAW_PATH")
 STAGING_PATH = os.getenv("STAGING_PATH")
 SENT_PATH = os.getenv("SENT_PATH")
 APPLIED_PATH = os.getenv("APPLIED_PATH")
+LOG_PATH = os.getenv("LOG_PATH", "logs/pipeline.log")
+PROGRESS_INTERVAL = float(os.getenv("PROGRESS_INTERVAL", "3"))
+EMBEDS_PER_MESSAGE = int(os.getenv("EMBEDS_PER_MESSAGE", "1"))
+LEDGER_BATCH_SIZE = int(os.getenv("LEDGER_BATCH_SIZE", "20"))
+# Discord allows 5 messages per 5 seconds per channel
+DISCORD_MESSAGES_PER_WINDOW = int(os.getenv("DISCORD_MESSAGES_PER_WINDOW", "5"))
+DISCORD_WINDOW_SECONDS = float(os.getenv("DISCORD_WINDOW_SECONDS", "5"))
+# Jobs waiting to be sent, the readers wait while the queue is full
+DISPATCH_QUEUE_SIZE = int(os.getenv("DISPATCH_QUEUE_SIZE", "50"))
+# Unsent jobs read from staging at a time
+UNSENT_BATCH_SIZE = 100
+COVER_LETTER_EDIT_INTERVAL = float(os.getenv("COVER_LETTER_EDIT_INTERVAL", "1.5"))
+METRICS_PORT = os.getenv("METRICS_PORT")
+COVER_LETTER_CACHE_PATH = os.getenv("COVER_LETTER_CACHE_PATH", f"{SENT_PATH}/_cover_letters.sqlite")
+PREGEN_MIN_MATCH = float(os.getenv("PREGEN_MIN_MATCH", "0.8"))
+PREGEN_CONCURRENCY = int(os.getenv("PREGEN_CONCURRENCY", "2"))
+PREGEN_DAILY_BUDGET = int(os.getenv("PREGEN_DAILY_BUDGET", "50"))
+PREGEN_TTL_HOURS = float(os.getenv("PREGEN_TTL_HOURS", "72"))
+
+
+def setup_logging(log_path=LOG_PATH):
+    """Full pipeline logs go to a rotating local file, Discord only gets a summary."""
+    logger = logging.getLogger("upwork_job_finder")
+    if not logger.handlers:
+        os.makedirs(os.path.dirname(log_path) or ".", exist_ok=True)
+        handler = RotatingFileHandler(log_path, maxBytes=5 * 1024 * 1024, backupCount=5, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+    return logger
+
+
+logger = setup_logging()
+
+
+class ProgressReporter:
+    """
+    Keeps a single status message per run up to date instead of sending one message per
+    log line. Lines are buffered and the message is edited at most every `min_interval`
+    seconds. At the end a summary with counts and durations per stage is posted.
+    """
+
+    # Log line prefix -> stage name
+    STAGES = {"Scraping": "Scrape", "Raw Step": "Scrape", "Staging Step": "Evaluate", "Sending Step": "Send"}
+
+    # Numbers taken from the log lines for the summary: (stage, counter, pattern)
+    COUNTERS = [
+        ("Scrape", "new jobs", re.compile(r"Found (\d+) new jobs to download")),
+        ("Evaluate", "prefiltered", re.compile(r"Prefilter rejected (\d+)")),
+        ("Evaluate", "evaluated", re.compile(r"(\d+) of \d+ new jobs were evaluated")),
+        ("Send", "sent", re.compile(r"Sent (\d+) jobs")),
+    ]
+
+    def __init__(self, channel, title="🚀 Running job process...", min_interval=3.0, max_lines=12):
+        self.channel = channel
+        self.title = title
+        self.min_interval = min_interval
+        self.lines = collections.deque(maxlen=max_lines)
+        self.stages = {}
+        self.stage = None
+        self.message = None
+        self.dirty = False
+        self.started = time.perf_counter()
+        self._task = None
+
+    async def start(self):
+        self.message = await self.channel.send(self.title)
+        self._task = asyncio.create_task(self._flush_loop())
+        return self
+
+    def log(self, line):
+        line = line.strip()
+        if not line:
+            return
+        logger.info(line)
+        self.lines.append(line)
+        self.dirty = True
+
+        now = time.perf_counter()
+        for prefix, stage in self.STAGES.items():
+            if line.startswith(prefix):
+                self.stage = stage
+                break
+        if self.stage:
+            stats = self.stages.setdefault(self.stage, {"started": now, "ended": now, "counts": {}})
+            stats["ended"] = now
+
+        for stage, counter, pattern in self.COUNTERS:
+            match = pattern.search(line)
+            if match:
+                counts = self.stages.setdefault(stage, {"started": now, "ended": now, "counts": {}})["counts"]
+                counts[counter] = counts.get(counter, 0) + int(match.group(1))
+
+    def render(self):
+        content = f"{self.title}\n```\n" + "\n".join(self.lines) + "\n```"
+        # Discord messages are limited to 2000 characters, the latest lines are kept
+        return content if len(content) <= 2000 else content[:1950] + "\n…\n```"
+
+    async def flush(self):
+        if self.message is None or not self.dirty:
+            return
+        self.dirty = False
+        try:
+            await self.message.edit(content=self.render())
+        except discord.HTTPException as e:
+            logger.warning(f"Could not update the status message: {e}")
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.min_interval)
+            await self.flush()
+
+    def summary(self):
+        lines = [f"✅ Job process finished in {time.perf_counter() - self.started:.1f}s"]
+        for stage, stats in self.stages.items():
+            counts = ", ".join(f"{value} {name}" for name, value in stats["counts"].items())
+            lines.append(f"• {stage}: {stats['ended'] - stats['started']:.1f}s" + (f" ({counts})" if counts else ""))
+        return "\n".join(lines)
+
+    async def finish(self):
+        if self._task:
+            self._task.cancel()
+        await self.flush()
+        summary = self.summary()
+        logger.info(summary.replace("\n", " | "))
+        await self.channel.send(summary)
+
+
+class ReporterStream(io.TextIOBase):
+    """
+    File-like object forwarding printed lines to a ProgressReporter and to the real stdout.
+    The pipeline also prints from its worker threads.
+    """
+
+    def __init__(self, reporter, stdout):
+        self.reporter = reporter
+        self.stdout = stdout
+        self.buffer = ""
+        self.lock = threading.Lock()
+
+    def write(self, text):
+        with self.lock:
+            self.stdout.write(text)
+            self.buffer += text
+            *lines, self.buffer = self.buffer.split("\n")
+            for line in lines:
+                self.reporter.log(line)
+        return len(text)
+
+    def flush(self):
+        self.stdout.flush()
+
+
+async def report(channel, reporter, line):
+    """Log a line through the run's reporter, or as a message when there is none."""
+    if reporter is not None:
+        reporter.log(line)
+    else:
+        await channel.send(f"🖨️ {line}")
+
+
+# Discord limits of one message: 10 embeds, 6000 characters over all of them
+MAX_EMBEDS = 10
+MAX_EMBEDS_CHARS = 6000
+
+
+def truncate(text, length):
+    text = str(text)
+    if len(text) <= length:
+        return text
+    return text[:length - 1] + "…" if length > 0 else ""
+
+
+def build_job_embed(row, max_description=4096):
+    embed = discord.Embed(
+        title=truncate(row["job_title"], 256),
+        description=truncate(job_description(row), max_description),
+        color=discord.Color.yellow(),
+        url=row["job_link"]
+    )
+    embed.add_field(name="Job ID", value=row["job_id"], inline=True)
+    embed.add_field(name="Experience Level", value=row["job_type_level"], inline=True)
+    embed.add_field(name="Duration", value=row["duration_label"], inline=True)
+    embed.add_field(name="Fixed Price?", value="✅" if row["is_fixed_price"] else "❌", inline=True)
+    embed.add_field(name="Match Level", value=row["match_level"], inline=True)
+    embed.add_field(name="Reason", value=truncate(row["reason"], 1024), inline=False)
+    return embed
+
+
+def fit_job_embeds(rows, max_chars=MAX_EMBEDS_CHARS):
+    """
+    Embeds of `rows` for one message, within `max_chars` in total, or None if they do not fit.
+    When several embeds share the message, each gets an equal share of the characters and
+    its description is cut to what the title and fields leave of it.
+    """
+    if len(rows) == 1:
+        return [build_job_embed(rows[0])]
+    share = max_chars // len(rows)
+    embeds = []
+    for row in rows:
+        room = share - len(build_job_embed(row, max_description=0))
+        if room < 0:
+            return None
+        embeds.append(build_job_embed(row, max_description=room))
+    return embeds
+
+
+def pack_job_embeds(rows, max_embeds=MAX_EMBEDS, max_chars=MAX_EMBEDS_CHARS):
+    """Split `rows` in order into (rows, embeds) groups that each fit one message."""
+    groups = []
+    group, embeds = [], None
+    for row in rows:
+        packed = fit_job_embeds(group + [row], max_chars) if 0 < len(group) < max_embeds else None
+        if packed is None:
+            if group:
+                groups.append((group, embeds))
+            group, embeds = [row], fit_job_embeds([row], max_chars)
+        else:
+            group, embeds = group + [row], packed
+    if group:
+        groups.append((group, embeds))
+    return groups
+
+
+class JobDispatcher:
+    """
+    Outbound queue of job notifications for one channel.
+    Messages are paced to Discord's per-channel limit, at most `messages_per_window`
+    messages in any `window_seconds`, so sends never run into a 429, up to
+    `embeds_per_message` jobs are packed into one message within Discord's 6000 characters
+    (pack_job_embeds), and the sent ledger is appended
+    in batches of `ledger_batch_size` with jobs whose message Discord already accepted.
+    At most `queue_size` jobs wait in the queue, put() waits for room.
+    """
+
+    def __init__(self, channel, SENT_PATH=SENT_PATH, embeds_per_message=1, ledger_batch_size=20,
+                 messages_per_window=5, window_seconds=5.0, queue_size=50, pregenerator=None):
+        self.channel = channel
+        self.pregenerator = pregenerator
+        self.ledger = sent_ledger_path(SENT_PATH)
+        self.embeds_per_message = max(1, min(MAX_EMBEDS, embeds_per_message))
+        self.ledger_batch_size = ledger_batch_size
+        self.limiter = WindowLimiter(messages_per_window, window_seconds)
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.accepted = []
+        self.sent = 0
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def put(self, row):
+        await self.queue.put(row)
+
+    async def join(self):
+        """Wait until everything queued so far is sent and written to the ledger."""
+        await self.queue.join()
+        self.flush_ledger()
+
+    async def close(self):
+        await self.join()
+        if self._task:
+            self._task.cancel()
+
+    async def _run(self):
+        while True:
+            rows = [await self.queue.get()]
+            # Pack whatever is already waiting, without holding back the first job
+            while len(rows) < self.embeds_per_message and not self.queue.empty():
+                rows.append(self.queue.get_nowait())
+            for group, embeds in pack_job_embeds(rows, self.embeds_per_message):
+                try:
+                    await self._send(group, embeds)
+                except Exception as e:
+                    get_metrics().count("discord_errors")
+                    logger.error(f"Could not send jobs {[row['job_id'] for row in group]}: {e}")
+                finally:
+                    for _ in group:
+                        self.queue.task_done()
+
+    async def _send(self, rows, embeds):
+        await self.limiter.acquire()
+        view = JobView([row["job_id"] for row in rows])
+        with get_metrics().span("discord_send"):
+            await self.channel.send(embeds=embeds, view=view)
+        # Clicks are routed to JobButton by custom_id, the view must not stay in memory
+        view.stop()
+        # Only jobs whose message was accepted reach the ledger
+        self.accepted.extend(rows)
+        self.sent += len(rows)
+        if self.pregenerator:
+            for row in rows:
+                self.pregenerator.submit(row)
+        if len(self.accepted) >= self.ledger_batch_size:
+            self.flush_ledger()
+
+    def flush_ledger(self):
+        if not self.accepted:
+            return
+        append_ledger(self.ledger, self.accepted, "sent")
+        self.accepted = []
+
+
+_pregenerator = None
+
+
+def get_pregenerator():
+    """Cover-letter pre-generation shared by every dispatcher, opened on first use."""
+    global _pregenerator
+    if _pregenerator is None:
+        _pregenerator = CoverLetterPregenerator(
+            CoverLetterCache(COVER_LETTER_CACHE_PATH, ttl_hours=PREGEN_TTL_HOURS),
+            min_match_level=PREGEN_MIN_MATCH,
+            concurrency=PREGEN_CONCURRENCY,
+            daily_budget=PREGEN_DAILY_BUDGET,
+        )
+    return _pregenerator
 
 
-async def send_jobs(channel, already_sent_ids):
-        
-        # Processa novos jobs
-        try:
-            job_df = duckdb.query(f"""
-                SELECT * FROM read_parquet('{STAGING_PATH}/*.parquet')
-                WHERE apply = TRUE
-                ORDER BY match_level;
-            """).to_df()
-        except:
-            job_df = pd.DataFrame(columns=["job_id"])
-        
-        await channel.send(f"🖨️ Sending Step: Found {len(job_df)} jobs to send.")
-        await channel.send(f"🖨️ Sending Step: Found {len(already_sent_ids)} jobs have been already sent.")
-        
-        job_df = job_df[job_df["job_id"].isin(already_sent_ids) == False]
-        await channel.send(f"🖨️ Sending Step: Found {len(job_df)} new jobs to send.")
-
-        for _, row in job_df.iterrows():
-            embed = discord.Embed(
-                title=row["job_title"],
-                description=row["job_description"][:4096] if len(row["job_description"]) > 4096 else row["job_description"],
-                color=discord.Color.yellow(),
-                url=row["job_link"]
-            )
-            embed.add_field(name="Job ID", value=row["job_id"], inline=True)
-            embed.add_field(name="Experience Level", value=row["job_type_level"], inline=True)
-            embed.add_field(name="Duration", value=row["duration_label"], inline=True)
-            embed.add_field(name="Fixed Price?", value="✅" if row["is_fixed_price"] else "❌", inline=True)
-            embed.add_field(name="Match Level", value=row["match_level"], inline=True)
-            embed.add_field(name="Reason", value=row["reason"], inline=False)
-
-            await channel.send(embed=embed, view=JobView(row=row, APPLIED_PATH=APPLIED_PATH))
-
-            # Adiciona aos enviados
-            already_sent_ids.append(row["job_id"])
-            file_name = f'{SENT_PATH}/jobs-sent.csv'
-            row_df = pd.DataFrame([row])
-            if os.path.exists(file_name):
-                row_df.to_csv(file_name, mode='a', index=False, header=False)
-            else:
-                row_df.to_csv(file_name, mode='w', index=False, header=True)
-
-
-async def run_core(channel, STAGING_PATH=STAGING_PATH, SENT_PATH=SENT_PATH, APPLIED_PATH=APPLIED_PATH):
-    await channel.send("🚀 Running job process...")
-    
+def new_dispatcher(channel):
+    return JobDispatcher(
+        channel, embeds_per_message=EMBEDS_PER_MESSAGE, ledger_batch_size=LEDGER_BATCH_SIZE,
+        messages_per_window=DISCORD_MESSAGES_PER_WINDOW, window_seconds=DISCORD_WINDOW_SECONDS,
+        queue_size=DISPATCH_QUEUE_SIZE, pregenerator=get_pregenerator()
+    ).start()
+
+
+async def send_jobs(channel, reporter=None, exclude_last=0, dispatcher=None):
+    """
+    Send the applicable staging jobs missing from the sent ledger, in match_level order.
+    With `exclude_last`, the last jobs of the ledger are sent again.
+    """
+    own_dispatcher = dispatcher is None
+    dispatcher = dispatcher or new_dispatcher(channel)
+    sent_before = dispatcher.sent
+
+    n_jobs = 0
+    unsent = iter_unsent_jobs(STAGING_PATH, SENT_PATH, exclude_last, window_days=DATA_WINDOW_DAYS)
+    while True:
+        # DuckDB reads each batch in a thread, the event loop keeps sending meanwhile
+        rows = await asyncio.to_thread(list, itertools.islice(unsent, UNSENT_BATCH_SIZE))
+        if not rows:
+            break
+        for row in rows:
+            # Waits while the queue is full, rows are read as fast as they are sent
+            await dispatcher.put(row)
+            n_jobs += 1
+    await report(channel, reporter, f"Sending Step: Found {n_jobs} new jobs to send.")
+
+    if own_dispatcher:
+        await dispatcher.close()
+    else:
+        await dispatcher.join()
+    await report(channel, reporter, f"Sending Step: Sent {dispatcher.sent - sent_before} jobs.")
+
+
+async def run_pipeline(channel, reporter, only_due=False):
+    """
+    Scrape, evaluate and send inside the bot process: each job evaluated with apply = True
+    is sent while the other queries are still being scraped and evaluated.
+    """
+    started = time.perf_counter()
+    send_queue = asyncio.Queue()
+    dispatcher = new_dispatcher(channel)
+    pipeline = asyncio.create_task(stream_pipeline(
+        QUERY_URLS, RAW_PATH, STAGING_PATH, send_queue, only_due=only_due, **SCRAPE_OPTIONS, **STAGING_OPTIONS
+    ))
+
+    try:
+        # Streamed jobs were just staged, so they cannot be in the sent ledger yet
+        n_queued = 0
+        while True:
+            row = await send_queue.get()
+            if row is None:
+                break
+            await dispatcher.put(row)
+            n_queued += 1
+            if n_queued == 1:
+                await dispatcher.join()
+                reporter.log(f"Sending Step: Time to first notification {time.perf_counter() - started:.2f}s.")
+
+        await pipeline
+        await dispatcher.join()
+        reporter.log(f"Sending Step: Sent {dispatcher.sent} jobs while streaming, in {time.perf_counter() - started:.2f}s.")
+
+        # Applicable jobs staged by earlier runs that were never sent
+        await send_jobs(channel, reporter, dispatcher=dispatcher)
+    finally:
+        await dispatcher.close()
+
+
+async def run_subprocess(channel, reporter, only_due=False):
     # Executa o scraper
     process = await asyncio.create_subprocess_exec(
     "python", "-u", "app/scripts/main.py",  # Adiciona o flag -u para desativar o buffering
+    *(["--due"] if only_due else []),
     stdout=asyncio.subprocess.PIPE,
-    stderr=asyncio.subprocess.PIPE,
-    env={**os.environ, "PYTHONUNBUFFERED": "1"}  # Garante que o subprocesso use saída não bufferizada
+    stderr=asyncio.subprocess.STDOUT,  # Errors end up in the log file too
+    env={**os.environ, "PYTHONUNBUFFERED": "1", "METRICS_RUN_ID": get_metrics().run_id}  # Garante que o subprocesso use saída não bufferizada
 )
 
-    # stdout, stderr = await process.communicate()
-    # print(f"STDOUT: {stdout.decode()}")
-    # print(f"STDERR: {stderr.decode()}")
-
+    # Lines are only buffered here, so stdout is read as fast as the scraper writes it
     while True:
         line = await process.stdout.readline()
         if not line:
             break
         decoded_line = line.decode().strip()
         print(decoded_line)
-        await channel.send(f"🖨️ {decoded_line}")
+        reporter.log(decoded_line)
 
     await process.wait()
 
-    # Carrega jobs já enviados
-    already_sent_ids = pd.read_csv(f'{SENT_PATH}/jobs-sent.csv')['job_id'].tolist() if os.path.exists(f'{SENT_PATH}/jobs-sent.csv') else []
+    await send_jobs(channel, reporter)
 
-    await send_jobs(channel, already_sent_ids)
-    
-    await channel.send("✅ Job process finished!")
+
+async def run_core(channel, STAGING_PATH=STAGING_PATH, SENT_PATH=SENT_PATH, APPLIED_PATH=APPLIED_PATH, only_due=False):
+    reporter = await ProgressReporter(channel, min_interval=PROGRESS_INTERVAL).start()
+    get_metrics().start_run()
+
+    try:
+        # The subprocess path is kept as a fallback, with PIPELINE_MODE=subprocess
+        if PIPELINE_MODE == "subprocess":
+            await run_subprocess(channel, reporter, only_due)
+        else:
+            # Everything printed by the pipeline goes to the status message and the log file
+            with contextlib.redirect_stdout(ReporterStream(reporter, sys.stdout)):
+                await run_pipeline(channel, reporter, only_due)
+    except Exception as e:
+        reporter.log(f"Error: {e}")
+        raise
+    finally:
+        cache = get_pregenerator().cache
+        cache.evict()
+        stats = cache.stats()
+        reporter.log(
+            f"Sending Step: Pre-generated cover letters hit rate {stats['hit_rate']:.0%} "
+            f"({stats['hits']} hits, {stats['misses']} misses), {stats['wasted']} of {stats['generated']} wasted."
+        )
+        get_metrics().finish_run()
+        await reporter.finish()
 
 
 async def watch_jobs(channel, STAGING_PATH=STAGING_PATH, SENT_PATH=SENT_PATH, APPLIED_PATH=APPLIED_PATH):
     while True:
-        await run_core(channel, STAGING_PATH, SENT_PATH, APPLIED_PATH)
-        await asyncio.sleep(3600)  # Espera 1h até a próxima execução
+        try:
+            await run_core(channel, STAGING_PATH, SENT_PATH, APPLIED_PATH, only_due=True)
+            # Until the next query is due, each query has its own poll interval
+            delay = QuerySchedule.load(RAW_PATH).seconds_until_due(QUERY_URLS)
+        except Exception as e:
+            # A failed run must not stop the polling, the next run retries the due queries
+            get_metrics().count("pipeline_errors")
+            logger.exception(f"Pipeline run failed: {e}")
+            delay = 0
+        await asyncio.sleep(max(delay, SCRAPE_OPTIONS["poll_min_interval"]))
 
 intents = discord.Intents.default()
 intents.message_content = True  # Enable message content intent
 
 bot = commands.Bot(command_prefix="!", intents=intents)
 
-class JobView(discord.ui.View):
-    def __init__(self, row, APPLIED_PATH):
-        super().__init__(timeout=None)  # Chama o init da View normalmente
-        self.row = row  # Agora salva o row como atributo
-        self.APPLIED_PATH = APPLIED_PATH  # Salva o caminho do diretório de aplicados
-
-    async def apply_reply(self, interaction: discord.Interaction):
-        application = apply_job(self.row)  # Usa o self.row
-
-        # Salva o job aplicado no CSV
-        row_df = pd.DataFrame([self.row])
-        file_name = f'{self.APPLIED_PATH}/jobs-applied.csv'
-        if os.path.exists(file_name):
-            row_df.to_csv(file_name, mode='a', index=False, header=False)
+async def stream_to_message(channel, header, chunks, edit_interval=COVER_LETTER_EDIT_INTERVAL):
+    """
+    Post a message and grow it with the text of the async iterator `chunks`, editing it at
+    most every `edit_interval` seconds. Text past Discord's 2000 characters goes to new
+    messages. Failures replace the placeholder with a visible error.
+    """
+    limit = 2000
+    message = await channel.send(f"{header}\n✍️ Writing the cover letter...")
+    text = ""
+    last_edit = time.monotonic()
+    try:
+        async for chunk in chunks:
+            text += chunk
+            if time.monotonic() - last_edit >= edit_interval:
+                await message.edit(content=f"{header}\n{text}▌"[:limit])
+                last_edit = time.monotonic()
+    except Exception as e:
+        logger.error(f"Cover letter generation failed: {e}")
+        await message.edit(content=f"{header}\n⚠️ Could not generate the cover letter: {e}"[:limit])
+        return None
+
+    if not text.strip():
+        await message.edit(content=f"{header}\n⚠️ The cover letter came back empty, try again.")
+        return None
+
+    content = f"{header}\n{text}"
+    await message.edit(content=content[:limit])
+    for start in range(limit, len(content), limit):
+        await channel.send(content[start:start + limit])
+    return text
+
+
+async def send_text(channel, content, limit=2000):
+    """Send `content` in as many messages as Discord's 2000 characters limit needs."""
+    for start in range(0, len(content), limit):
+        await channel.send(content[start:start + limit])
+
+
+class JobButton(discord.ui.DynamicItem[discord.ui.Button], template=r"job:(?P<action>apply|skip):(?P<index>\d+):(?P<job_id>.+)"):
+    """
+    Apply or Skip button of the job at `index` in a message with one or more job embeds.
+    Its whole state is in the custom_id, so buttons keep working after a restart and the
+    bot holds nothing per sent job: the job is read back from staging when clicked.
+    """
+
+    def __init__(self, action, index, job_id, n_jobs=1):
+        suffix = f" #{index + 1}" if n_jobs > 1 else ""
+        custom_id = f"job:{action}:{index}:{job_id}"
+        if action == "apply":
+            button = discord.ui.Button(label=f"Apply{suffix}", style=discord.ButtonStyle.grey, emoji="😎", custom_id=custom_id)
+        else:
+            button = discord.ui.Button(label=f"Skip{suffix}", style=discord.ButtonStyle.grey, emoji="❌", custom_id=custom_id)
+        super().__init__(button)
+        self.action = action
+        self.index = index
+        self.job_id = job_id
+
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Button, match):
+        return cls(match["action"], int(match["index"]), match["job_id"])
+
+    async def callback(self, interaction: discord.Interaction):
+        if self.action == "apply":
+            await apply_button(interaction, self)
         else:
-            row_df.to_csv(file_name, mode='w', index=False, header=True)
+            await skip_button(interaction, self)
+
+
+class JobView(discord.ui.View):
+    """Apply and Skip buttons of the jobs of one message, built from their job_ids only."""
+
+    def __init__(self, job_ids):
+        super().__init__(timeout=None)
+        for index, job_id in enumerate(job_ids):
+            self.add_item(JobButton("apply", index, job_id, len(job_ids)))
+            self.add_item(JobButton("skip", index, job_id, len(job_ids)))
 
-        # Cria a thread com o máximo de tempo possível antes de arquivar
-        thread = await interaction.channel.create_thread(
-            name="Application reply",
-            message=interaction.message,
-            auto_archive_duration=10080  # 7 dias (máximo possível)
-        )
 
-        # Envia a aplicação na thread
-        await thread.send(content=f"{interaction.user.mention}\n{application}")
+async def apply_reply(interaction: discord.Interaction, row, APPLIED_PATH=APPLIED_PATH):
+    # Salva o job aplicado no CSV
+    append_ledger(applied_ledger_path(APPLIED_PATH), [row], "apply")
 
-    @discord.ui.button(label="Apply", style=discord.ButtonStyle.grey, emoji="😎")
-    async def apply_button(self, interaction: discord.Interaction, button: discord.Button):
-        await interaction.response.defer()
+    # Cria a thread com o máximo de tempo possível antes de arquivar
+    thread = await interaction.channel.create_thread(
+        name="Application reply",
+        message=interaction.message,
+        auto_archive_duration=10080  # 7 dias (máximo possível)
+    ) if interaction.message.thread is None else interaction.message.thread
 
-        await self.apply_reply(interaction)
+    # A letter pre-generated when the job was sent is posted right away
+    text = get_pregenerator().lookup(row)
+    if text is not None:
+        await send_text(thread, f"{interaction.user.mention}\n{text}")
+        return
 
-        button.label = "Applied"
-        button.emoji = "✅"
-        button.style = discord.ButtonStyle.green
-        button.disabled = True
+    # Envia a aplicação na thread, escrita enquanto o modelo gera o texto
+    await stream_to_message(thread, interaction.user.mention, stream_cover_letter(row))
 
-        skip_button = [b for b in self.children if b.label == "Skip"][0]
-        skip_button.disabled = True
 
-        emb = interaction.message.embeds[0]
-        emb.description = "You applied successfully!"
-        emb.color = discord.Color.green()
+async def close_job(interaction: discord.Interaction, button: JobButton, label, emoji, style, description, color):
+    """Disable the buttons of the clicked job and recolor its embed, in the message itself."""
+    view = discord.ui.View.from_message(interaction.message, timeout=None)
+    for item in view.children:
+        if getattr(item, "custom_id", None) in (f"job:apply:{button.index}:{button.job_id}", f"job:skip:{button.index}:{button.job_id}"):
+            item.disabled = True
+            if item.custom_id == button.item.custom_id:
+                item.label, item.emoji, item.style = label, emoji, style
 
-        await interaction.edit_original_response(embed=emb, view=self)
+    embeds = interaction.message.embeds
+    embeds[button.index].description = description
+    embeds[button.index].color = color
+    await interaction.edit_original_response(embeds=embeds, view=view)
+    # Clicks are routed to JobButton, the edited view must not stay in memory
+    view.stop()
 
-    @discord.ui.button(label="Skip", style=discord.ButtonStyle.grey, emoji="❌")
-    async def skip_button(self, interaction: discord.Interaction, button: discord.Button):
-        await interaction.response.defer()
 
-        button.label = "Skipped"
-        button.style = discord.ButtonStyle.red
-        button.emoji = "🙅🏻‍♂️"
-        button.disabled = True
+async def apply_button(interaction: discord.Interaction, button: JobButton):
+    await interaction.response.defer()
 
-        apply_button = [b for b in self.children if b.label == "Apply"][0]
-        apply_button.disabled = True
+    row = await asyncio.to_thread(get_staged_job, STAGING_PATH, button.job_id, DATA_WINDOW_DAYS)
+    if row is None:
+        await interaction.followup.send(f"Job {button.job_id} is no longer in staging.", ephemeral=True)
+        return
+    await apply_reply(interaction, row)
 
-        emb = interaction.message.embeds[0]
-        emb.color = discord.Color.red()
-        emb.description = "You skipped the application!"
-        await interaction.edit_original_response(embed=emb, view=self)
+    await close_job(
+        interaction, button, "Applied", "✅", discord.ButtonStyle.green,
+        "You applied successfully!", discord.Color.green()
+    )
+
+
+async def skip_button(interaction: discord.Interaction, button: JobButton):
+    await interaction.response.defer()
+    get_pregenerator().cache.mark_skipped(button.job_id)
+
+    await close_job(
+        interaction, button, "Skipped", "🙅🏻‍♂️", discord.ButtonStyle.red,
+        "You skipped the application!", discord.Color.red()
+    )
+
+
+@bot.event
+async def setup_hook():
+    # Buttons of every message ever sent are handled from their custom_id
+    bot.add_dynamic_items(JobButton)
+    if METRICS_PORT:
+        serve_prometheus(int(METRICS_PORT))
 
 
 @bot.event
@@ -181,17 +656,111 @@ async def on_ready():
     # Inicia a monitoração do CSV
     bot.loop.create_task(watch_jobs(channel, STAGING_PATH=STAGING_PATH, APPLIED_PATH=APPLIED_PATH))
 
+async def purge_channel(channel, on_progress=None, bot_only=False, older_than_days=0, delete_interval=1.0):
+    """
+    Delete the messages of `channel`, all of them or only the bot's / those older than
+    `older_than_days`. Messages younger than 14 days are bulk deleted 100 at a time, older
+    ones can only be deleted one by one, every `delete_interval` seconds.
+    Returns the number of deleted messages.
+    """
+    now = discord.utils.utcnow()
+    # A minute of margin, Discord rejects the whole bulk if one message is past 14 days
+    bulk_cutoff = now - timedelta(days=14) + timedelta(minutes=1)
+    before = now - timedelta(days=older_than_days) if older_than_days else None
+    bulk = []
+    deleted = 0
+
+    async def flush():
+        nonlocal bulk, deleted
+        if bulk:
+            await channel.delete_messages(bulk)
+            deleted += len(bulk)
+            bulk = []
+            if on_progress:
+                await on_progress(deleted)
+
+    # Newest first, so every bulk-deletable message comes before the old ones
+    async for message in channel.history(limit=None, before=before):
+        if bot_only and message.author.id != bot.user.id:
+            continue
+        if message.created_at > bulk_cutoff:
+            bulk.append(message)
+            if len(bulk) == 100:
+                await flush()
+        else:
+            await flush()
+            await message.delete()
+            deleted += 1
+            if on_progress:
+                await on_progress(deleted)
+            await asyncio.sleep(delete_interval)
+    await flush()
+    return deleted
+
+
 # command to delete all messages in the channel
 @bot.tree.command(name="delete_all", description="Deleta todas as mensagens")
-@commands.has_permissions(manage_messages=True)
-async def delete_all(ctx):
+@app_commands.describe(bot_only="Only delete the bot's messages", older_than_days="Only delete messages older than this")
+@app_commands.checks.has_permissions(manage_messages=True)
+async def delete_all(interaction: discord.Interaction, bot_only: bool = False, older_than_days: int = 0):
     channel = bot.get_channel(int(CHANNEL_ID))
-    if channel:
-        async for message in channel.history(limit=1000):
-            await message.delete()
-        await ctx.send("All messages deleted.")
-    else:
-        await ctx.send("Channel not found.")
+    if channel is None:
+        await interaction.response.send_message("Channel not found.", ephemeral=True)
+        return
+
+    # The status message is ephemeral, so it is not in the history being deleted
+    await interaction.response.send_message("🧹 Deleting messages...", ephemeral=True)
+    last_edit = 0.0
+
+    async def on_progress(deleted):
+        nonlocal last_edit
+        if time.monotonic() - last_edit < PROGRESS_INTERVAL:
+            return
+        last_edit = time.monotonic()
+        try:
+            await interaction.edit_original_response(content=f"🧹 Deleted {deleted} messages...")
+        except discord.HTTPException:
+            # The interaction token expires after 15 minutes, the purge goes on
+            pass
+
+    try:
+        deleted = await purge_channel(channel, on_progress, bot_only=bot_only, older_than_days=older_than_days)
+        content = f"✅ Deleted {deleted} messages."
+    except discord.HTTPException as e:
+        logger.error(f"Channel purge failed: {e}")
+        content = f"⚠️ Purge stopped: {e}"
+    try:
+        await interaction.edit_original_response(content=content)
+    except discord.HTTPException:
+        await channel.send(content)
+
+def format_stats(summary):
+    """Stage latencies, LLM usage and counters of a MetricsStore summary, as a code block."""
+    lines = [f"{'stage':<16}{'n':>7}{'p50':>9}{'p95':>9}{'total':>9}{'fail':>6}"]
+    for stage, row in summary["stages"].iterrows():
+        lines.append(
+            f"{stage:<16}{int(row['count']):>7}{row['p50']:>8.2f}s{row['p95']:>8.2f}s"
+            f"{row['total']:>8.0f}s{int(row['failed']):>6}"
+        )
+    lines.append("")
+    lines.append(f"{'model':<16}{'calls':>7}{'in':>11}{'out':>9}{'cost':>9}")
+    for _, row in summary["models"].iterrows():
+        lines.append(
+            f"{row['model']:<16}{int(row['calls']):>7}{int(row['input_tokens']):>11}"
+            f"{int(row['output_tokens']):>9}{row['cost']:>8.3f}$"
+        )
+    if summary["counters"]:
+        lines.append("")
+        lines.append(", ".join(f"{name}: {value}" for name, value in sorted(summary["counters"].items())))
+    return "```\n" + "\n".join(lines) + "\n```"
+
+
+@bot.tree.command(name="stats", description="Latency, tokens and cost of the last runs")
+async def stats(interaction: discord.Interaction, last_runs: int = 10):
+    summary = get_metrics().summary(last_runs)
+    content = f"📊 Last {summary['runs']} runs\n{format_stats(summary)}"
+    await interaction.response.send_message(content[:2000], ephemeral=True)
+
 
 @bot.tree.command(name="run_scraper", description="Run scraping")
 @commands.has_permissions(administrator=True)
@@ -209,14 +778,13 @@ async def resend_last_jobs(ctx, n_last: int = 10):
     try:
         channel = bot.get_channel(int(CHANNEL_ID))
 
-        already_sent_ids = pd.read_csv(f'{SENT_PATH}/jobs-sent.csv')['job_id'].tolist() if os.path.exists(f'{SENT_PATH}/jobs-sent.csv') else []
-        # remover os últimos n_last ids da lista
-        already_sent_ids = already_sent_ids[:-n_last] if len(already_sent_ids) > n_last else []
-        await send_jobs(channel, already_sent_ids)
+        # The last n_last jobs of the ledger are sent again
+        await send_jobs(channel, exclude_last=n_last)
         
     except Exception as e:
         await channel.send(f"⚠️ Exceção: {e}")
 
-bot.run(TOKEN)
+if __name__ == "__main__":
+    bot.run(TOKEN)
 
 
@@ -0,0 +1,64 @@
+"""
+Shared setup of the tests. The pipeline modules are imported from app/scripts like
+main.py and benchmark.py do, and every store of a test lives in its temporary directory.
+"""
+import importlib
+import os
+import random
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "app", "scripts"))
+# bot.py imports the pipeline as app.scripts.utils
+sys.path.insert(1, ROOT)
+
+import utils  # noqa: E402
+from fakes import LOREM_WORDS, POST_DATES, fake_job_id  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def isolated_stores(tmp_path, monkeypatch):
+    """Metrics and texts go to the test's directory, and there is no lease store unless a test opens one."""
+    monkeypatch.setenv("METRICS_PATH", str(tmp_path / "metrics.sqlite"))
+    monkeypatch.setenv("TEXT_STORE_PATH", str(tmp_path / "texts.sqlite"))
+    monkeypatch.setenv("LEASE_TTL", "0")
+    monkeypatch.setattr(utils, "_metrics", None)
+    monkeypatch.setattr(utils, "_text_store", None)
+    monkeypatch.setattr(utils, "_leases", None)
+
+
+@pytest.fixture
+def make_jobs():
+    """Builds a DataFrame of `n_jobs` synthetic raw jobs, like the scraper's rows."""
+    def make(n_jobs, seed=0):
+        rng = random.Random(seed)
+        datetime_now = utils.pd.Timestamp.now()
+        jobs = []
+        for i in range(n_jobs):
+            title = " ".join(rng.choice(LOREM_WORDS) for _ in range(6)).capitalize()
+            jobs.append({
+                "job_id": fake_job_id(i),
+                "job_title": title,
+                "job_description": " ".join(rng.choice(LOREM_WORDS) for _ in range(rng.randint(80, 250))),
+                "description_key": None,
+                "job_link": f"/jobs/{title.replace(' ', '-')}_~{fake_job_id(i)}/",
+                "job_post_date": rng.choice(POST_DATES),
+                "job_type_level": "Fixed price",
+                "job_experience_level": "Intermediate",
+                "is_fixed_price": "$500",
+                "duration_label": "1 to 3 months",
+                "datetime": datetime_now,
+            })
+        return utils.pd.DataFrame(jobs)
+    return make
+
+
+@pytest.fixture
+def bot(tmp_path, monkeypatch):
+    """The bot module, imported with its log file in the test's directory and fresh metrics."""
+    monkeypatch.setenv("LOG_PATH", str(tmp_path / "pipeline.log"))
+    bot = importlib.import_module("bot")
+    monkeypatch.setattr(importlib.import_module("app.scripts.utils"), "_metrics", None)
+    return bot
@@ -0,0 +1,61 @@
+import asyncio
+import os
+
+import openai
+
+from fakes import FakeOpenAIServer
+from utils import duckdb, evaluate_jobs_async, evaluate_jobs_batch, pending_batch_path, read_latest_sql
+
+
+def staged_results(path):
+    return duckdb.query(
+        f"SELECT job_id, match_level, apply, reason FROM {read_latest_sql(path)} ORDER BY job_id"
+    ).fetchall()
+
+
+def test_batch_and_async_results_agree(tmp_path, make_jobs):
+    jobs_df = make_jobs(40)
+    batch_path, async_path = str(tmp_path / "batch"), str(tmp_path / "async")
+
+    async def run():
+        with FakeOpenAIServer(batch_delay=0.2) as server:
+            client = openai.AsyncOpenAI(base_url=server.base_url, api_key="fake", max_retries=0)
+            try:
+                batch_written = await evaluate_jobs_batch(jobs_df, batch_path, poll_interval=0.1, client=client)
+                async_written = await evaluate_jobs_async(jobs_df, async_path, concurrency=4, client=client)
+            finally:
+                await client.close()
+            return batch_written, async_written, server.counts
+
+    batch_written, async_written, counts = asyncio.run(run())
+
+    assert batch_written == async_written == len(jobs_df)
+    assert counts["batches"] == 1
+    # Both modes share the prompt and the validation of the answers
+    assert staged_results(batch_path) == staged_results(async_path)
+
+
+def test_batch_without_waiting_is_merged_on_a_later_call(tmp_path, make_jobs):
+    jobs_df = make_jobs(20)
+    path = str(tmp_path / "staging")
+
+    async def run():
+        with FakeOpenAIServer(batch_delay=0.5) as server:
+            client = openai.AsyncOpenAI(base_url=server.base_url, api_key="fake", max_retries=0)
+            try:
+                # Submitted, not finished yet: nothing is written and the batch stays pending
+                submitted = await evaluate_jobs_batch(jobs_df, path, client=client, wait=False)
+                still_pending = os.path.exists(pending_batch_path(path))
+                await asyncio.sleep(0.6)
+                merged = await evaluate_jobs_batch(jobs_df, path, client=client, wait=False)
+            finally:
+                await client.close()
+            return submitted, still_pending, merged, server.counts
+
+    submitted, still_pending, merged, counts = asyncio.run(run())
+
+    assert submitted == 0 and still_pending
+    assert merged == len(jobs_df)
+    assert counts["batches"] == 1
+    assert not os.path.exists(pending_batch_path(path))
+    assert len(staged_results(path)) == len(jobs_df)
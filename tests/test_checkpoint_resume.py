@@ -0,0 +1,60 @@
+import asyncio
+
+import openai
+import pytest
+
+from fakes import FakeOpenAIServer
+from utils import duckdb, evaluate_jobs_async, read_dataset_sql
+
+
+class Interrupted(Exception):
+    pass
+
+
+def test_resume_evaluates_nothing_twice(tmp_path, make_jobs):
+    jobs_df = make_jobs(30)
+    staging_path = str(tmp_path / "staging")
+    evaluated = []
+
+    def interrupt_after(n_jobs):
+        def on_result(row, result):
+            evaluated.append(row["job_id"])
+            if len(evaluated) == n_jobs:
+                raise Interrupted()
+        return on_result
+
+    async def run():
+        with FakeOpenAIServer() as server:
+            client = openai.AsyncOpenAI(base_url=server.base_url, api_key="fake", max_retries=0)
+            try:
+                # One worker, so no request is in flight when the run stops
+                with pytest.raises(Interrupted):
+                    await evaluate_jobs_async(
+                        jobs_df, staging_path, concurrency=1, checkpoint_every=5, client=client,
+                        on_result=interrupt_after(12)
+                    )
+                checkpointed = {job_id for (job_id,) in duckdb.query(
+                    f"SELECT DISTINCT job_id FROM {read_dataset_sql(staging_path)}"
+                ).fetchall()}
+
+                pending_df = jobs_df[~jobs_df["job_id"].isin(checkpointed)]
+                evaluated.clear()
+                written = await evaluate_jobs_async(
+                    pending_df, staging_path, concurrency=4, checkpoint_every=5, client=client,
+                    on_result=lambda row, result: evaluated.append(row["job_id"])
+                )
+            finally:
+                await client.close()
+            return checkpointed, written, server.counts
+
+    checkpointed, written, counts = asyncio.run(run())
+
+    # What finished before the interruption was checkpointed, even past the last checkpoint
+    assert len(checkpointed) == 12
+    assert not checkpointed & set(evaluated)
+    assert written == len(jobs_df) - 12
+    assert counts["responses"] == len(jobs_df)
+    n_rows, n_jobs = duckdb.query(
+        f"SELECT count(*), count(DISTINCT job_id) FROM {read_dataset_sql(staging_path)}"
+    ).fetchone()
+    assert n_rows == n_jobs == len(jobs_df)
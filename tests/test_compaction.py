@@ -0,0 +1,39 @@
+import glob
+import os
+
+from utils import STAGING_SCHEMA, append_dataset, compact_dataset, duckdb, read_latest_sql
+
+
+def staged(make_jobs, match_level):
+    jobs_df = make_jobs(3)
+    jobs_df["match_level"] = match_level
+    jobs_df["apply"] = match_level >= 0.5
+    jobs_df["reason"] = f"Evaluated with {match_level}"
+    jobs_df["model"] = "test"
+    return jobs_df
+
+
+def latest_match_levels(path):
+    return dict(duckdb.query(f"SELECT job_id, match_level FROM {read_latest_sql(path)}").fetchall())
+
+
+def test_latest_row_wins_before_and_after_compaction(tmp_path, make_jobs):
+    path = str(tmp_path / "staging")
+    # Same job_ids and scrape date, the second file is written later
+    append_dataset(staged(make_jobs, 0.2), path, STAGING_SCHEMA, "staging")
+    append_dataset(staged(make_jobs, 0.9), path, STAGING_SCHEMA, "staging")
+    files = glob.glob(os.path.join(path, "*", "*.parquet"))
+    assert len(files) == 2
+
+    before = latest_match_levels(path)
+    assert set(before.values()) == {0.9}
+
+    compact_dataset(path, STAGING_SCHEMA, "staging")
+    assert len(glob.glob(os.path.join(path, "*", "*.parquet"))) == 1
+    assert latest_match_levels(path) == before
+
+    # The compacted file keeps the write time of its newest source, rows written afterwards stay newer
+    append_dataset(staged(make_jobs, 0.4), path, STAGING_SCHEMA, "staging")
+    assert set(latest_match_levels(path).values()) == {0.4}
+    compact_dataset(path, STAGING_SCHEMA, "staging")
+    assert set(latest_match_levels(path).values()) == {0.4}
@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+
+from fakes import FakeDiscordChannel, FakeDiscordHTTPError
+from utils import duckdb, sent_ledger_path
+
+
+def test_packed_messages_stay_within_discord_limits(bot, tmp_path, make_jobs):
+    jobs_df = make_jobs(25)
+    # Descriptions at the 4096 characters an embed allows on its own
+    jobs_df["job_description"] = [("lorem ipsum " * 400)[:4096]] * len(jobs_df)
+    jobs_df["match_level"] = 0.9
+    jobs_df["reason"] = "Matches the profile."
+    rows = jobs_df.to_dict("records")
+    sent_path = str(tmp_path / "sent")
+
+    async def run():
+        channel = FakeDiscordChannel(rate_limit=1000, per=1.0, latency=0)
+        dispatcher = bot.JobDispatcher(
+            channel, sent_path, embeds_per_message=10, messages_per_window=1000, window_seconds=1.0
+        ).start()
+        for row in rows:
+            await dispatcher.put(row)
+        await dispatcher.close()
+        return channel
+
+    channel = asyncio.run(run())
+
+    assert channel.counts.get("400", 0) == 0
+    assert channel.counts["embeds"] == len(rows)
+    assert channel.counts["messages"] < len(rows)
+    for message in channel.messages:
+        assert len(message.embeds) <= 10
+        assert sum(len(embed) for embed in message.embeds) <= 6000
+    # A job alone in its message keeps its whole description
+    assert all(
+        len(message.embeds[0].description) == 4096 for message in channel.messages if len(message.embeds) == 1
+    )
+    ledger = duckdb.query(f"SELECT count(DISTINCT job_id) FROM read_csv('{sent_ledger_path(sent_path)}')").fetchone()[0]
+    assert ledger == len(rows)
+
+
+def test_fake_channel_rejects_oversized_messages(bot, make_jobs):
+    jobs_df = make_jobs(2)
+    jobs_df["job_description"] = "x" * 4096
+    jobs_df["match_level"] = 0.9
+    jobs_df["reason"] = "Matches the profile."
+    embeds = [bot.build_job_embed(row) for row in jobs_df.to_dict("records")]
+
+    channel = FakeDiscordChannel(latency=0)
+    with pytest.raises(FakeDiscordHTTPError) as error:
+        asyncio.run(channel.send(embeds=embeds))
+    assert error.value.status == 400
+    assert channel.counts["400"] == 1
@@ -0,0 +1,56 @@
+import multiprocessing
+import random
+
+from utils import LeaseStore
+
+JOB_IDS = [f"job{i}" for i in range(300)]
+
+
+def claim_worker(path, owner, barrier, results):
+    store = LeaseStore(path, owner=owner, ttl=60)
+    rng = random.Random(owner)
+    job_ids = JOB_IDS[:]
+    rng.shuffle(job_ids)
+    barrier.wait()
+    claimed = set()
+    # Small overlapping claims, so the workers race on every job_id
+    for start in range(0, len(job_ids), 20):
+        claimed |= store.claim_jobs(job_ids[start:start + 20])
+    store.close()
+    results.put((owner, sorted(claimed)))
+
+
+def test_claim_jobs_is_exclusive_across_processes(tmp_path):
+    path = str(tmp_path / "leases.sqlite")
+    n_workers = 4
+    ctx = multiprocessing.get_context("spawn")
+    barrier = ctx.Barrier(n_workers)
+    results = ctx.Queue()
+    workers = [
+        ctx.Process(target=claim_worker, args=(path, f"worker{i}", barrier, results)) for i in range(n_workers)
+    ]
+    for worker in workers:
+        worker.start()
+    claimed = dict(results.get(timeout=60) for _ in workers)
+    for worker in workers:
+        worker.join(timeout=60)
+        assert worker.exitcode == 0
+
+    all_claims = [job_id for job_ids in claimed.values() for job_id in job_ids]
+    assert len(all_claims) == len(set(all_claims)), "a job_id was claimed by two workers"
+    assert set(all_claims) == set(JOB_IDS)
+
+
+def test_claims_are_free_again_once_expired(tmp_path):
+    path = str(tmp_path / "leases.sqlite")
+    first, second = LeaseStore(path, owner="first", ttl=60), LeaseStore(path, owner="second", ttl=60)
+    try:
+        assert first.claim_jobs(["a", "b"]) == {"a", "b"}
+        assert second.claim_jobs(["a", "b", "c"]) == {"c"}
+        # A claim that expired, its owner died, goes to the next worker
+        first.conn.execute("UPDATE claims SET expires_at = 0 WHERE owner = 'first'")
+        first.conn.commit()
+        assert second.claim_jobs(["a", "b"]) == {"a", "b"}
+    finally:
+        first.close()
+        second.close()
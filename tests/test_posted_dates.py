@@ -0,0 +1,33 @@
+import pandas as pd
+import pytest
+
+from utils import get_posted_datetime, parse_posted_dates
+
+POSTED_TEXTS = [
+    "Posted 5 seconds ago", "Posted 1 second ago", "Posted 1 minute ago", "Posted 45 minutes ago",
+    "Posted 1 hour ago", "Posted 2 hours ago", "Posted 1 day ago", "Posted 3 days ago",
+    "Posted 1 week ago", "Posted 2 weeks ago", "Posted 1 month ago", "Posted 4 months ago",
+    "Posted today", "Posted yesterday", "Posted last week", "Posted last month", "Posted last year",
+    "  POSTED 10 MINUTES AGO  ", "posted   7   days   ago",
+]
+UNRECOGNIZED_TEXTS = ["Posted recently", "Posted a while ago", "", "Posted 2 years ago"]
+
+
+def test_parse_posted_dates_matches_get_posted_datetime():
+    timestamps = pd.Series(pd.date_range("2024-05-01 12:00", periods=len(POSTED_TEXTS), freq="37min"))
+    post_dates, n_unrecognized = parse_posted_dates(timestamps, pd.Series(POSTED_TEXTS))
+
+    assert n_unrecognized == 0
+    expected = [get_posted_datetime(timestamp, text) for timestamp, text in zip(timestamps, POSTED_TEXTS)]
+    assert list(post_dates) == expected
+
+
+@pytest.mark.parametrize("text", UNRECOGNIZED_TEXTS)
+def test_unrecognized_texts_become_nat(text):
+    timestamp = pd.Timestamp("2024-05-01 12:00")
+    with pytest.raises(ValueError):
+        get_posted_datetime(timestamp, text)
+
+    post_dates, n_unrecognized = parse_posted_dates(pd.Series([timestamp]), pd.Series([text]))
+    assert n_unrecognized == 1
+    assert pd.isna(post_dates.iloc[0])
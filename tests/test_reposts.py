@@ -0,0 +1,83 @@
+import asyncio
+import random
+
+import openai
+
+import utils
+from fakes import LOREM_WORDS, FakeOpenAIServer
+from utils import (
+    RepostIndex, duckdb, evaluate_jobs_async, open_evaluation_cache, prepare_staging_rows, read_latest_sql,
+    stage_without_llm
+)
+
+EVALUATION = {"match_level": 0.5, "apply": False, "reason": "Synthetic", "model": "fake"}
+
+
+def repost(row, rng, edit_rate=0.05):
+    """The same job under a new job_id, with `edit_rate` of its description words replaced."""
+    words = [rng.choice(LOREM_WORDS) if rng.random() < edit_rate else word for word in row["job_description"].split()]
+    return {**row, "job_id": f"repost{row['job_id']}", "job_description": " ".join(words)}
+
+
+def test_edited_reposts_are_found_with_the_defaults(tmp_path, make_jobs):
+    rng = random.Random(0)
+    history_df = make_jobs(100, seed=1)
+    reposts_df = utils.pd.DataFrame([repost(row, rng) for row in history_df.head(50).to_dict("records")])
+    new_df = make_jobs(50, seed=2).assign(job_id=lambda df: "new" + df["job_id"])
+
+    index = RepostIndex(str(tmp_path / "reposts.sqlite"))
+    index.put_many(history_df, {i: EVALUATION for i in history_df.index})
+    found = index.find_many(reposts_df)
+    assert len(found) == len(reposts_df)
+    assert all(found[i]["repost_of"] == reposts_df.at[i, "job_id"][len("repost"):] for i in found)
+    assert index.find_many(new_df) == {}
+    index.close()
+
+
+def test_index_of_other_minhash_settings_is_emptied(tmp_path, make_jobs, monkeypatch):
+    jobs_df = make_jobs(10)
+    path = str(tmp_path / "reposts.sqlite")
+    index = RepostIndex(path)
+    index.put_many(jobs_df, {i: EVALUATION for i in jobs_df.index})
+    index.close()
+
+    assert len(RepostIndex(path)) == len(jobs_df)
+    monkeypatch.setattr(utils, "MINHASH_SHINGLE_SIZE", utils.MINHASH_SHINGLE_SIZE + 1)
+    # Its signatures are not comparable anymore, open_repost_index builds it again
+    assert len(RepostIndex(path)) == 0
+
+
+def test_near_duplicates_in_one_batch_are_evaluated_once(tmp_path, make_jobs):
+    rng = random.Random(0)
+    jobs_df = make_jobs(10)
+    jobs_df = utils.pd.concat([
+        jobs_df, utils.pd.DataFrame([repost(row, rng) for row in jobs_df.head(4).to_dict("records")])
+    ], ignore_index=True)
+    staging_path = str(tmp_path / "staging")
+
+    cache = open_evaluation_cache(staging_path)
+    index = RepostIndex(str(tmp_path / "reposts.sqlite"))
+    jobs_df = prepare_staging_rows(jobs_df)
+    pending_df, _ = stage_without_llm(jobs_df, staging_path, cache, prefilter_threshold=None, reposts=index)
+    assert len(pending_df) == 10
+
+    async def run():
+        with FakeOpenAIServer() as server:
+            client = openai.AsyncOpenAI(base_url=server.base_url, api_key="fake", max_retries=0)
+            try:
+                await evaluate_jobs_async(pending_df, staging_path, concurrency=2, client=client,
+                                          cache=cache, reposts=index)
+            finally:
+                await client.close()
+            return server.counts
+
+    counts = asyncio.run(run())
+    cache.close()
+    index.close()
+
+    assert counts["responses"] == 10
+    staged = dict(duckdb.query(f"SELECT job_id, repost_of FROM {read_latest_sql(staging_path)}").fetchall())
+    assert len(staged) == 14
+    assert {job_id: original for job_id, original in staged.items() if original} == {
+        f"repost{job_id}": job_id for job_id in jobs_df["job_id"].head(4)
+    }
@@ -0,0 +1,76 @@
+import glob
+import os
+
+import pandas as pd
+import pytest
+
+from utils import (
+    RAW_SCHEMA, append_dataset, apply_retention, conform_table, duckdb, pa, partition_dates, read_dataset_sql,
+    write_dataset_file
+)
+
+RETENTION_DAYS = 90
+
+
+@pytest.fixture
+def dataset(tmp_path, make_jobs):
+    """Raw dataset with partitions 200, 90, 89 and 0 days old, and a file written before partitioning."""
+    path = str(tmp_path / "raw")
+    today = pd.Timestamp.now().floor("D")
+    for days in (200, 90, 89, 0):
+        jobs_df = make_jobs(5, seed=days)
+        jobs_df["job_id"] = f"{days}days-" + jobs_df["job_id"]
+        jobs_df["datetime"] = today - pd.Timedelta(days=days) + pd.Timedelta(hours=12)
+        append_dataset(jobs_df, path, RAW_SCHEMA, "raw")
+
+    legacy_df = make_jobs(4, seed=1).assign(datetime=today - pd.Timedelta(days=300))
+    legacy_df["job_id"] = "legacy-" + legacy_df["job_id"]
+    write_dataset_file(conform_table(pa.Table.from_pandas(legacy_df, preserve_index=False), RAW_SCHEMA), path, "raw")
+    return path
+
+
+def job_ids(path):
+    return {job_id for (job_id,) in duckdb.query(f"SELECT job_id FROM {read_dataset_sql(path)}").fetchall()}
+
+
+def groups(path):
+    """Number of rows of each group of job_ids, the part of the job_id before the dash."""
+    rows = duckdb.query(f"SELECT split_part(job_id, '-', 1), count(*) FROM {read_dataset_sql(path)} GROUP BY 1")
+    return dict(rows.fetchall())
+
+
+def dates(days):
+    today = pd.Timestamp.now().floor("D")
+    return [(today - pd.Timedelta(days=d)).strftime("%Y-%m-%d") for d in days]
+
+
+def test_retention_drops_old_partitions(dataset):
+    removed = apply_retention(dataset, RETENTION_DAYS)
+
+    assert removed == 10
+    assert partition_dates(dataset) == dates([89, 0])
+    # Files written before partitioning are left for compact_dataset
+    assert len(glob.glob(os.path.join(dataset, "*.parquet"))) == 1
+    assert groups(dataset) == {"89days": 5, "0days": 5, "legacy": 4}
+
+
+def test_retention_archives_old_partitions(dataset, tmp_path):
+    archive = str(tmp_path / "archive" / "raw")
+    before = job_ids(dataset)
+
+    removed = apply_retention(dataset, RETENTION_DAYS, archive)
+
+    assert removed == 10
+    assert partition_dates(dataset) == dates([89, 0])
+    assert partition_dates(archive) == dates([200, 90])
+    assert groups(archive) == {"200days": 5, "90days": 5}
+    assert len(glob.glob(os.path.join(dataset, "*.parquet"))) == 1
+    # Nothing is lost, every row is in the dataset or the archive
+    assert job_ids(dataset) | job_ids(archive) == before
+    assert not job_ids(dataset) & job_ids(archive)
+
+
+def test_retention_without_days_keeps_everything(dataset):
+    before = job_ids(dataset)
+    assert apply_retention(dataset, 0) == 0
+    assert job_ids(dataset) == before
@@ -0,0 +1,86 @@
+import pandas as pd
+
+from utils import (
+    LEDGER_COLUMNS, RAW_SCHEMA, TextStore, append_dataset, append_ledger, compact_dataset, compact_ledger, conform_table,
+    duckdb, get_text_store, pa, read_latest_sql, with_descriptions, write_dataset_file
+)
+
+
+def test_text_store_round_trip(tmp_path):
+    store = TextStore(str(tmp_path / "texts.sqlite"))
+    texts = ["first description", "second description", "first description", None]
+
+    keys = store.put_many(texts)
+    assert keys[0] == keys[2] and keys[3] is None
+    # The same text is kept once
+    assert len(store) == 2
+    assert store.get_many(keys) == {keys[0]: texts[0], keys[1]: texts[1]}
+    assert store.get("unknown") is None
+    store.close()
+
+    reopened = TextStore(str(tmp_path / "texts.sqlite"))
+    assert reopened.get(keys[1]) == texts[1]
+    reopened.close()
+
+
+def read_descriptions(path):
+    jobs_df = duckdb.query(f"SELECT * FROM {read_latest_sql(path, schema=RAW_SCHEMA)}").to_df()
+    return dict(zip(jobs_df["job_id"], with_descriptions(jobs_df)["job_description"]))
+
+
+def test_descriptions_survive_compaction(tmp_path, make_jobs):
+    path = str(tmp_path / "raw")
+    jobs_df = make_jobs(10)
+    expected = dict(zip(jobs_df["job_id"], jobs_df["job_description"]))
+
+    # Written before the text store: the description inline and no description_key column
+    legacy_schema = pa.schema([field for field in RAW_SCHEMA if field.name != "description_key"])
+    legacy_table = conform_table(pa.Table.from_pandas(jobs_df.head(5), preserve_index=False), legacy_schema)
+    write_dataset_file(legacy_table, path, "raw")
+    # Written since: the description moved to the text store
+    append_dataset(jobs_df.tail(5), path, RAW_SCHEMA, "raw")
+    assert len(get_text_store()) == 5
+
+    assert read_descriptions(path) == expected
+
+    compact_dataset(path, RAW_SCHEMA, "raw")
+    # Compaction moves the inline descriptions to the store and leaves only keys in the files
+    assert len(get_text_store()) == 10
+    inline = duckdb.query(
+        f"SELECT count(*) FROM {read_latest_sql(path)} WHERE job_description IS NOT NULL OR description_key IS NULL"
+    ).fetchone()[0]
+    assert inline == 0
+    assert read_descriptions(path) == expected
+
+
+def test_old_ledger_is_slimmed_to_ledger_columns(tmp_path, make_jobs):
+    path = str(tmp_path / "jobs-sent.csv")
+    old_df = make_jobs(3)[["job_id", "job_title", "job_description", "job_link"]]
+    old_df.to_csv(path, index=False)
+
+    new_rows = make_jobs(5).tail(2).to_dict("records")
+    append_ledger(path, new_rows, "sent")
+
+    ledger_df = pd.read_csv(path, dtype=str)
+    assert list(ledger_df.columns) == LEDGER_COLUMNS
+    # Zero-prefixed job_ids are kept as written
+    assert list(ledger_df["job_id"]) == list(old_df["job_id"]) + [row["job_id"] for row in new_rows]
+    assert ledger_df["decision"].isna().sum() == 3
+    assert (ledger_df["decision"].tail(2) == "sent").all()
+    assert ledger_df["recorded_at"].tail(2).notna().all()
+
+    # Already slim, compaction leaves it as it is
+    compact_ledger(path)
+    assert pd.read_csv(path, dtype=str).equals(ledger_df)
+
+
+def test_compact_ledger_slims_an_old_ledger(tmp_path, make_jobs):
+    path = str(tmp_path / "jobs-applied.csv")
+    old_df = make_jobs(4)[["job_id", "job_title", "job_description"]]
+    old_df.to_csv(path, index=False)
+
+    compact_ledger(path)
+
+    ledger_df = pd.read_csv(path, dtype=str)
+    assert list(ledger_df.columns) == LEDGER_COLUMNS
+    assert list(ledger_df["job_id"]) == list(old_df["job_id"])
@@ -0,0 +1,27 @@
+import pandas as pd
+
+from utils import STAGING_SCHEMA, LEDGER_COLUMNS, append_dataset, iter_unsent_jobs, sent_ledger_path
+
+
+def test_exclude_last_sends_the_latest_ledger_rows_again(tmp_path, make_jobs):
+    staging_path, sent_path = str(tmp_path / "staging"), str(tmp_path / "sent")
+    jobs_df = make_jobs(30)
+    jobs_df["match_level"] = 0.9
+    jobs_df["apply"] = True
+    jobs_df["reason"] = "Matches the profile."
+    jobs_df["model"] = "test"
+    append_dataset(jobs_df, staging_path, STAGING_SCHEMA, "staging")
+
+    # Three appends of 10 jobs, one per minute
+    job_ids = list(jobs_df["job_id"])
+    ledger_df = pd.DataFrame({
+        "job_id": job_ids,
+        "recorded_at": [pd.Timestamp("2026-01-01 10:00") + pd.Timedelta(minutes=i // 10) for i in range(30)],
+        "decision": "sent",
+    })[LEDGER_COLUMNS]
+    (tmp_path / "sent").mkdir()
+    ledger_df.to_csv(sent_ledger_path(sent_path), index=False)
+
+    assert list(iter_unsent_jobs(staging_path, sent_path)) == []
+    resent = {row["job_id"] for row in iter_unsent_jobs(staging_path, sent_path, exclude_last=10)}
+    assert resent == set(job_ids[20:])
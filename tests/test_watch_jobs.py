@@ -0,0 +1,29 @@
+import asyncio
+
+import pytest
+
+
+def test_watch_jobs_keeps_polling_after_a_failed_run(bot, monkeypatch):
+    runs = []
+    sleeps = []
+
+    async def failing_run_core(channel, *args, **kwargs):
+        runs.append(kwargs)
+        if len(runs) > 2:
+            # Stops the loop, like the bot shutting down
+            raise asyncio.CancelledError
+        raise RuntimeError("browser launch failed")
+
+    async def fake_sleep(seconds):
+        sleeps.append(seconds)
+
+    monkeypatch.setattr(bot, "run_core", failing_run_core)
+    monkeypatch.setattr(bot.asyncio, "sleep", fake_sleep)
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(bot.watch_jobs(channel=None))
+
+    assert len(runs) == 3
+    assert all(run["only_due"] for run in runs)
+    assert sleeps == [bot.SCRAPE_OPTIONS["poll_min_interval"]] * 2
+    assert bot.get_metrics().counts["pipeline_errors"] == 2